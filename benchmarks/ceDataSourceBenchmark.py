@@ -0,0 +1,78 @@
+"""
+Compare the time taken to build a transaction from the rows of a data set
+with the time taken to extract the arguments for those rows with the
+generated extractors and with the generic _GetArgsFromNames() method.
+
+    python benchmarks/ceDataSourceBenchmark.py [numRows ...]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ceDatabase
+import ceDataSource
+
+class Order(ceDatabase.Row):
+    attrNames = "orderId"
+
+
+class OrderLineDataSet(ceDatabase.DataSet):
+    tableName = "OrderLines"
+    attrNames = "id orderId description quantity shipped notes"
+    pkAttrNames = "id"
+    charBooleanAttrNames = "shipped"
+    clobAttrNames = "notes"
+
+
+def TimeCall(method, *args):
+    startTime = time.perf_counter()
+    method(*args)
+    return time.perf_counter() - startTime
+
+
+def BestTime(method, *args):
+    return min(TimeCall(method, *args) for i in range(3))
+
+
+def BuildTransaction(methodName, dataSet, rows):
+    transaction = ceDataSource.Transaction()
+    method = getattr(transaction, methodName)
+    for row in rows:
+        if methodName == "ModifyRow":
+            method(dataSet, row, row)
+        else:
+            method(dataSet, row)
+
+
+def ExtractArgs(dataSet, rows):
+    for row in rows:
+        dataSet._GetArgs("insert", row)
+
+
+def ExtractArgsFromNames(dataSet, rows):
+    names = dataSet.insertAttrNames
+    for row in rows:
+        dataSet._GetArgsFromNames(names, row)
+
+
+def Run(numRows):
+    dataSet = OrderLineDataSet(None, Order(1))
+    rows = [OrderLineDataSet.rowClass(i, 1, "Line %d" % i, i, i % 2 == 0,
+            "Notes") for i in range(numRows)]
+    transactionTimes = [BestTime(BuildTransaction, n, dataSet, rows) \
+            for n in ("CreateRow", "ModifyRow", "RemoveRow")]
+    argTimes = [BestTime(m, dataSet, rows) \
+            for m in (ExtractArgs, ExtractArgsFromNames)]
+    print("%10d   %8.3fs %8.3fs %8.3fs   %8.3fs / %8.3fs" % \
+            ((numRows,) + tuple(transactionTimes) + tuple(argTimes)))
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000]
+    print("      rows      create    modify    remove   "
+            "args generated / by name")
+    for numRows in sizes:
+        Run(numRows)
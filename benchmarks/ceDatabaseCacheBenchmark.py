@@ -0,0 +1,102 @@
+"""
+Compare the number of queries executed and the time taken when many threads
+request the same keys from a cache with and without thread safe mode, as well
+as the time taken by a hit. Each query is delayed to simulate a round trip to
+the database.
+
+    python benchmarks/ceDatabaseCacheBenchmark.py [numThreads [delay]]
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ceDatabase
+import ceDatabaseCache
+import ceDataSource
+
+NUM_KEYS = 50
+NUM_HITS = 200000
+
+class DataSource(ceDataSource.ODBCDataSource):
+    delay = 0.005
+
+    def __init__(self, connection):
+        super(DataSource, self).__init__(connection)
+        self.lock = threading.Lock()
+        self.numQueries = 0
+
+    def GetRowsDirect(self, sql, args = None, rowFactory = None):
+        time.sleep(self.delay)
+        with self.lock:
+            self.numQueries += 1
+            cursor = self.connection.cursor()
+            cursor.execute(sql, args or [])
+            rows = cursor.fetchall()
+        if rowFactory is not None:
+            rows = [rowFactory(*r) for r in rows]
+        return rows
+
+
+class Code(ceDatabase.Row):
+    tableName = "Codes"
+    attrNames = "id code"
+    pkAttrNames = "id"
+
+
+def CreateCache(connection, threadSafe):
+
+    class Cache(ceDatabaseCache.Cache):
+
+        class Codes(ceDatabaseCache.SubCache):
+            rowClass = Code
+            cacheAttrName = "codes"
+
+            class ById(ceDatabaseCache.SingleRowPath):
+                retrievalAttrNames = "id"
+                cacheAttrName = "CodeById"
+
+    Cache.threadSafe = threadSafe
+    return Cache(DataSource(connection))
+
+
+def Run(connection, numThreads, threadSafe):
+    cache = CreateCache(connection, threadSafe)
+    barrier = threading.Barrier(numThreads)
+
+    def Work():
+        barrier.wait()
+        for key in range(NUM_KEYS):
+            cache.CodeById(key)
+
+    threads = [threading.Thread(target = Work) for i in range(numThreads)]
+    startTime = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - startTime
+    startTime = time.perf_counter()
+    for i in range(NUM_HITS):
+        cache.CodeById(5)
+    hitTime = (time.perf_counter() - startTime) / NUM_HITS * 1e9
+    print("%10s   %7d   %8.3fs   %6.0fns" % \
+            (threadSafe, cache.dataSource.numQueries, elapsed, hitTime))
+
+
+if __name__ == "__main__":
+    numThreads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    if len(sys.argv) > 2:
+        DataSource.delay = float(sys.argv[2])
+    connection = sqlite3.connect(":memory:", check_same_thread = False)
+    connection.execute("create table Codes (id integer primary key, "
+            "code text)")
+    connection.executemany("insert into Codes values (?, ?)",
+            [(i, "C%d" % i) for i in range(NUM_KEYS)])
+    print("threadSafe   queries    elapsed        hit")
+    for threadSafe in (False, True):
+        Run(connection, numThreads, threadSafe)
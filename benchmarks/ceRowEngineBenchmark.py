@@ -0,0 +1,70 @@
+"""
+Compare the time taken by the in memory join and group by operations of
+ceRowEngine over rows and over columns: orders are joined to customers on an
+integer key and grouped by customer.
+
+    python benchmarks/ceRowEngineBenchmark.py [numRows ...]
+"""
+
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ceDatabase
+import ceRowEngine
+
+class Order(ceDatabase.Row):
+    attrNames = "id customerId amount"
+
+
+class Customer(ceDatabase.Row):
+    attrNames = "customerId region"
+
+
+def CreateData(numRows):
+    """Return the orders and customers as rows and as columns."""
+    random = numpy.random.default_rng(1)
+    numCustomers = numRows // 10 + 1
+    customerIds = random.integers(0, numCustomers, numRows)
+    amounts = random.random(numRows) * 100
+    orderColumns = ceRowEngine.Columns(id = numpy.arange(numRows),
+            customerId = customerIds, amount = amounts)
+    customerColumns = ceRowEngine.Columns(
+            customerId = numpy.arange(0, numCustomers, 2),
+            region = numpy.array(["R%d" % (i % 7) \
+                    for i in range(0, numCustomers, 2)], dtype = object))
+    orders = [Order(i, int(c), float(a)) \
+            for i, (c, a) in enumerate(zip(customerIds, amounts))]
+    customers = [Customer(int(c), r) \
+            for c, r in zip(customerColumns["customerId"],
+                    customerColumns["region"])]
+    return orders, customers, orderColumns, customerColumns
+
+
+def TimeCall(method, *args, **kwargs):
+    startTime = time.perf_counter()
+    method(*args, **kwargs)
+    return time.perf_counter() - startTime
+
+
+def Run(numRows):
+    orders, customers, orderColumns, customerColumns = CreateData(numRows)
+    joinTimes = [TimeCall(ceRowEngine.HashJoin, l, r, "customerId") \
+            for l, r in ((orders, customers),
+                    (orderColumns, customerColumns))]
+    groupTimes = [TimeCall(ceRowEngine.GroupBy, o, "customerId",
+            total = ("sum", "amount"), count = ("count", None)) \
+            for o in (orders, orderColumns)]
+    print("%10d   %8.3fs / %8.3fs   %8.3fs / %8.3fs" % \
+            ((numRows,) + tuple(joinTimes) + tuple(groupTimes)))
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000, 1000000]
+    print("      rows   join rows / columns     group by rows / columns")
+    for numRows in sizes:
+        Run(numRows)
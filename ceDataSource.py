@@ -3,9 +3,164 @@ Define classes for accessing data sources in a generic fashion (and may not be
 connected directly but indirectly through a web service, for example).
 """
 
+import concurrent.futures
+import copy
 import cx_Exceptions
+import datetime
+import decimal
+
+class _ArrayBuilder(object):
+    """Builds NumPy arrays (one per column or a single structured array) from
+       chunks of rows, growing preallocated arrays as needed."""
+    initialSize = 1024
+
+    def __init__(self, columnNames, dtypes = None, converters = None,
+            structured = False):
+        import numpy
+        self.numpy = numpy
+        self.columnNames = columnNames
+        self.dtypes = [None] * len(columnNames)
+        if dtypes is not None:
+            self.dtypes = [dtypes.get(n) for n in columnNames]
+        self.inferred = [d is None for d in self.dtypes]
+        self.nullOnly = [False] * len(columnNames)
+        self.converters = [None] * len(columnNames)
+        if converters is not None:
+            self.converters = [converters.get(n) for n in columnNames]
+        self.structured = structured
+        self.arrays = None
+        self.numRows = 0
+
+    def _Allocate(self, size):
+        numpy = self.numpy
+        if self.structured:
+            dtype = list(zip(self.columnNames, self.dtypes))
+            self.array = numpy.zeros(size, dtype = dtype)
+            self.arrays = [self.array[n] for n in self.columnNames]
+        else:
+            self.arrays = [numpy.zeros(size, dtype = d) for d in self.dtypes]
+
+    def _ChangeType(self, columnIndex, dtype):
+        oldArrays = self.arrays
+        self.dtypes[columnIndex] = dtype
+        if self.structured:
+            self._Allocate(len(self.array))
+            for oldArray, array in zip(oldArrays, self.arrays):
+                array[:] = oldArray
+        else:
+            oldArray = oldArrays[columnIndex]
+            self.arrays[columnIndex] = oldArray.astype(dtype)
+
+    def _GetCombinedType(self, dtype, values):
+        """Return the type needed to hold both the values already stored in
+           an array of the given type and the new values."""
+        valuesType = self._GetType(values)
+        if valuesType is None:
+            return dtype
+        valuesType = self.numpy.dtype(valuesType)
+        if valuesType == dtype or dtype.kind == "O":
+            return dtype
+        if dtype.kind == "f" and valuesType.kind == "i":
+            return dtype
+        if dtype.kind == "i" and valuesType.kind == "f":
+            return valuesType
+        if dtype.kind == "M" and valuesType.kind == "M":
+            return self.numpy.dtype("datetime64[us]")
+        return self.numpy.dtype(object)
+
+    def _GetType(self, values):
+        """Return the type of array needed to hold all of the values (or None
+           if all of the values are None)."""
+        types = set(type(v) for v in values)
+        types.discard(type(None))
+        if not types:
+            return None
+        if all(issubclass(t, bool) for t in types):
+            return bool
+        if any(issubclass(t, bool) for t in types):
+            return object
+        if all(issubclass(t, int) for t in types):
+            return self.numpy.int64
+        if all(issubclass(t, (int, float, decimal.Decimal)) for t in types):
+            return self.numpy.float64
+        if all(issubclass(t, datetime.date) for t in types):
+            if any(issubclass(t, datetime.datetime) for t in types):
+                return "datetime64[us]"
+            return "datetime64[D]"
+        return object
+
+    def _SetFirstType(self, columnIndex, values):
+        """Set the type of a column which only held nulls so far from the
+           type of the first values which are not null; integers and
+           booleans become floats and objects so that nulls can be held."""
+        dtype = self._GetType(values)
+        if dtype is None:
+            return
+        self.nullOnly[columnIndex] = False
+        dtype = self.numpy.dtype(dtype)
+        if dtype.kind == "b":
+            return
+        if dtype.kind in "iu":
+            dtype = self.numpy.dtype(self.numpy.float64)
+        self._ChangeType(columnIndex, dtype)
+
+    def _Resize(self, size):
+        if self.structured:
+            self.array.resize(size, refcheck = False)
+            self.arrays = [self.array[n] for n in self.columnNames]
+        else:
+            for array in self.arrays:
+                array.resize(size, refcheck = False)
+
+    def AddRows(self, rows):
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        for columnIndex, converter in enumerate(self.converters):
+            if converter is not None:
+                columns[columnIndex] = [converter(v) \
+                        for v in columns[columnIndex]]
+        if self.arrays is None:
+            for columnIndex, values in enumerate(columns):
+                if self.dtypes[columnIndex] is None:
+                    dtype = self._GetType(values)
+                    self.nullOnly[columnIndex] = dtype is None
+                    self.dtypes[columnIndex] = dtype or object
+            self._Allocate(max(self.initialSize, len(rows)))
+        size = len(self.arrays[0])
+        if self.numRows + len(rows) > size:
+            self._Resize(max(size * 2, self.numRows + len(rows)))
+        endRow = self.numRows + len(rows)
+        for columnIndex, values in enumerate(columns):
+            if self.nullOnly[columnIndex]:
+                self._SetFirstType(columnIndex, values)
+            if self.inferred[columnIndex]:
+                dtype = self.arrays[columnIndex].dtype
+                newDtype = self._GetCombinedType(dtype, values)
+                if newDtype != dtype:
+                    self._ChangeType(columnIndex, newDtype)
+            kind = self.arrays[columnIndex].dtype.kind
+            if kind in "biu" and None in values:
+                dtype = object if kind == "b" else self.numpy.float64
+                self._ChangeType(columnIndex, dtype)
+            self.arrays[columnIndex][self.numRows:endRow] = values
+        self.numRows = endRow
+
+    def GetResult(self):
+        if self.arrays is None:
+            self._Allocate(0)
+        self._Resize(self.numRows)
+        if self.structured:
+            return self.array
+        return dict(zip(self.columnNames, self.arrays))
+
 
 class DataSource(object):
+    maxBindParameters = 999
+    hashPartitionTypes = (int, decimal.Decimal)
+
+    def AcquireDataSource(self):
+        return self
 
     def BeginTransaction(self):
         return Transaction()
@@ -19,6 +174,76 @@ class DataSource(object):
     def CommitTransaction(self, transaction):
         raise NotImplementedError
 
+    def GetArrays(self, _tableName, _columnNames, _dtypes = None,
+            _converters = None, _structured = False, **_conditions):
+        """Return the values of the given columns as NumPy arrays, either as
+           a dictionary of arrays keyed by column name or as a single
+           structured array. The types of the arrays are taken from the
+           dictionary of dtypes if specified or inferred from the data."""
+        sql, args = self.GetSqlAndArgs(_tableName, _columnNames, **_conditions)
+        builder = _ArrayBuilder(_columnNames, _dtypes, _converters,
+                _structured)
+        self._FetchArrays(sql, args, builder)
+        return builder.GetResult()
+
+    def _FetchArrays(self, sql, args, builder):
+        builder.AddRows(self.GetRowsDirect(sql, args))
+
+    def GetMaximumValue(self, _tableName, _columnName, **_conditions):
+        """Return the maximum value of the column (None if no rows match)."""
+        sql = "select max(%s) from %s" % (_columnName, _tableName)
+        whereClause, args = self.GetWhereClauseAndArgs(**_conditions)
+        if whereClause is not None:
+            sql += " where " + whereClause
+        (maxValue,), = self.GetRowsDirect(sql, args)
+        return maxValue
+
+    def GetPartitionConditions(self, _tableName, _columnName,
+            _numPartitions, _method = "range", **_conditions):
+        """Return the conditions for each partition of the rows matching the
+           conditions, which together select each row exactly once. Range
+           partitions require numeric or date values and hash partitions
+           require values of one of the types in hashPartitionTypes; rows
+           with a null value are selected by the first partition."""
+        if _method not in ("hash", "range"):
+            raise ValueError("unsupported partition method %r" % _method)
+        sql = "select min(%s), max(%s) from %s" % \
+                (_columnName, _columnName, _tableName)
+        whereClause, args = self.GetWhereClauseAndArgs(**_conditions)
+        if whereClause is not None:
+            sql += " where " + whereClause
+        (minValue, maxValue), = self.GetRowsDirect(sql, args)
+        partitions = [{ _columnName : None }]
+        if minValue is None:
+            return partitions
+        if _method == "hash":
+            if not isinstance(minValue, self.hashPartitionTypes):
+                raise ValueError("column %s has values of type %s which "
+                        "cannot be partitioned by hash" % \
+                        (_columnName, type(minValue).__name__))
+            name = "%s__hash" % _columnName
+            partitions.extend({ name : (_numPartitions, i) } \
+                    for i in range(_numPartitions))
+            return partitions
+        try:
+            step = (maxValue - minValue) / _numPartitions
+        except TypeError:
+            raise ValueError("column %s has values of type %s which cannot "
+                    "be partitioned by range" % \
+                    (_columnName, type(minValue).__name__))
+        if isinstance(minValue, int) and isinstance(maxValue, int):
+            step = max(1, (maxValue - minValue) // _numPartitions)
+        lowerName = "%s__gte" % _columnName
+        upperName = "%s__lt" % _columnName
+        lowerValue = minValue
+        for i in range(_numPartitions):
+            partition = { lowerName : lowerValue }
+            if i < _numPartitions - 1:
+                lowerValue = minValue + step * (i + 1)
+                partition[upperName] = lowerValue
+            partitions.append(partition)
+        return partitions
+
     def GetSqlAndArgs(self, tableName, columnNames, **conditions):
         raise NotImplementedError
 
@@ -43,12 +268,37 @@ class DataSource(object):
     def GetRowsDirect(self, sql, args, rowFactory = None):
         raise NotImplementedError
 
+    def GetRowsParallel(self, _tableName, _columnNames, _rowFactory,
+            _partitions, **_conditions):
+        rows = []
+        for partitionConditions in _partitions:
+            conditions = self._MergePartitionConditions(_conditions,
+                    partitionConditions)
+            rows.extend(self.GetRows(_tableName, _columnNames, _rowFactory,
+                    **conditions))
+        return rows
+
+    def ReleaseDataSource(self, dataSource):
+        pass
+
+    def _MergePartitionConditions(self, conditions, partitionConditions):
+        for name in partitionConditions:
+            if name in conditions:
+                raise ValueError("condition %r conflicts with partition" % \
+                        name)
+        conditions = conditions.copy()
+        conditions.update(partitionConditions)
+        return conditions
+
 
 class DatabaseDataSource(DataSource):
+    procedureBatchSize = 1
+    arrayFetchSize = 5000
 
-    def __init__(self, connection):
+    def __init__(self, connection, connectionPool = None):
         self.connection = connection
         self.cursor = connection.cursor()
+        self.connectionPool = connectionPool
 
     def __enter__(self):
         return self.cursor
@@ -72,6 +322,18 @@ class DatabaseDataSource(DataSource):
     def _GetEmptyArgs(self):
         raise NotImplementedError
 
+    def _GetProcedureBatch(self, items, startIndex):
+        item = items[startIndex]
+        batch = [item]
+        for nextItem in items[startIndex + 1:]:
+            if len(batch) >= self.procedureBatchSize \
+                    or not item._CanBatchWith(nextItem):
+                break
+            if any(i in batch for i in nextItem.referencedItems):
+                break
+            batch.append(nextItem)
+        return batch
+
     def _TransactionCallProcedure(self, cursor, item):
         args = self._TransactionSetupPositionalArgs(cursor, item.args,
                 item.clobArgs, item.blobArgs, item.fkArgs,
@@ -82,6 +344,10 @@ class DatabaseDataSource(DataSource):
         else:
             cursor.callproc(item.procedureName, args)
 
+    def _TransactionCallProcedures(self, cursor, items):
+        for item in items:
+            self._TransactionCallProcedure(cursor, item)
+
     def _TransactionDeleteRow(self, cursor, item):
         whereClause, args = self.GetWhereClauseAndArgs(**item.conditions)
         sql = "delete from %s" % item.tableName
@@ -124,6 +390,33 @@ class DatabaseDataSource(DataSource):
             args[attrIndex] = referencedItem.generatedKey
         return args
 
+    def _FetchArrays(self, sql, args, builder):
+        cursor = self.connection.cursor()
+        cursor.arraysize = self.arrayFetchSize
+        cursor.execute(sql, args)
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            builder.AddRows(rows)
+
+    def _GetPartitionRows(self, tableName, columnNames, rowFactory,
+            conditions):
+        dataSource = self.AcquireDataSource()
+        try:
+            return dataSource.GetRows(tableName, columnNames, rowFactory,
+                    **conditions)
+        finally:
+            self.ReleaseDataSource(dataSource)
+
+    def AcquireDataSource(self):
+        if self.connectionPool is None:
+            return self
+        dataSource = copy.copy(self)
+        dataSource.connection = self.connectionPool.Get()
+        dataSource.cursor = dataSource.connection.cursor()
+        return dataSource
+
     def CallFunction(self, functionName, returnType, *args):
         return self.cursor.callfunc(functionName, returnType, args)
 
@@ -133,9 +426,18 @@ class DatabaseDataSource(DataSource):
     def CommitTransaction(self, transaction):
         with self.connection:
             cursor = self.connection.cursor()
-            for item in transaction.items:
+            items = transaction.items
+            itemIndex = 0
+            while itemIndex < len(items):
+                item = items[itemIndex]
+                itemIndex += 1
                 if item.procedureName is not None:
-                    self._TransactionCallProcedure(cursor, item)
+                    batch = self._GetProcedureBatch(items, itemIndex - 1)
+                    itemIndex += len(batch) - 1
+                    if len(batch) > 1:
+                        self._TransactionCallProcedures(cursor, batch)
+                    else:
+                        self._TransactionCallProcedure(cursor, item)
                 elif item.setValues is not None and item.conditions is None:
                     self._TransactionInsertRow(cursor, item)
                 elif item.setValues is not None:
@@ -179,8 +481,33 @@ class DatabaseDataSource(DataSource):
             cursor.rowfactory = rowFactory
         return cursor.fetchall()
 
+    def GetRowsParallel(self, _tableName, _columnNames, _rowFactory,
+            _partitions, **_conditions):
+        if self.connectionPool is None or len(_partitions) < 2:
+            return super(DatabaseDataSource, self).GetRowsParallel(_tableName,
+                    _columnNames, _rowFactory, _partitions, **_conditions)
+        maxWorkers = self.connectionPool.maxResources
+        with concurrent.futures.ThreadPoolExecutor(maxWorkers) as executor:
+            futures = []
+            for partitionConditions in _partitions:
+                conditions = self._MergePartitionConditions(_conditions,
+                        partitionConditions)
+                future = executor.submit(self._GetPartitionRows, _tableName,
+                        _columnNames, _rowFactory, conditions)
+                futures.append(future)
+            rows = []
+            for future in futures:
+                rows.extend(future.result())
+        return rows
+
+    def ReleaseDataSource(self, dataSource):
+        if dataSource is not self:
+            self.connectionPool.Put(dataSource.connection)
+
 
 class OracleDataSource(DatabaseDataSource):
+    procedureBatchSize = 500
+    hashPartitionTypes = (object,)
     operators = {
             "contains" : "like",
             "endswith" : "like",
@@ -216,6 +543,12 @@ class OracleDataSource(DatabaseDataSource):
                 clauseFormat = "regexp_like(%s, '^' || :%s, 'i')"
             elif rawOperator == "endswith":
                 clauseFormat = "regexp_like(%s, :%s || '$', 'i')"
+            elif rawOperator == "hash":
+                numBuckets, bucket = value
+                clause = "ora_hash(%s, %d) = %d" % \
+                        (columnName, numBuckets - 1, bucket)
+                whereClauses.append(clause)
+                return
             elif rawOperator == "in":
                 inClauseParts = []
                 for i, inValue in enumerate(value):
@@ -243,6 +576,40 @@ class OracleDataSource(DatabaseDataSource):
     def _GetEmptyArgs(self):
         return {}
 
+    def _TransactionCallProcedures(self, cursor, items):
+        item = items[0]
+        argNames = ["a%d" % (i + 1) for i in range(len(item.args))]
+        callArgs = ", ".join(":%s" % n for n in argNames)
+        offset = 0
+        returnVar = None
+        inputSizes = {}
+        if item.returnType is not None:
+            offset = 1
+            sql = "begin :r := %s(%s); end;" % (item.procedureName, callArgs)
+            returnVar = cursor.var(item.returnType, arraysize = len(items))
+            inputSizes["r"] = returnVar
+        else:
+            sql = "begin %s(%s); end;" % (item.procedureName, callArgs)
+        for attrIndex in item.clobArgs:
+            inputSizes[argNames[attrIndex - offset]] = self._GetClobType()
+        for attrIndex in item.blobArgs:
+            inputSizes[argNames[attrIndex - offset]] = self._GetBlobType()
+        if inputSizes:
+            cursor.setinputsizes(**inputSizes)
+        rows = []
+        for batchItem in items:
+            args = dict(zip(argNames, batchItem.args))
+            for attrIndex, referencedItem in zip(batchItem.fkArgs,
+                    batchItem.referencedItems):
+                args[argNames[attrIndex]] = referencedItem.generatedKey
+            if returnVar is not None:
+                args["r"] = None
+            rows.append(args)
+        cursor.executemany(sql, rows)
+        if returnVar is not None:
+            for i, batchItem in enumerate(items):
+                batchItem.generatedKey = returnVar.getvalue(i)
+
     def _TransactionInsertRow(self, cursor, item):
         if item.pkSequenceName is not None:
             sql = "select %s.nextval from dual" % item.pkSequenceName
@@ -306,6 +673,18 @@ class ODBCDataSource(DatabaseDataSource):
             elif rawOperator == "ne" and value is None:
                 whereClauses.append("%s is not null" % columnName)
                 return
+            elif rawOperator == "hash":
+                numBuckets, bucket = value
+                clause = "abs(%s %% %d) = %d" % \
+                        (columnName, numBuckets, bucket)
+                whereClauses.append(clause)
+                return
+            elif rawOperator == "in":
+                inClauseParts = ["?" for v in value]
+                clause = "%s in (%s)" % (columnName, ",".join(inClauseParts))
+                whereClauses.append(clause)
+                args.extend(value)
+                return
             else:
                 clauseFormat = "%%s %s ?" % operator
         args.append(value)
@@ -378,7 +757,7 @@ class Transaction(object):
                 and (referencedItem.returnType is not None \
                         or referencedItem.pkSequenceName is not None):
             referencedItems.append(referencedItem)
-        args = dataSet._GetArgsFromNames(dataSet.insertAttrNames, row)
+        args = dataSet._GetInsertArgs(row)
         if dataSet.updatePackageName is not None:
             procedureName = "%s.%s" % \
                     (dataSet.updatePackageName, dataSet.insertProcedureName)
@@ -400,15 +779,15 @@ class Transaction(object):
 
     def ModifyRow(self, dataSet, row, origRow):
         if dataSet.updatePackageName is not None:
-            args = dataSet._GetArgsFromNames(row.pkAttrNames, origRow) + \
-                    dataSet._GetArgsFromNames(dataSet.updateAttrNames, row)
+            args = dataSet._GetPrimaryKeyArgs(origRow) + \
+                    dataSet._GetUpdateArgs(row)
             procedureName = "%s.%s" % \
                     (dataSet.updatePackageName, dataSet.updateProcedureName)
             item = self.AddItem(procedureName = procedureName, args = args)
         else:
-            args = dataSet._GetArgsFromNames(dataSet.updateAttrNames, row)
+            args = dataSet._GetUpdateArgs(row)
             setValues = dict(zip(dataSet.updateAttrNames, args))
-            args = dataSet._GetArgsFromNames(row.pkAttrNames, origRow)
+            args = dataSet._GetPrimaryKeyArgs(origRow)
             conditions = dict(zip(row.pkAttrNames, args))
             item = self.AddItem(tableName = dataSet.updateTableName,
                     setValues = setValues, conditions = conditions)
@@ -417,7 +796,7 @@ class Transaction(object):
         return item
 
     def RemoveRow(self, dataSet, row):
-        args = dataSet._GetArgsFromNames(row.pkAttrNames, row)
+        args = dataSet._GetPrimaryKeyArgs(row)
         if dataSet.updatePackageName is not None:
             procedureName = "%s.%s" % \
                     (dataSet.updatePackageName, dataSet.deleteProcedureName)
@@ -454,6 +833,14 @@ class Transaction(object):
         def __repr__(self):
             return "<TransactionItem: position=%s>" % self.position
 
+        def _CanBatchWith(self, other):
+            return other.procedureName == self.procedureName \
+                    and other.returnType == self.returnType \
+                    and len(other.args) == len(self.args) \
+                    and other.clobArgs == self.clobArgs \
+                    and other.blobArgs == self.blobArgs \
+                    and other.fkArgs == self.fkArgs
+
         def _SetArgType(self, dataSet, row, attrIndex, attrName, offset):
             if attrName in row.clobAttrNames:
                 if self.procedureName is not None:
@@ -474,6 +861,18 @@ class Transaction(object):
 
         def _SetArgTypes(self, dataSet, row, attrNames):
             offset = 1 if self.returnType is not None else 0
-            for attrIndex, attrName in enumerate(attrNames):
-                self._SetArgType(dataSet, row, attrIndex, attrName, offset)
+            key = (tuple(attrNames), row.__class__,
+                    dataSet.contextItem.__class__,
+                    self.procedureName is not None,
+                    bool(self.referencedItems), offset)
+            argTypes = dataSet.argTypes.get(key)
+            if argTypes is None:
+                for attrIndex, attrName in enumerate(attrNames):
+                    self._SetArgType(dataSet, row, attrIndex, attrName, offset)
+                argTypes = (self.clobArgs, self.blobArgs, self.fkArgs)
+                dataSet.argTypes[key] = argTypes
+            clobArgs, blobArgs, fkArgs = argTypes
+            self.clobArgs = list(clobArgs)
+            self.blobArgs = list(blobArgs)
+            self.fkArgs = list(fkArgs)
 
@@ -6,6 +6,35 @@ import cx_Logging
 import datetime
 import decimal
 
+def _GetValueExpression(attrName, getValue):
+    """Helper routine for row metaclass which returns the expression used to
+       convert the raw database value to the value stored in the row."""
+    if attrName in getValue("charBooleanAttrNames"):
+        return '%s in ("Y", "1", True)' % attrName
+    elif attrName in getValue("charDateAttrNames"):
+        return 'datetime.datetime.strptime(%s, "%s") ' \
+                'if isinstance(%s, str) else %s' % \
+                (attrName, getValue("charDateFormat"), attrName, attrName)
+    elif attrName in getValue("decimalAttrNames"):
+        return 'decimal.Decimal(%s) if %s is not None else None' % \
+                (attrName, attrName)
+    elif attrName in getValue("clobAttrNames"):
+        format = '%s if %s is None or isinstance(%s, str) else %s.read()'
+        return format % (attrName, attrName, attrName, attrName)
+    elif attrName in getValue("blobAttrNames"):
+        format = '%s if %s is None or isinstance(%s, bytes) else %s.read()'
+        return format % (attrName, attrName, attrName, attrName)
+    return attrName
+
+
+def _GetSetAttrLine(readOnly, attrName, value):
+    """Helper routine for row metaclass which returns the line of generated
+       code used to set the attribute on a newly created row."""
+    if readOnly:
+        return "    _setattr(self, %r, %s)\n" % (attrName, value)
+    return "    self.%s = %s\n" % (attrName, value)
+
+
 def _NormalizeValue(bases, classDict, name, split = True):
     """Helper routine for row metaclass."""
     value = classDict.get(name)
@@ -20,6 +49,36 @@ def _NormalizeValue(bases, classDict, name, split = True):
     return value
 
 
+def _ReadOnlyEq(self, other):
+    """Equality method for read only rows which compares primary keys."""
+    if other.__class__ is not self.__class__:
+        return NotImplemented
+    if not self.pkAttrNames:
+        return self is other
+    return self.GetPrimaryKeyTuple() == other.GetPrimaryKeyTuple()
+
+
+def _GetLoadedAttrNames(row):
+    """Return the names of the attributes of the row that have been loaded,
+       excluding any deferred attributes that have not been loaded yet."""
+    loader = getattr(row, "_deferredLoader", None)
+    if loader is None:
+        return row.GetAttributeNames()
+    return [n for n in row.GetAttributeNames() if n not in loader.attrNames]
+
+
+def _ReadOnlyHash(self):
+    """Hash method for read only rows which hashes the primary key."""
+    if not self.pkAttrNames:
+        return id(self)
+    return hash(self.GetPrimaryKeyTuple())
+
+
+def _ReadOnlySetAttr(self, name, value = None):
+    """Method which prevents read only rows from being modified."""
+    raise AttributeError("%r object is read only" % self.__class__.__name__)
+
+
 class RowMetaClass(type):
     """Metaclass for rows which automatically builds a constructor function
        which can then be used by ceODBC and cx_Oracle as a row factory."""
@@ -36,10 +95,12 @@ class RowMetaClass(type):
         clobAttrNames = _NormalizeValue(bases, classDict, "clobAttrNames")
         blobAttrNames = _NormalizeValue(bases, classDict, "blobAttrNames")
         pkAttrNames = _NormalizeValue(bases, classDict, "pkAttrNames")
+        _NormalizeValue(bases, classDict, "deferredAttrNames")
         sortByAttrNames = _NormalizeValue(bases, classDict, "sortByAttrNames")
         sortReversed = _NormalizeValue(bases, classDict, "sortReversed")
         reprAttrNames = _NormalizeValue(bases, classDict, "reprAttrNames")
         useSlots = _NormalizeValue(bases, classDict, "useSlots")
+        readOnly = _NormalizeValue(bases, classDict, "readOnly")
         charDateFormat = _NormalizeValue(bases, classDict, "charDateFormat",
                 split = False)
         generateTableName = _NormalizeValue(bases, classDict,
@@ -55,41 +116,76 @@ class RowMetaClass(type):
         classDict["tableName"] = tableName
         if useSlots:
             classDict["__slots__"] = attrNames + extraAttrNames
+            if not any(hasattr(b, "_deferredLoader") for b in bases):
+                classDict["__slots__"].append("_deferredLoader")
+        classDict["_rowFactories"] = {}
         if "reprName" not in classDict:
             classDict["reprName"] = name
+        if readOnly:
+            classDict["__setattr__"] = classDict["__delattr__"] = \
+                    _ReadOnlySetAttr
+            classDict["__eq__"] = _ReadOnlyEq
+            classDict["__hash__"] = _ReadOnlyHash
         initLines = []
         for attrName in attrNames + extraAttrNames:
-            if attrName in charBooleanAttrNames:
-                value = '%s in ("Y", "1", True)' % attrName
-            elif attrName in charDateAttrNames:
-                value = 'datetime.datetime.strptime(%s, "%s") ' \
-                        'if isinstance(%s, str) else %s' % \
-                        (attrName, charDateFormat, attrName, attrName)
-            elif attrName in decimalAttrNames:
-                value = 'decimal.Decimal(%s) if %s is not None else None' % \
-                        (attrName, attrName)
-            elif attrName in clobAttrNames:
-                format = '%s if %s is None or isinstance(%s, str) ' \
-                         'else %s.read()'
-                value = format % (attrName, attrName, attrName, attrName)
-            elif attrName in blobAttrNames:
-                format = '%s if %s is None or isinstance(%s, bytes) ' \
-                         'else %s.read()'
-                value = format % (attrName, attrName, attrName, attrName)
-            else:
-                value = "%s" % attrName
-            initLines.append("    self.%s = %s\n" % (attrName, value))
+            value = _GetValueExpression(attrName, classDict.get)
+            initLines.append(_GetSetAttrLine(readOnly, attrName, value))
         initArgs = attrNames + ["%s = None" % n for n in extraAttrNames]
         if initArgs:
             codeString = "def __init__(self, %s):\n%s" % \
                     (", ".join(initArgs), "".join(initLines))
             code = compile(codeString, "GeneratedClass.py", "exec")
-            exec(code, dict(datetime = datetime, decimal = decimal), classDict)
-        return type.__new__(cls, name, bases, classDict)
+            namespace = dict(datetime = datetime, decimal = decimal,
+                    _setattr = object.__setattr__)
+            exec(code, namespace, classDict)
+        newClass = type.__new__(cls, name, bases, classDict)
+        if readOnly:
+            editableClassDict = dict(readOnly = False, useSlots = False,
+                    __slots__ = [], reprName = classDict["reprName"],
+                    __setattr__ = object.__setattr__,
+                    __delattr__ = object.__delattr__,
+                    __eq__ = object.__eq__, __hash__ = object.__hash__,
+                    readOnlyRowClass = newClass)
+            newClass.editableRowClass = RowMetaClass(name, (newClass,),
+                    editableClassDict)
+        return newClass
 
     def New(cls):
         args = [None] * len(cls.attrNames)
-        return cls(*args)
+        return (cls.editableRowClass or cls)(*args)
+
+    def _GetRowFactory(cls, attrNames):
+        """Return a row factory which accepts only the given attributes (in
+           the order in which they are found in the class attribute names);
+           the remaining attributes are left unset so that they can be loaded
+           on first access."""
+        if attrNames == cls.attrNames:
+            return cls
+        key = tuple(attrNames)
+        factory = cls._rowFactories.get(key)
+        if factory is None:
+            lines = ["    self = cls.__new__(cls)\n"]
+            getValue = lambda n: getattr(cls, n)
+            for attrName in attrNames:
+                value = _GetValueExpression(attrName, getValue)
+                lines.append(_GetSetAttrLine(cls.readOnly, attrName, value))
+            for attrName in cls.extraAttrNames:
+                lines.append(_GetSetAttrLine(cls.readOnly, attrName, "None"))
+            lines.append("    return self\n")
+            codeString = "def factory(%s):\n%s" % \
+                    (", ".join(attrNames), "".join(lines))
+            code = compile(codeString, "GeneratedClass.py", "exec")
+            namespace = dict(cls = cls, datetime = datetime,
+                    decimal = decimal, _setattr = object.__setattr__)
+            exec(code, namespace)
+            factory = cls._rowFactories[key] = namespace["factory"]
+        return factory
+
+
+class Columns(dict):
+    """Dictionary of NumPy arrays keyed by attribute name, one element per
+       row, as returned by Row.GetArrays(); the in memory operations of
+       ceRowEngine use vectorized kernels when given columns."""
 
 
 class Row(object, metaclass = RowMetaClass):
@@ -106,7 +202,12 @@ class Row(object, metaclass = RowMetaClass):
     sortByAttrNames = []
     reprAttrNames = []
     pkAttrNames = []
+    deferredAttrNames = []
+    deferredBatchSize = 500
     useSlots = True
+    readOnly = False
+    editableRowClass = None
+    readOnlyRowClass = None
     generateTableName = True
     sortReversed = False
     schemaName = None
@@ -119,6 +220,15 @@ class Row(object, metaclass = RowMetaClass):
         elif self.pkAttrNames:
             return tuple(getattr(self, n) for n in self.pkAttrNames)
 
+    def __getattr__(self, name):
+        if not name.startswith("_"):
+            loader = getattr(self, "_deferredLoader", None)
+            if loader is not None and name in loader.attrNames:
+                loader.Load()
+                return object.__getattribute__(self, name)
+        raise AttributeError("%r object has no attribute %r" % \
+                (self.__class__.__name__, name))
+
     def __repr__(self):
         reprAttrNames = self.reprAttrNames or self.attrNames
         if reprAttrNames:
@@ -131,19 +241,132 @@ class Row(object, metaclass = RowMetaClass):
         return (cls.tableName, cls.attrNames, conditions)
 
     @classmethod
-    def GetRow(cls, dataSource, **conditions):
+    def _GetQueryInfoForAttrNames(cls, attrNames, conditions):
         tableName, selectNames, queryConditions = \
                 cls.GetQueryInfo(**conditions)
-        row = dataSource.GetRow(tableName, selectNames, cls, **queryConditions)
+        if attrNames != cls.attrNames:
+            selectNames = [selectNames[cls.attrNames.index(n)] \
+                    for n in attrNames]
+        return tableName, selectNames, queryConditions
+
+    @classmethod
+    def _GetSelectAttrNames(cls, attrNames = None):
+        if attrNames is None:
+            if not cls.deferredAttrNames or not cls.pkAttrNames:
+                return cls.attrNames
+            return [n for n in cls.attrNames \
+                    if n not in cls.deferredAttrNames]
+        if isinstance(attrNames, str):
+            attrNames = attrNames.split()
+        return [n for n in cls.attrNames \
+                if n in attrNames or n in cls.pkAttrNames]
+
+    @classmethod
+    def _SetDeferredLoader(cls, dataSource, selectAttrNames, rows):
+        if not rows or not cls.pkAttrNames:
+            return
+        attrNames = [n for n in cls.attrNames if n not in selectAttrNames]
+        if not attrNames:
+            return
+        loader = _DeferredLoader(cls, dataSource, attrNames, rows)
+        for row in rows:
+            object.__setattr__(row, "_deferredLoader", loader)
+
+    @classmethod
+    def GetRow(cls, dataSource, _attrNames = None, **conditions):
+        attrNames = cls._GetSelectAttrNames(_attrNames)
+        tableName, selectNames, queryConditions = \
+                cls._GetQueryInfoForAttrNames(attrNames, conditions)
+        rowFactory = cls._GetRowFactory(attrNames)
+        row = dataSource.GetRow(tableName, selectNames, rowFactory,
+                **queryConditions)
+        cls._SetDeferredLoader(dataSource, attrNames, [row])
         cls.SetExtraAttributes(dataSource, [row])
         return row
 
     @classmethod
-    def GetRows(cls, dataSource, **conditions):
+    def GetRows(cls, dataSource, _attrNames = None, **conditions):
+        attrNames = cls._GetSelectAttrNames(_attrNames)
         tableName, selectNames, queryConditions = \
-                cls.GetQueryInfo(**conditions)
-        rows = dataSource.GetRows(tableName, selectNames, cls,
+                cls._GetQueryInfoForAttrNames(attrNames, conditions)
+        rowFactory = cls._GetRowFactory(attrNames)
+        rows = dataSource.GetRows(tableName, selectNames, rowFactory,
                 **queryConditions)
+        cls._SetDeferredLoader(dataSource, attrNames, rows)
+        cls.SetExtraAttributes(dataSource, rows)
+        if cls.sortByAttrNames:
+            rows.sort(key = cls.SortValue)
+            if cls.sortReversed:
+                rows.reverse()
+        return rows
+
+    @classmethod
+    def GetArrays(cls, dataSource, _attrNames = None, _structured = False,
+            _dtypes = None, **conditions):
+        """Return the values of the given attributes (or all attributes) of
+           the rows matching the conditions as NumPy arrays without creating
+           row objects; the array types are taken from the dictionary of
+           dtypes keyed by attribute name if specified or derived from the
+           metadata of the row class where possible."""
+        attrNames = _attrNames
+        if attrNames is None:
+            attrNames = cls.attrNames
+        elif isinstance(attrNames, str):
+            attrNames = attrNames.split()
+        tableName, selectNames, queryConditions = \
+                cls._GetQueryInfoForAttrNames(attrNames, conditions)
+        dtypes = {}
+        converters = {}
+        getValue = lambda n: getattr(cls, n)
+        for attrName, selectName in zip(attrNames, selectNames):
+            if attrName in cls.charBooleanAttrNames:
+                dtypes[selectName] = bool
+            elif attrName in cls.charDateAttrNames:
+                dtypes[selectName] = "datetime64[us]"
+            elif attrName in cls.decimalAttrNames:
+                dtypes[selectName] = float
+                continue
+            elif attrName in cls.clobAttrNames + cls.blobAttrNames:
+                dtypes[selectName] = object
+            else:
+                continue
+            value = _GetValueExpression(attrName, getValue)
+            converters[selectName] = eval("lambda %s: %s" % (attrName, value),
+                    dict(datetime = datetime, decimal = decimal))
+        if _dtypes is not None:
+            for attrName, selectName in zip(attrNames, selectNames):
+                if attrName in _dtypes:
+                    dtypes[selectName] = _dtypes[attrName]
+        arrays = dataSource.GetArrays(tableName, selectNames, dtypes,
+                converters, _structured, **queryConditions)
+        if _structured:
+            arrays.dtype.names = attrNames
+            return arrays
+        return Columns((n, arrays[s]) for n, s in zip(attrNames, selectNames))
+
+    @classmethod
+    def GetRowsParallel(cls, dataSource, numPartitions,
+            partitionMethod = "range", partitionAttrName = None,
+            **conditions):
+        """Return the rows matching the conditions by splitting the query
+           into partitions (by range or hash of the primary key or the given
+           partition attribute) which are run concurrently on pooled
+           connections of the data source, if any are available."""
+        attrNames = cls._GetSelectAttrNames()
+        tableName, selectNames, queryConditions = \
+                cls._GetQueryInfoForAttrNames(attrNames, conditions)
+        if partitionAttrName is None:
+            partitionAttrName, = cls.pkAttrNames
+        if partitionAttrName in attrNames:
+            columnName = selectNames[attrNames.index(partitionAttrName)]
+        else:
+            columnName = partitionAttrName
+        partitions = dataSource.GetPartitionConditions(tableName, columnName,
+                numPartitions, partitionMethod, **queryConditions)
+        rowFactory = cls._GetRowFactory(attrNames)
+        rows = dataSource.GetRowsParallel(tableName, selectNames, rowFactory,
+                partitions, **queryConditions)
+        cls._SetDeferredLoader(dataSource, attrNames, rows)
         cls.SetExtraAttributes(dataSource, rows)
         if cls.sortByAttrNames:
             rows.sort(key = cls.SortValue)
@@ -156,7 +379,7 @@ class Row(object, metaclass = RowMetaClass):
         pass
 
     def Copy(self):
-        cls = self.__class__
+        cls = self.editableRowClass or self.__class__
         args = [getattr(self, n) for n in cls.attrNames]
         row = cls(*args)
         for name in cls.extraAttrNames:
@@ -164,6 +387,19 @@ class Row(object, metaclass = RowMetaClass):
                 setattr(row, name, getattr(self, name))
         return row
 
+    def Freeze(self):
+        """Return a read only copy of an editable row created from a read
+           only row class (or the row itself if there is no such class)."""
+        cls = self.readOnlyRowClass
+        if cls is None or self.__class__ is cls:
+            return self
+        args = [getattr(self, n) for n in cls.attrNames]
+        row = cls(*args)
+        for name in cls.extraAttrNames:
+            if hasattr(self, name):
+                object.__setattr__(row, name, getattr(self, name))
+        return row
+
     def GetAttributeNames(self):
         return self.attrNames + self.extraAttrNames
 
@@ -189,6 +425,72 @@ class Row(object, metaclass = RowMetaClass):
         return tuple(values)
 
 
+class _DeferredLoader(object):
+    """Loads the deferred attributes of a set of rows retrieved at the same
+       time, in batches by primary key, the first time any one of them is
+       accessed."""
+
+    def __init__(self, rowClass, dataSource, attrNames, rows):
+        self.rowClass = rowClass
+        self.dataSource = dataSource
+        self.attrNames = attrNames
+        self.rows = rows
+
+    def _GetBatchConditions(self, keys):
+        """Return the conditions shared by all of the keys (the primary key
+           attributes which have only one value) and the index of the primary
+           key attribute with the most distinct values, which is retrieved
+           with an in clause; rows which match the conditions but not one of
+           the keys are ignored when the rows are loaded."""
+        valueSets = [set(k[i] for k in keys) \
+                for i in range(len(self.rowClass.pkAttrNames))]
+        inIndex = max(range(len(valueSets)),
+                key = lambda i: len(valueSets[i]))
+        conditions = {}
+        for i, attrName in enumerate(self.rowClass.pkAttrNames):
+            if i != inIndex and len(valueSets[i]) == 1:
+                conditions[attrName] = valueSets[i].pop()
+        return conditions, inIndex
+
+    def _GetRows(self, conditions):
+        cls = self.rowClass
+        attrNames = [n for n in cls.attrNames \
+                if n in self.attrNames or n in cls.pkAttrNames]
+        tableName, selectNames, queryConditions = \
+                cls._GetQueryInfoForAttrNames(attrNames, conditions)
+        rowFactory = cls._GetRowFactory(attrNames)
+        return self.dataSource.GetRows(tableName, selectNames, rowFactory,
+                **queryConditions)
+
+    def Load(self):
+        rows = [r for r in self.rows if r._deferredLoader is self]
+        cls = self.rowClass
+        cx_Logging.Debug("%s: loading deferred attributes %s for %s rows",
+                cls.reprName, self.attrNames, len(rows))
+        rowsByKey = dict((r.GetPrimaryKeyTuple(), r) for r in rows)
+        loadedRows = []
+        conditions, inIndex = self._GetBatchConditions(list(rowsByKey))
+        name = "%s__in" % cls.pkAttrNames[inIndex]
+        values = list(dict.fromkeys(k[inIndex] for k in rowsByKey))
+        batchSize = min(cls.deferredBatchSize,
+                self.dataSource.maxBindParameters - len(conditions))
+        for i in range(0, len(values), batchSize):
+            conditions[name] = values[i:i + batchSize]
+            loadedRows.extend(self._GetRows(conditions))
+        self.rows = []
+        for loadedRow in loadedRows:
+            row = rowsByKey.get(loadedRow.GetPrimaryKeyTuple())
+            if row is not None:
+                for attrName in self.attrNames:
+                    value = getattr(loadedRow, attrName)
+                    object.__setattr__(row, attrName, value)
+        for row in rows:
+            object.__setattr__(row, "_deferredLoader", None)
+            for attrName in self.attrNames:
+                if not hasattr(row, attrName):
+                    object.__setattr__(row, attrName, None)
+
+
 class DataSetMetaClass(type):
     """Metaclass for data sets which sets up the class used for retrieval and
        other data manipulation routines."""
@@ -203,6 +505,7 @@ class DataSetMetaClass(type):
                     clobAttrNames = cls.clobAttrNames,
                     blobAttrNames = cls.blobAttrNames,
                     pkAttrNames = cls.pkAttrNames, useSlots = cls.useSlots,
+                    deferredAttrNames = cls.deferredAttrNames,
                     sortByAttrNames = cls.sortByAttrNames,
                     sortReversed = cls.sortReversed,
                     tableName = cls.tableName)
@@ -229,6 +532,39 @@ class DataSetMetaClass(type):
         if not cls.updateAttrNames:
             cls.updateAttrNames = [n for n in cls.attrNames \
                     if n not in cls.pkAttrNames]
+        cls.argNamesByKind = dict(insert = cls.insertAttrNames,
+                update = cls.updateAttrNames, pk = cls.pkAttrNames)
+        cls.argExtractors = {}
+        cls.argTypes = {}
+
+    def _GenerateArgExtractor(cls, names, row, contextItem):
+        """Generate a function which returns the arguments for the given
+           names, deciding once for the class of the row and context item
+           where each value comes from instead of doing so for each row."""
+        rowAttrNames = []
+        if row is not None:
+            rowAttrNames = getattr(row, "attrNames", []) + \
+                    getattr(row, "extraAttrNames", [])
+        values = []
+        for name in names:
+            if row is not None and (name in rowAttrNames \
+                    or hasattr(row, name)):
+                value = "row.%s" % name
+            elif contextItem is not None and hasattr(contextItem, name):
+                value = "contextItem.%s" % name
+            else:
+                value = "retrievalArgs[%d]" % cls.retrievalAttrIndexes[name]
+            if name in cls.rowClass.charBooleanAttrNames:
+                value = '"Y" if %s else "N"' % value
+            values.append(value)
+        codeString = "def extractor(dataSet, row):\n" \
+                "    contextItem = dataSet.contextItem\n" \
+                "    retrievalArgs = dataSet.retrievalArgs\n" \
+                "    return [%s]\n" % ", ".join(values)
+        code = compile(codeString, "GeneratedClass.py", "exec")
+        namespace = {}
+        exec(code, namespace)
+        return namespace["extractor"]
 
 
 class DataSet(object, metaclass = DataSetMetaClass):
@@ -243,6 +579,7 @@ class DataSet(object, metaclass = DataSetMetaClass):
     attrNames = []
     extraAttrNames = []
     pkAttrNames = []
+    deferredAttrNames = []
     charBooleanAttrNames = []
     decimalAttrNames = []
     clobAttrNames = []
@@ -259,7 +596,11 @@ class DataSet(object, metaclass = DataSetMetaClass):
     def __init__(self, dataSource, contextItem = None):
         self.dataSource = dataSource
         self.childDataSets = []
+        self.masterDataSet = None
         self.contextItem = contextItem
+        self.hasPendingChanges = False
+        self.pendingChangeCount = 0
+        self.changeVersion = 0
         self.retrievalArgs = [None] * len(self.retrievalAttrNames)
         if self.updateTableName is None:
             self.updateTableName = self.tableName
@@ -286,6 +627,19 @@ class DataSet(object, metaclass = DataSetMetaClass):
             args.append(value)
         return args
 
+    def _GetArgs(self, kind, row):
+        key = (kind, row.__class__, self.contextItem.__class__)
+        extractor = self.argExtractors.get(key)
+        if extractor is None:
+            names = self.argNamesByKind[kind]
+            extractor = self.__class__._GenerateArgExtractor(names, row,
+                    self.contextItem)
+            self.argExtractors[key] = extractor
+        return extractor(self, row)
+
+    def _GetInsertArgs(self, row):
+        return self._GetArgs("insert", row)
+
     def _GetNewRowHandle(self):
         if self.rows:
             handle = max(self.rows) + 1
@@ -308,6 +662,17 @@ class DataSet(object, metaclass = DataSetMetaClass):
         for row in self.insertedRows.values():
             self.InsertRowInDatabase(transaction, row)
 
+    def _OnChanged(self):
+        hasPendingChanges = bool(self.insertedRows or self.updatedRows \
+                or self.deletedRows)
+        delta = int(hasPendingChanges) - int(self.hasPendingChanges)
+        self.hasPendingChanges = hasPendingChanges
+        dataSet = self
+        while dataSet is not None:
+            dataSet.pendingChangeCount += delta
+            dataSet.changeVersion += 1
+            dataSet = dataSet.masterDataSet
+
     def _OnDeleteRow(self, row):
         pass
 
@@ -320,6 +685,9 @@ class DataSet(object, metaclass = DataSetMetaClass):
     def _OnSetValue(self, row, attrName, value, origValue):
         pass
 
+    def _GetPrimaryKeyArgs(self, row):
+        return self._GetArgs("pk", row)
+
     def _GetPrimaryKeyValues(self, transaction):
         if self.pkIsGenerated:
             attrName = self.pkAttrNames[0]
@@ -336,6 +704,42 @@ class DataSet(object, metaclass = DataSetMetaClass):
     def _PreUpdate(self):
         pass
 
+    def _RefreshByValues(self):
+        """Refresh the rows of a data set without a primary key by matching
+           the values of the rows; rows are only ever inserted or deleted."""
+        changes = DataSetChanges()
+        getValues = lambda r: tuple(getattr(r, n) \
+                for n in _GetLoadedAttrNames(r))
+        pendingCounts = {}
+        for row in list(self.updatedRows.values()) + \
+                list(self.deletedRows.values()):
+            values = getValues(row)
+            pendingCounts[values] = pendingCounts.get(values, 0) + 1
+        handlesByValues = {}
+        for handle, row in self.rows.items():
+            if handle not in self.insertedRows \
+                    and handle not in self.updatedRows:
+                handlesByValues.setdefault(getValues(row), []).append(handle)
+        nextHandle = self._GetNewRowHandle()
+        for row in self._GetRows(*self.retrievalArgs):
+            values = getValues(row)
+            if pendingCounts.get(values):
+                pendingCounts[values] -= 1
+            elif handlesByValues.get(values):
+                handlesByValues[values].pop(0)
+            else:
+                self.rows[nextHandle] = row
+                changes.insertedHandles.append(nextHandle)
+                nextHandle += 1
+        for handles in handlesByValues.values():
+            for handle in handles:
+                del self.rows[handle]
+                changes.deletedHandles.append(handle)
+        changes.deletedHandles.sort()
+        if changes:
+            self._OnChanged()
+        return changes
+
     def _SetRows(self, rows):
         self.rows = dict(enumerate(rows))
 
@@ -346,6 +750,9 @@ class DataSet(object, metaclass = DataSetMetaClass):
             return str(value)
         return value
 
+    def _GetUpdateArgs(self, row):
+        return self._GetArgs("update", row)
+
     def _Update(self, transaction):
         if self.deletedRows:
             self._DeleteRowsInDatabase(transaction)
@@ -364,6 +771,8 @@ class DataSet(object, metaclass = DataSetMetaClass):
     def AddChildDataSet(self, cls, contextItem = None):
         dataSet = cls(self.dataSource, contextItem)
         self.childDataSets.append(dataSet)
+        dataSet.masterDataSet = self
+        self.pendingChangeCount += dataSet.pendingChangeCount
         return dataSet
 
     def CanDeleteRow(self, rowHandle):
@@ -383,6 +792,7 @@ class DataSet(object, metaclass = DataSetMetaClass):
         self.insertedRows = {}
         self.updatedRows = {}
         self.deletedRows = {}
+        self._OnChanged()
         if includeChildren:
             for dataSet in self.childDataSets:
                 dataSet.ClearChanges()
@@ -397,6 +807,7 @@ class DataSet(object, metaclass = DataSetMetaClass):
             if handle in self.updatedRows:
                 self.updatedRows.pop(handle)
             self.deletedRows[handle] = row
+        self._OnChanged()
 
     def DeleteRowInDatabase(self, transaction, row):
         return transaction.RemoveRow(self, row)
@@ -410,6 +821,11 @@ class DataSet(object, metaclass = DataSetMetaClass):
     def GetKeyedDataSet(self, *attrNames):
         return KeyedDataSet(self, *attrNames)
 
+    def ChangedSince(self, version):
+        """Return true if this data set or any of its children have been
+           changed since the given change version was acquired."""
+        return self.changeVersion != version
+
     def GetRows(self):
         return list(self.rows.values())
 
@@ -430,8 +846,11 @@ class DataSet(object, metaclass = DataSetMetaClass):
         handle = self._GetNewRowHandle()
         if row is None:
             row = self.rowClass.New()
+        elif row.readOnly:
+            row = row.Copy()
         self._OnInsertRow(row, choice)
         self.insertedRows[handle] = self.rows[handle] = row
+        self._OnChanged()
         return handle, row
 
     def InsertRowInDatabase(self, transaction, row):
@@ -440,6 +859,7 @@ class DataSet(object, metaclass = DataSetMetaClass):
     def MarkAllRowsAsNew(self):
         for handle, row in self.rows.items():
             self.insertedRows[handle] = row
+        self._OnChanged()
         for childDataSet in self.childDataSets:
             childDataSet.MarkAllRowsAsNew()
 
@@ -449,17 +869,66 @@ class DataSet(object, metaclass = DataSetMetaClass):
             self.updatedRows[handle] = origRow
             newRow = self.rows[handle] = origRow.Copy()
             self._OnRowChanged(newRow, origRow)
+            self._OnChanged()
 
     def OnCreate(self):
         pass
 
     def PendingChanges(self):
-        if self.insertedRows or self.updatedRows or self.deletedRows:
-            return True
-        for dataSet in self.childDataSets:
-            if dataSet.PendingChanges():
-                return True
-        return False
+        return self.pendingChangeCount > 0
+
+    def Refresh(self):
+        """Retrieve the rows again using the last retrieval arguments and
+           merge them into the existing rows by primary key; unchanged rows
+           keep their handles, changed rows are updated in place, new rows
+           are assigned new handles and rows no longer found are removed.
+           Rows with pending changes are left untouched. Without a primary key
+           rows are matched by the values of their loaded attributes instead
+           and retrieved rows matching the original values of updated or
+           deleted rows are ignored. Deferred attributes that have not been
+           loaded are not compared."""
+        if not self.pkAttrNames:
+            return self._RefreshByValues()
+        changes = DataSetChanges()
+        handlesByKey = dict((r.GetPrimaryKeyTuple(), h) \
+                for h, r in self.rows.items())
+        deletedKeys = set(r.GetPrimaryKeyTuple() \
+                for r in self.deletedRows.values())
+        nextHandle = self._GetNewRowHandle()
+        for row in self._GetRows(*self.retrievalArgs):
+            key = row.GetPrimaryKeyTuple()
+            handle = handlesByKey.pop(key, None)
+            if handle is None:
+                if key not in deletedKeys:
+                    self.rows[nextHandle] = row
+                    changes.insertedHandles.append(nextHandle)
+                    nextHandle += 1
+                continue
+            if handle in self.insertedRows or handle in self.updatedRows:
+                continue
+            existingRow = self.rows[handle]
+            if existingRow is row:
+                continue
+            loadedAttrNames = _GetLoadedAttrNames(existingRow)
+            changedAttrNames = [n for n in _GetLoadedAttrNames(row) \
+                    if n in loadedAttrNames \
+                    and getattr(existingRow, n) != getattr(row, n)]
+            if not changedAttrNames:
+                continue
+            if existingRow.readOnly:
+                self.rows[handle] = row
+            else:
+                for attrName in changedAttrNames:
+                    setattr(existingRow, attrName, getattr(row, attrName))
+            changes.updatedHandles.append(handle)
+        for handle in handlesByKey.values():
+            if handle not in self.insertedRows \
+                    and handle not in self.updatedRows:
+                del self.rows[handle]
+                changes.deletedHandles.append(handle)
+        if changes:
+            self._OnChanged()
+        return changes
 
     def RevertChanges(self, includeChildren = True):
         while self.insertedRows:
@@ -471,6 +940,7 @@ class DataSet(object, metaclass = DataSetMetaClass):
         while self.updatedRows:
             handle, row = self.updatedRows.popitem()
             self.rows[handle] = row
+        self._OnChanged()
         if includeChildren:
             for dataSet in self.childDataSets:
                 dataSet.RevertChanges()
@@ -497,6 +967,7 @@ class DataSet(object, metaclass = DataSetMetaClass):
                     attrName, handle, value, origValue)
             self._OnSetValue(row, attrName, value, origValue)
             setattr(row, attrName, value)
+            self._OnChanged()
 
     def Update(self):
         if not self.PendingChanges():
@@ -530,11 +1001,31 @@ class DataSet(object, metaclass = DataSetMetaClass):
             del self.updatedRows[handle]
         elif handle in self.deletedRows:
             del self.deletedRows[handle]
+        self._OnChanged()
 
     def UpdateRowInDatabase(self, transaction, row, origRow):
         return transaction.ModifyRow(self, row, origRow)
 
 
+class DataSetChanges(object):
+    """The handles of the rows that were inserted, updated and deleted when a
+       data set was refreshed."""
+
+    def __init__(self):
+        self.insertedHandles = []
+        self.updatedHandles = []
+        self.deletedHandles = []
+
+    def __bool__(self):
+        return bool(self.insertedHandles or self.updatedHandles \
+                or self.deletedHandles)
+
+    def __repr__(self):
+        return "<DataSetChanges inserted=%s, updated=%s, deleted=%s>" % \
+                (self.insertedHandles, self.updatedHandles,
+                        self.deletedHandles)
+
+
 class FilteredDataSet(DataSet):
 
     def __init__(self, parentDataSet):
@@ -553,6 +1044,7 @@ class FilteredDataSet(DataSet):
     def InsertRow(self, choice = None, row = None):
         handle, parentRow = self.parentDataSet.InsertRow(choice, row)
         self.insertedRows[handle] = self.rows[handle] = parentRow
+        self._OnChanged()
         return handle, parentRow
 
     def PendingChanges(self):
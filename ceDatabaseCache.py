@@ -2,9 +2,636 @@
 Define classes and methods used for caching database results.
 """
 
+import bisect
 import ceDatabase
+import collections
+import concurrent.futures
 import cx_Exceptions
 import cx_Logging
+import cx_Threads
+import hashlib
+import itertools
+import pickle
+import sys
+import threading
+import time
+import weakref
+
+def EstimateSize(value):
+    """Return the approximate number of bytes used by a cached value (a row
+       or a list of rows); attributes referencing other rows are not
+       included as those rows are owned by other subcaches."""
+    if isinstance(value, ceDatabase.Row):
+        size = sys.getsizeof(value)
+        for attrName in value.attrNames + value.extraAttrNames:
+            attrValue = getattr(value, attrName, None)
+            if attrValue is not None \
+                    and not isinstance(attrValue, ceDatabase.Row):
+                size += sys.getsizeof(attrValue)
+        return size
+    size = sys.getsizeof(value)
+    for item in value:
+        size += EstimateSize(item) if isinstance(item, ceDatabase.Row) \
+                else sys.getsizeof(item)
+    return size
+
+
+def _EstimateKeySize(key):
+    size = sys.getsizeof(key)
+    if isinstance(key, tuple):
+        size += sum(sys.getsizeof(v) for v in key)
+    return size
+
+
+def _EstimateRowsSize(rows, numRows, sampleSize = None):
+    """Return the approximate number of bytes used by the rows, extrapolated
+       from the first sampleSize rows (or computed from all of them if
+       sampleSize is None). Rows returned more than once and values shared
+       by more than one row (such as interned strings) are counted once."""
+    seen = set()
+    size = numSampled = 0
+    for row in itertools.islice(rows, sampleSize):
+        if id(row) in seen:
+            continue
+        seen.add(id(row))
+        numSampled += 1
+        size += sys.getsizeof(row)
+        if not isinstance(row, ceDatabase.Row):
+            continue
+        for attrName in row.attrNames + row.extraAttrNames:
+            value = getattr(row, attrName, None)
+            if id(value) not in seen \
+                    and not isinstance(value, ceDatabase.Row):
+                seen.add(id(value))
+                size += sys.getsizeof(value)
+    if sampleSize is None or numSampled == 0:
+        return size
+    return size * numRows // numSampled
+
+
+_dictEntrySize = sys.getsizeof(dict.fromkeys(range(1024))) // 1024
+_missing = object()
+
+def _CallPeriodically(objRef, interval, methodName, *args):
+    while True:
+        time.sleep(interval)
+        obj = objRef()
+        if obj is None:
+            break
+        try:
+            getattr(obj, methodName)(*args)
+        except:
+            cx_Logging.LogException()
+        obj = None
+
+
+class RowSet(object):
+    """List like collection which preserves the order in which items are
+       added but adds, removes and replaces items in constant time. Rows are
+       identified by identity and all other items (such as the keys stored
+       by xref subcaches) by value. The other methods of lists are supported
+       as well (returning lists where lists would return new lists).
+       Iterating and indexing use a list of the items which is extended when
+       items are added and built again when first needed after items are
+       removed or replaced; the version is changed before and after each
+       modification so that readers which do not hold the lock only keep a
+       list built while no modification was in progress."""
+    __slots__ = ["items", "positions", "nextPosition", "version",
+            "cachedList"]
+
+    def __init__(self, items = ()):
+        self.items = {}
+        self.positions = {}
+        self.nextPosition = 0
+        self.version = 0
+        self.cachedList = None
+        self._SetItems(items)
+
+    def __add__(self, other):
+        return self._GetList() + list(other)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def __contains__(self, item):
+        return self._GetKey(item) in self.positions
+
+    def __eq__(self, other):
+        if isinstance(other, (RowSet, list, tuple)):
+            return len(self) == len(other) \
+                    and all(a is b or a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __getitem__(self, index):
+        return self._GetList()[index]
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __iter__(self):
+        return iter(self._GetList())
+
+    def __len__(self):
+        return len(self.items)
+
+    def __reduce__(self):
+        return (RowSet, (self.copy(),))
+
+    def __radd__(self, other):
+        return list(other) + self._GetList()
+
+    def __repr__(self):
+        return repr(self._GetList())
+
+    def __reversed__(self):
+        return reversed(self._GetList())
+
+    def _BeginChange(self):
+        """Mark the start of a modification and return the list of items if
+           it is up to date."""
+        cachedList = self.cachedList
+        self.version += 1
+        if cachedList is not None and cachedList[0] == self.version - 1:
+            return cachedList[1]
+
+    def _EndChange(self, items = None):
+        self.version += 1
+        self.cachedList = None if items is None else (self.version, items)
+
+    @staticmethod
+    def _GetKey(item):
+        if isinstance(item, ceDatabase.Row):
+            return id(item)
+        return item
+
+    def _GetList(self):
+        cachedList = self.cachedList
+        version = self.version
+        if cachedList is not None and cachedList[0] == version:
+            return cachedList[1]
+        items = list(self.items.values())
+        if version % 2 == 0 and self.version == version:
+            self.cachedList = (version, items)
+        return items
+
+    def _SetItems(self, items):
+        newItems = {}
+        positions = {}
+        for item in items:
+            key = self._GetKey(item)
+            if key not in positions:
+                positions[key] = len(newItems)
+                newItems[len(newItems)] = item
+        self._BeginChange()
+        self.items = newItems
+        self.positions = positions
+        self.nextPosition = len(newItems)
+        self._EndChange(list(newItems.values()))
+
+    def append(self, item):
+        key = self._GetKey(item)
+        if key in self.positions:
+            return
+        items = self._BeginChange()
+        self.positions[key] = self.nextPosition
+        self.items[self.nextPosition] = item
+        self.nextPosition += 1
+        if items is not None:
+            items.append(item)
+        self._EndChange(items)
+
+    def clear(self):
+        self._SetItems(())
+
+    def copy(self):
+        return list(self._GetList())
+
+    def count(self, item):
+        return 1 if item in self else 0
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def index(self, item, *args):
+        return self._GetList().index(item, *args)
+
+    def insert(self, index, item):
+        if item not in self:
+            items = self.copy()
+            items.insert(index, item)
+            self._SetItems(items)
+
+    def pop(self, index = -1):
+        item = self._GetList()[index]
+        self.remove(item)
+        return item
+
+    def reverse(self):
+        self._SetItems(reversed(self._GetList()))
+
+    def sort(self, key = None, reverse = False):
+        self._SetItems(sorted(self._GetList(), key = key, reverse = reverse))
+
+    def Copy(self):
+        rowSet = RowSet()
+        rowSet.items = self.items.copy()
+        rowSet.positions = self.positions.copy()
+        rowSet.nextPosition = self.nextPosition
+        return rowSet
+
+    def GetIndexSize(self):
+        """Return the approximate number of bytes used by the row set, not
+           including the items themselves."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.items) + \
+                sys.getsizeof(self.positions) + \
+                len(self.items) * sys.getsizeof(self.nextPosition) * 2
+        cachedList = self.cachedList
+        if cachedList is not None:
+            size += sys.getsizeof(cachedList[1])
+        return size
+
+    def remove(self, item):
+        key = self._GetKey(item)
+        if key not in self.positions:
+            raise ValueError("item not in row set")
+        self._BeginChange()
+        del self.items[self.positions.pop(key)]
+        self._EndChange()
+
+    def Replace(self, item, newItem):
+        """Replace the item with the new item, in the same position."""
+        key = self._GetKey(item)
+        if key not in self.positions:
+            raise ValueError("item not in row set")
+        self._BeginChange()
+        position = self.positions.pop(key)
+        self.positions[self._GetKey(newItem)] = position
+        self.items[position] = newItem
+        self._EndChange()
+
+
+class SortedRowIndex(object):
+    """Collection of rows kept sorted by key in parallel lists which are
+       searched with bisect. Rows added and removed are collected and then
+       applied together by Sort(), which is called with the lock of the
+       subcache held once the subcache has been modified. The lists are
+       replaced rather than modified so that readers searching the index
+       without the lock always find keys and rows which match. Rows with
+       keys that are or contain None are not indexed."""
+    __slots__ = ["entries", "unsortedItems", "removedItems"]
+
+    def __init__(self):
+        self.entries = ([], [])
+        self.unsortedItems = []
+        self.removedItems = {}
+
+    def __iter__(self):
+        return iter(self.entries[1])
+
+    def __len__(self):
+        return len(self.entries[0])
+
+    @staticmethod
+    def _GetPrefixEndIndex(keys, prefix, low):
+        """Return the index after the last key starting with the prefix,
+           searching from the given index (the first such key, if any)."""
+        high = len(keys)
+        while low < high:
+            middle = (low + high) // 2
+            if SortedRowIndex._HasPrefix(keys[middle], prefix):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @staticmethod
+    def _HasPrefix(key, prefix):
+        if isinstance(key, tuple):
+            return key[:len(prefix)] == prefix
+        return key.startswith(prefix)
+
+    @staticmethod
+    def _IsIndexed(key):
+        if isinstance(key, tuple):
+            return None not in key
+        return key is not None
+
+    def Add(self, key, row):
+        if self._IsIndexed(key):
+            self.unsortedItems.append((key, row))
+
+    def Copy(self):
+        index = SortedRowIndex()
+        index.entries = self.entries
+        index.unsortedItems = list(self.unsortedItems)
+        index.removedItems = self.removedItems.copy()
+        return index
+
+    def GetIndexSize(self, sampleSize = None):
+        """Return the approximate number of bytes used by the index, not
+           including the rows themselves."""
+        keys, rows = self.entries
+        size = sys.getsizeof(keys) + sys.getsizeof(rows)
+        sampleKeys = keys[:sampleSize]
+        if sampleKeys:
+            keySize = sum(_EstimateKeySize(k) for k in sampleKeys)
+            size += keySize * len(keys) // len(sampleKeys)
+        return size
+
+    def IsSorted(self):
+        """Return true if there are no changes waiting to be applied."""
+        return not self.unsortedItems and not self.removedItems
+
+    def clear(self):
+        self.entries = ([], [])
+        self.unsortedItems = []
+        self.removedItems = {}
+
+    def Remove(self, key, row):
+        if not self._IsIndexed(key):
+            return
+        for index, item in enumerate(self.unsortedItems):
+            if item[1] is row and item[0] == key:
+                del self.unsortedItems[index]
+                return
+        keys, rows = self.entries
+        startIndex = bisect.bisect_left(keys, key)
+        endIndex = bisect.bisect_right(keys, key, startIndex)
+        for index in range(startIndex, endIndex):
+            if rows[index] is row and id(row) not in self.removedItems:
+                self.removedItems[id(row)] = key
+                return
+        raise ValueError("row not in index")
+
+    def Search(self, lower = None, upper = None, prefix = None,
+            limit = None, descending = False):
+        """Return the rows with keys between the lower and upper bounds
+           (inclusive) which start with the prefix, if specified, in key
+           order (or the reverse), stopping after limit rows. An upper bound
+           which is a tuple shorter than the keys includes all of the keys
+           starting with it."""
+        keys, rows = self.entries
+        startIndex = 0 if lower is None else bisect.bisect_left(keys, lower)
+        if upper is None:
+            endIndex = len(keys)
+        else:
+            endIndex = bisect.bisect_right(keys, upper)
+            if isinstance(upper, tuple):
+                endIndex = self._GetPrefixEndIndex(keys, upper, endIndex)
+        if prefix is not None:
+            prefixIndex = bisect.bisect_left(keys, prefix)
+            startIndex = max(startIndex, prefixIndex)
+            endIndex = min(endIndex,
+                    self._GetPrefixEndIndex(keys, prefix, prefixIndex))
+        if limit is not None and endIndex - startIndex > limit:
+            if descending:
+                startIndex = endIndex - limit
+            else:
+                endIndex = startIndex + limit
+        result = rows[startIndex:endIndex]
+        if descending:
+            result.reverse()
+        return result
+
+    def Sort(self):
+        """Apply the rows added and removed since the index was last
+           sorted."""
+        if self.IsSorted():
+            return
+        items = self.unsortedItems
+        removedItems = self.removedItems
+        self.unsortedItems = []
+        self.removedItems = {}
+        keys, rows = self.entries
+        if (len(items) + len(removedItems)) * 8 < len(keys):
+            keys = list(keys)
+            rows = list(rows)
+            for rowId, key in removedItems.items():
+                index = bisect.bisect_left(keys, key)
+                while id(rows[index]) != rowId:
+                    index += 1
+                del keys[index]
+                del rows[index]
+            for key, row in items:
+                index = bisect.bisect_right(keys, key)
+                keys.insert(index, key)
+                rows.insert(index, row)
+        else:
+            items = [(k, r) for k, r in zip(keys, rows) \
+                    if id(r) not in removedItems] + items
+            items.sort(key = lambda i: i[0])
+            keys = [k for k, r in items]
+            rows = [r for k, r in items]
+        self.entries = (keys, rows)
+
+
+class MemoryBudgetExceeded(cx_Exceptions.BaseException):
+    message = "Loading all rows of %(subCacheName)s would use " \
+            "approximately %(requiredBytes)s bytes but only %(budget)s " \
+            "bytes are available within the memory budget."
+
+
+class SnapshotMismatch(cx_Exceptions.BaseException):
+    message = 'Snapshot "%(fileName)s" does not match the cache definition.'
+
+
+class SnapshotRowClassNotCached(cx_Exceptions.BaseException):
+    message = 'Rows of class "%(name)s" are not cached by any subcache and ' \
+            'cannot be saved in a snapshot.'
+
+
+class _SnapshotPickler(pickle.Pickler):
+
+    def __init__(self, f, rowIndexes):
+        super(_SnapshotPickler, self).__init__(f, pickle.HIGHEST_PROTOCOL)
+        self.rowIndexes = rowIndexes
+
+    def persistent_id(self, obj):
+        if obj is _missing:
+            return "missing"
+        if isinstance(obj, ceDatabase.Row):
+            return self.rowIndexes[id(obj)]
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    """Unpickler for snapshots which only creates the types found in the
+       values of rows and path indexes; other globals are rejected so that
+       loading a snapshot cannot run arbitrary code."""
+    safeGlobals = set([("builtins", "bytearray"), ("builtins", "complex"),
+            ("builtins", "frozenset"), ("builtins", "set"),
+            ("ceDatabaseCache", "RowSet"), ("datetime", "date"),
+            ("datetime", "datetime"), ("datetime", "time"),
+            ("datetime", "timedelta"), ("datetime", "timezone"),
+            ("decimal", "Decimal")])
+
+    def __init__(self, f):
+        super(_SnapshotUnpickler, self).__init__(f)
+        self.rows = []
+
+    def find_class(self, moduleName, name):
+        if (moduleName, name) not in self.safeGlobals:
+            raise pickle.UnpicklingError("%s.%s is not permitted in a "
+                    "snapshot" % (moduleName, name))
+        return super(_SnapshotUnpickler, self).find_class(moduleName, name)
+
+    def persistent_load(self, pid):
+        if pid == "missing":
+            return _missing
+        return self.rows[pid]
+
+
+class Statistics(object):
+    """Counters for the lookups and loads performed by a path or subcache;
+       load latencies are counted in buckets with the given upper bounds (in
+       milliseconds)."""
+    latencyBucketBounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000,
+            5000)
+
+    def __init__(self):
+        self.Clear()
+
+    def Clear(self):
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.rowsLoaded = 0
+        self.evictions = 0
+        self.loadTime = 0.0
+        self.latencyCounts = [0] * (len(self.latencyBucketBounds) + 1)
+
+    def GetReport(self):
+        """Return a dictionary describing the statistics."""
+        lookups = self.hits + self.misses
+        buckets = list(self.latencyBucketBounds) + [None]
+        return dict(hits = self.hits, misses = self.misses,
+                hitRatio = self.hits / lookups if lookups else None,
+                loads = self.loads, rowsLoaded = self.rowsLoaded,
+                evictions = self.evictions, loadTime = self.loadTime,
+                averageLoadTime = self.loadTime / self.loads \
+                        if self.loads else None,
+                loadLatencies = list(zip(buckets, self.latencyCounts)))
+
+    def RecordLoad(self, elapsedTime, numRows):
+        """Record a load which took the given time (in seconds) and returned
+           the given number of rows."""
+        self.loads += 1
+        self.rowsLoaded += numRows
+        self.loadTime += elapsedTime
+        bucket = bisect.bisect_left(self.latencyBucketBounds,
+                elapsedTime * 1000)
+        self.latencyCounts[bucket] += 1
+
+
+class _PendingLoad(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.keys = {}
+        self.value = None
+        self.exc = None
+        self.errors = {}
+
+
+class _UnresolvedRows(object):
+    """Rows loaded by a thread which are being resolved before they are added
+       to a subcache, indexed by the name of each path. Lookups made by the
+       same thread find them so that rows which refer to each other are not
+       loaded again."""
+
+    def __init__(self, subCacheName, valuesByPath, allRows = None):
+        self.subCacheName = subCacheName
+        self.valuesByPath = valuesByPath
+        self.allRows = allRows
+
+
+class Batch(object):
+    """Collects calls to the generated cache methods and resolves them with
+       one set based query for each path, either when the batch is exited
+       or when the value of one of its deferred results is first requested.
+       Use as a context manager:
+
+           with cache.Batch() as batch:
+               results = [batch.RowById(i) for i in ids]
+           rows = [r.GetValue() for r in results]"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.pendingResults = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        if excType is None:
+            self.Resolve()
+
+    def __getattr__(self, name):
+        try:
+            subCacheAttrName, pathName = self.cache.pathMethodNames[name]
+        except KeyError:
+            raise AttributeError(name)
+        subCache = getattr(self.cache, subCacheAttrName)
+        def AddPendingResult(*args):
+            result = DeferredResult(self, subCache, pathName, args)
+            self.pendingResults.append(result)
+            return result
+        return AddPendingResult
+
+    def Resolve(self):
+        """Resolve all of the results that have not yet been resolved."""
+        resultsByPath = {}
+        for result in self.pendingResults:
+            key = (result.subCache, result.pathName)
+            resultsByPath.setdefault(key, []).append(result)
+        self.pendingResults = []
+        for (subCache, pathName), results in resultsByPath.items():
+            keys = [r.args[0] if len(r.args) == 1 else r.args for r in results]
+            try:
+                values = subCache.LoadMany(self.cache, pathName, keys)
+            except BaseException as e:
+                for result in results:
+                    result._SetException(e)
+                continue
+            path = subCache.pathsByName[pathName]
+            for result, value in zip(results, values):
+                if value is None and not path.ignoreRowNotCached:
+                    result._SetException(cx_Exceptions.NoDataFound())
+                else:
+                    result._SetValue(value)
+
+
+class DeferredResult(object):
+    """The result of a call to a generated cache method made on a batch."""
+
+    def __init__(self, batch, subCache, pathName, args):
+        self.batch = batch
+        self.subCache = subCache
+        self.pathName = pathName
+        self.args = args
+        self.resolved = False
+        self.value = None
+        self.exc = None
+
+    def _SetException(self, exc):
+        self.exc = exc
+        self.resolved = True
+
+    def _SetValue(self, value):
+        self.value = value
+        self.resolved = True
+
+    def GetValue(self):
+        """Return the value, resolving the batch first if needed; the
+           exception raised by the lookup (such as NoDataFound) is raised
+           here instead."""
+        if not self.resolved:
+            self.batch.Resolve()
+        if self.exc is not None:
+            raise self.exc
+        return self.value
+
 
 class PathMetaClass(type):
 
@@ -20,6 +647,8 @@ class PathMetaClass(type):
             cls.name = cls.__name__
         if "subCacheAttrName" not in classDict:
             cls.subCacheAttrName = "rowsBy%s" % cls.name
+        cls.expiryAttrName = "expiryTimesBy%s" % cls.name
+        cls.statisticsAttrName = "statisticsBy%s" % cls.name
 
 
 class Path(object, metaclass = PathMetaClass):
@@ -29,14 +658,51 @@ class Path(object, metaclass = PathMetaClass):
     subCacheAttrName = None
     cacheAttrName = None
     ignoreRowNotCached = False
+    maxEntries = None
+    maxBytes = None
+    sizeSampleEntries = 20
+    batchSize = 500
+    cacheMisses = False
+    missTimeToLive = None
+    maxMisses = 10000
     name = None
 
     def __init__(self, cache, subCache):
-        self.rows = {}
+        self.maxEntries, self.maxBytes = self._GetLimits(subCache.__class__)
+        self.isLimited = self._IsLimited(subCache.__class__, cache.__class__)
+        self.rows = collections.OrderedDict() if self.isLimited else {}
+        self.expiryTimes = {}
+        self.misses = collections.OrderedDict()
+        self.statistics = Statistics()
+        self.collectStatistics = cache.collectStatistics
+        self.timeToLive = None
+        if not subCache.loadAllRowsOnFirstLoad:
+            self.timeToLive = subCache.timeToLive
         self.subCacheName = subCache.name
         self.rowClass = subCache.rowClass
         self.Clear()
 
+    @classmethod
+    def _GetLimits(cls, subCacheClass):
+        if subCacheClass.loadAllRowsOnFirstLoad:
+            return None, None
+        maxEntries = cls.maxEntries
+        if maxEntries is None:
+            maxEntries = subCacheClass.maxEntries
+        maxBytes = cls.maxBytes
+        if maxBytes is None:
+            maxBytes = subCacheClass.maxBytes
+        return maxEntries, maxBytes
+
+    @classmethod
+    def _IsLimited(cls, subCacheClass, cacheClass):
+        if subCacheClass.loadAllRowsOnFirstLoad:
+            return False
+        maxEntries, maxBytes = cls._GetLimits(subCacheClass)
+        return maxEntries is not None or maxBytes is not None \
+                or subCacheClass.memoryBudget is not None \
+                or cacheClass.memoryBudget is not None
+
     @classmethod
     def _GetProcessedAndKeyArgs(cls, prefix = ""):
         processedArgs = []
@@ -49,6 +715,17 @@ class Path(object, metaclass = PathMetaClass):
             return processedArgs, processedArgs[0]
         return processedArgs, "(%s)" % ", ".join(processedArgs)
 
+    def _AddMiss(self, key):
+        if not self.cacheMisses:
+            return
+        expiryTime = None
+        if self.missTimeToLive is not None:
+            expiryTime = time.monotonic() + self.missTimeToLive
+        self.misses[key] = expiryTime
+        self.misses.move_to_end(key)
+        while len(self.misses) > self.maxMisses:
+            self.misses.popitem(last = False)
+
     def _CacheValue(self, args, value):
         if len(args) == 1:
             self.rows[args[0]] = value
@@ -58,44 +735,195 @@ class Path(object, metaclass = PathMetaClass):
 
     def Clear(self):
         self.rows.clear()
+        self.expiryTimes.clear()
+        self.misses.clear()
 
-    def GetCachedValue(self, args):
+    def GetCachedValue(self, args, rows = None):
         if len(args) == 1:
             key, = args
         else:
             key = args
+        if rows is None:
+            rows = self.rows
         try:
-            return self.rows[key]
+            return rows[key]
         except KeyError:
             if self.ignoreRowNotCached:
                 return self.OnRowNotCached(args)
             raise cx_Exceptions.NoDataFound()
 
+    def EstimateIndexSize(self, sampleSize = None):
+        """Return the approximate number of bytes used by the index of the
+           path (its dictionaries, keys and groups of rows but not the rows
+           themselves), extrapolated from the first sampleSize entries (or
+           computed from all of them if sampleSize is None)."""
+        size = sys.getsizeof(self.rows) + sys.getsizeof(self.expiryTimes) + \
+                sys.getsizeof(self.misses)
+        if not self.rows:
+            return size
+        entrySize = numSampled = 0
+        for key, value in itertools.islice(self.rows.items(), sampleSize):
+            numSampled += 1
+            entrySize += _EstimateKeySize(key)
+            if isinstance(value, RowSet):
+                entrySize += value.GetIndexSize()
+        return size + entrySize * len(self.rows) // numSampled
+
+    def GetKey(self, value):
+        """Return the key used to cache the value passed to the generated
+           methods; for paths with multiple retrieval attributes the value is
+           a sequence of arguments or a row supplying all of them."""
+        if len(self.retrievalAttrNames) == 1:
+            args = [value]
+        elif isinstance(value, ceDatabase.Row):
+            args = [value] * len(self.retrievalAttrNames)
+        else:
+            args = list(value)
+        for i, attrName in enumerate(self.retrievalAttrNames):
+            if isinstance(args[i], ceDatabase.Row):
+                args[i] = getattr(args[i], attrName)
+            if attrName in self.stringRetrievalAttrNames \
+                    and args[i] is not None:
+                args[i] = args[i].upper()
+        if len(args) == 1:
+            return args[0]
+        return tuple(args)
+
     def GetKeyValue(self, row):
         args = [getattr(row, n) for n in self.retrievalAttrNames]
+        for i, attrName in enumerate(self.retrievalAttrNames):
+            if attrName in self.stringRetrievalAttrNames \
+                    and args[i] is not None:
+                args[i] = args[i].upper()
         if len(args) == 1:
             return args[0]
         return tuple(args)
 
+    def IsCachedMiss(self, key):
+        """Return true if a previous load found no rows for the key and that
+           result has not yet expired."""
+        try:
+            expiryTime = self.misses[key]
+        except KeyError:
+            return False
+        if expiryTime is not None and time.monotonic() > expiryTime:
+            self.misses.pop(key, None)
+            return False
+        return True
+
+    def GetMaxEntries(self):
+        """Return the maximum number of entries permitted in the path; if a
+           limit on the number of bytes has been specified, the size of an
+           entry is estimated from a sample of the most recent entries."""
+        maxEntries = self.maxEntries
+        if self.maxBytes is not None and self.rows:
+            values = itertools.islice(reversed(self.rows.values()),
+                    self.sizeSampleEntries)
+            sizes = [EstimateSize(v) for v in values]
+            entrySize = max(1, sum(sizes) // len(sizes))
+            maxEntriesForBytes = max(1, self.maxBytes // entrySize)
+            if maxEntries is None or maxEntriesForBytes < maxEntries:
+                maxEntries = maxEntriesForBytes
+        return maxEntries
+
     def GetRowsFromDataSource(self, cache, *args):
         conditions = dict(zip(self.retrievalAttrNames, args))
         return self.rowClass.GetRows(cache.dataSource, **conditions)
 
+    def GetRowsFromDataSourceForKeys(self, cache, keys):
+        """Return the rows for all of the given keys. Paths with a single
+           retrieval attribute which do not override GetRowsFromDataSource()
+           use one query for each batch of keys; all others use one query for
+           each key."""
+        rows = []
+        if len(self.retrievalAttrNames) > 1 or self.__class__.\
+                GetRowsFromDataSource is not Path.GetRowsFromDataSource:
+            for key in keys:
+                args = key if len(self.retrievalAttrNames) > 1 else (key,)
+                rows.extend(self.GetRowsFromDataSource(cache, *args))
+            return rows
+        name = "%s__in" % self.retrievalAttrNames[0]
+        for i in range(0, len(keys), self.batchSize):
+            conditions = { name : keys[i:i + self.batchSize] }
+            rows.extend(self.rowClass.GetRows(cache.dataSource, **conditions))
+        return rows
+
     def Load(self, cache, subCache, *args):
+        subCache._InitHighWaterMark(cache)
+        if self.collectStatistics:
+            startTime = time.perf_counter()
         rows = self.GetRowsFromDataSource(cache, *args)
-        cachedValue = self._OnLoad(rows, *args)
-        subCache.OnLoadRows(cache, rows)
+        if self.collectStatistics:
+            self.statistics.RecordLoad(time.perf_counter() - startTime,
+                    len(rows))
+        key = args[0] if len(args) == 1 else args
+        value = self._GetLoadedValue(rows)
+        subCache.ResolveRows(cache, rows, self.name,
+                {} if value is None else { key : value })
+        with subCache.lock:
+            cachedValue = self._OnLoad(value, *args)
+            subCache.OnLoadRows(cache, rows)
+            if self.timeToLive is not None:
+                self.expiryTimes[key] = time.monotonic() + self.timeToLive
         return cachedValue
 
+    def LoadMany(self, cache, subCache, keys, errors = None):
+        subCache._InitHighWaterMark(cache)
+        if self.collectStatistics:
+            startTime = time.perf_counter()
+        rows = self.GetRowsFromDataSourceForKeys(cache, keys)
+        if self.collectStatistics:
+            self.statistics.RecordLoad(time.perf_counter() - startTime,
+                    len(rows))
+        rowsByKey = dict((k, []) for k in keys)
+        for row in rows:
+            rowsByKey.setdefault(self.GetKeyValue(row), []).append(row)
+        values = self._GetLoadedValues(rowsByKey, errors)
+        if errors:
+            rowsByKey = dict((k, r) for k, r in rowsByKey.items() \
+                    if k not in errors)
+            rows = [r for r in rows if self.GetKeyValue(r) not in errors]
+        subCache.ResolveRows(cache, rows, self.name, values)
+        with subCache.lock:
+            self._OnLoadMany(rowsByKey, values)
+            subCache.OnLoadRows(cache, rows)
+            if self.timeToLive is not None:
+                expiryTime = time.monotonic() + self.timeToLive
+                for key in values:
+                    self.expiryTimes[key] = expiryTime
+        return values
+
 
 class SingleRowPath(Path):
 
-    def _OnLoad(self, rows, *args):
-        if len(rows) == 0:
-            raise cx_Exceptions.NoDataFound()
-        elif len(rows) > 1:
+    def _GetLoadedValue(self, rows):
+        if len(rows) > 1:
             raise cx_Exceptions.TooManyRows(numRows = len(rows))
-        return self._CacheValue(args, rows[0])
+        return rows[0] if rows else None
+
+    def _GetLoadedValues(self, rowsByKey, errors):
+        values = {}
+        for key, rows in rowsByKey.items():
+            if len(rows) > 1:
+                exc = cx_Exceptions.TooManyRows(numRows = len(rows))
+                if errors is None:
+                    raise exc
+                errors[key] = exc
+            elif rows:
+                values[key] = rows[0]
+        return values
+
+    def _OnLoad(self, value, *args):
+        if value is None:
+            self._AddMiss(args[0] if len(args) == 1 else args)
+            raise cx_Exceptions.NoDataFound()
+        return self._CacheValue(args, value)
+
+    def _OnLoadMany(self, rowsByKey, values):
+        self.rows.update(values)
+        for key in rowsByKey:
+            if key not in values:
+                self._AddMiss(key)
 
     def OnRowNotCached(self, args):
         return None
@@ -104,13 +932,74 @@ class SingleRowPath(Path):
 class MultipleRowPath(Path):
     ignoreRowNotCached = True
 
-    def _OnLoad(self, rows, *args):
-        return self._CacheValue(args, rows)
+    def _GetLoadedValue(self, rows):
+        return RowSet(rows)
+
+    def _GetLoadedValues(self, rowsByKey, errors):
+        return dict((k, RowSet(r)) for k, r in rowsByKey.items())
+
+    def _OnLoad(self, value, *args):
+        return self._CacheValue(args, value)
+
+    def _OnLoadMany(self, rowsByKey, values):
+        self.rows.update(values)
 
     def OnRowNotCached(self, args):
         return list()
 
 
+class RangePath(Path):
+    """Path which keeps the rows sorted by the retrieval attributes; the
+       generated method returns the rows in a range of keys, with a prefix
+       or the first (or last) rows in key order. All rows must be loaded on
+       first load."""
+
+    def __init__(self, cache, subCache):
+        super(RangePath, self).__init__(cache, subCache)
+        self.rows = SortedRowIndex()
+
+    @classmethod
+    def _GetLimits(cls, subCacheClass):
+        return None, None
+
+    def EstimateIndexSize(self, sampleSize = None):
+        return self.rows.GetIndexSize(sampleSize)
+
+    def _GetSearchKey(self, value):
+        if value is None or not self.stringRetrievalAttrNames:
+            return value
+        if len(self.retrievalAttrNames) == 1:
+            return value.upper() if isinstance(value, str) else value
+        return tuple(v.upper() \
+                if n in self.stringRetrievalAttrNames and isinstance(v, str) \
+                else v for n, v in zip(self.retrievalAttrNames, value))
+
+    def Search(self, lower = None, upper = None, prefix = None,
+            limit = None, descending = False, rows = None):
+        """Return the rows with keys between the lower and upper bounds
+           (inclusive) and starting with the prefix; for paths with multiple
+           retrieval attributes these are tuples of the leading values. The
+           index searched may be passed, as is done for the generations of
+           copy on write subcaches."""
+        if rows is None:
+            rows = self.rows
+        return rows.Search(self._GetSearchKey(lower),
+                self._GetSearchKey(upper), self._GetSearchKey(prefix),
+                limit, descending)
+
+
+class SubCacheGeneration(object):
+    """The rows and path indexes of a copy on write subcache at one point in
+       time; these are never modified once the generation is published and
+       a generation is freed once no reader holds a reference to it."""
+
+    def __init__(self, subCache):
+        self.allRows = subCache.allRows
+        self.allRowsLoaded = subCache.allRowsLoaded
+        for path in subCache.paths:
+            setattr(self, path.subCacheAttrName, path.rows)
+
+
 class SubCacheMetaClass(type):
 
     def __init__(cls, name, bases, classDict):
@@ -134,21 +1023,44 @@ class SubCacheMetaClass(type):
                 cls.pathClasses.append(value)
         if "name" not in classDict:
             cls.name = cls.__name__
+        if cls.copyOnWrite and not cls.loadAllRowsOnFirstLoad:
+            raise TypeError("%s: copy on write requires all rows to be "
+                    "loaded on first load" % cls.name)
+        if cls.regenerateMethods \
+                or not hasattr(cls, cls.onResolveRowMethodName):
+            onResolveRowMethodLines = []
+            for directive in cls.onLoadRowExtraDirectives:
+                if cls.rowClass.readOnly:
+                    line = "_setattr(row, %r, cache.%s(row.%s))" % directive
+                else:
+                    line = "row.%s = cache.%s(row.%s)" % directive
+                onResolveRowMethodLines.append(line)
+            if hasattr(cls, cls.setExtraAttrValuesMethodName):
+                line = "self.%s(cache, row)" % cls.setExtraAttrValuesMethodName
+                onResolveRowMethodLines.append(line)
+            if onResolveRowMethodLines:
+                cls._GenerateMethod(cls, cls.onResolveRowMethodName,
+                        onResolveRowMethodLines, "cache", "row")
         if cls.regenerateMethods \
                 or not hasattr(cls, cls.onLoadRowMethodName) \
                 or not hasattr(cls, cls.onRemoveRowMethodName):
             onLoadRowMethodLines = []
             onRemoveRowMethodLines = []
-            for directive in cls.onLoadRowExtraDirectives:
-                line = "row.%s = cache.%s(row.%s)" % directive
-                onLoadRowMethodLines.append(line)
-            if hasattr(cls, cls.setExtraAttrValuesMethodName):
-                line = "self.%s(cache, row)" % cls.setExtraAttrValuesMethodName
-                onLoadRowMethodLines.append(line)
             for pathClass in cls.pathClasses:
                 processedArgs, keyArgs = \
                         pathClass._GetProcessedAndKeyArgs("row.")
-                if issubclass(pathClass, SingleRowPath):
+                if issubclass(pathClass, RangePath):
+                    if not cls.loadAllRowsOnFirstLoad:
+                        raise TypeError("%s: range path %s requires all rows "
+                                "to be loaded on first load" % \
+                                (cls.name, pathClass.name))
+                    line = "self.%s.Add(%s, row)" % \
+                            (pathClass.subCacheAttrName, keyArgs)
+                    onLoadRowMethodLines.append(line)
+                    line = "self.%s.Remove(%s, row)" % \
+                            (pathClass.subCacheAttrName, keyArgs)
+                    onRemoveRowMethodLines.append(line)
+                elif issubclass(pathClass, SingleRowPath):
                     line = "self.%s[%s] = row" % \
                             (pathClass.subCacheAttrName, keyArgs)
                     onLoadRowMethodLines.append(line)
@@ -157,12 +1069,27 @@ class SubCacheMetaClass(type):
                     onRemoveRowMethodLines.append(line)
                 else:
                     if cls.loadAllRowsOnFirstLoad:
-                        line = "self.%s.setdefault(%s, []).append(row)" % \
+                        lines = [
+                            "try:",
+                            "    self.%s[%s].append(row)" % \
+                                    (pathClass.subCacheAttrName, keyArgs),
+                            "except KeyError:",
+                            "    self.%s[%s] = _RowSet([row])" % \
+                                    (pathClass.subCacheAttrName, keyArgs)
+                        ]
+                        onLoadRowMethodLines.extend(lines)
+                    if cls.loadAllRowsOnFirstLoad:
+                        line = "self.%s[%s].remove(row)" % \
                                 (pathClass.subCacheAttrName, keyArgs)
-                        onLoadRowMethodLines.append(line)
-                    line = "self.%s[%s].remove(row)" % \
-                            (pathClass.subCacheAttrName, keyArgs)
-                    onRemoveRowMethodLines.append(line)
+                        onRemoveRowMethodLines.append(line)
+                    else:
+                        lines = [
+                            "rows = self.%s.get(%s)" % \
+                                    (pathClass.subCacheAttrName, keyArgs),
+                            "if rows is not None and row in rows:",
+                            "    rows.remove(row)"
+                        ]
+                        onRemoveRowMethodLines.extend(lines)
             if onLoadRowMethodLines:
                 if cls.regenerateMethods \
                         or not hasattr(cls, cls.onLoadRowMethodName):
@@ -179,6 +1106,7 @@ class SubCache(object, metaclass = SubCacheMetaClass):
     setExtraAttrValuesMethodName = "SetExtraAttrValues"
     onRemoveRowMethodName = "OnRemoveRow"
     onLoadRowMethodName = "OnLoadRow"
+    onResolveRowMethodName = "OnResolveRow"
     regenerateMethods = False
     onLoadRowExtraDirectives = []
     loadAllRowsOnFirstLoad = False
@@ -187,21 +1115,58 @@ class SubCache(object, metaclass = SubCacheMetaClass):
     pathClassesByName = {}
     cacheAttrName = None
     tracePathLoads = True
+    maxEntries = None
+    maxBytes = None
+    memoryBudget = None
+    memorySampleSize = 100
+    copyOnWrite = False
+    timeToLive = None
+    coalesceWindow = None
+    changeTrackingAttrName = None
+    changeLogRowClass = None
+    changeLogKeyAttrNames = None
+    changeLogSequenceAttrName = None
+    changeLogOperationAttrName = None
+    changeLogDeleteOperations = ("D",)
+    refreshDeltaInterval = None
     name = None
 
     def __init__(self, cache):
         self.paths = []
         self.singleRowPaths = []
+        self.rangePaths = []
+        self.limitedPaths = []
         self.pathsByName = {}
         self.allRowsLoaded = False
-        self.allRows = []
+        self.allRows = RowSet()
+        self.allRowsExpiryTime = 0
+        self.highWaterMark = _missing
+        self.estimatedBytes = 0
+        self.threadSafe = cache.threadSafe
+        self.collectStatistics = cache.collectStatistics
+        self.statistics = Statistics()
+        self.lock = threading.RLock()
+        self.loadsPending = {}
+        self.coalescedLoadsPending = {}
+        self.coalescedLoadsRunning = collections.Counter()
+        self.refreshesPending = set()
         for cls in self.pathClasses:
             path = cls(cache, self)
             self.paths.append(path)
             self.pathsByName[path.name] = path
             setattr(self, cls.subCacheAttrName, path.rows)
+            setattr(self, cls.expiryAttrName, path.expiryTimes)
+            setattr(self, cls.statisticsAttrName, path.statistics)
             if issubclass(cls, SingleRowPath):
                 self.singleRowPaths.append(path)
+            elif issubclass(cls, RangePath):
+                self.rangePaths.append(path)
+            if path.isLimited:
+                self.limitedPaths.append(path)
+        self.writeDepth = 0
+        self.generation = None
+        if self.copyOnWrite:
+            self._PublishGeneration()
 
     @classmethod
     def _GenerateMethod(cls, targetClass, methodName, methodLines, *args):
@@ -211,34 +1176,130 @@ class SubCache(object, metaclass = SubCacheMetaClass):
         cx_Logging.Debug("%s: GENERATED CODE\n%s", cls.name, codeString)
         code = compile(codeString, "SubCacheGeneratedCode.py", "exec")
         temp = {}
-        exec(code, dict(), temp)
+        exec(code, dict(_setattr = object.__setattr__, _time = time.monotonic,
+                _RowSet = RowSet), temp)
         setattr(targetClass, methodName, temp[methodName])
 
     @classmethod
     def _GenerateCacheMethods(cls, cacheClass):
+        generationRef = "self.%s" % cls.cacheAttrName
+        if cls.copyOnWrite:
+            generationRef += ".generation"
         if cls.allRowsMethodCacheAttrName is not None:
             methodLines = [
-                    "if self.%s.allRowsLoaded:" % cls.cacheAttrName,
-                    "    return self.%s.allRows" % cls.cacheAttrName,
+                    "generation = %s" % generationRef,
+                    "if generation.allRowsLoaded:",
+                    "    return generation.allRows",
                     "return self.%s.LoadAllRows(self)" % cls.cacheAttrName
             ]
+            if cls.timeToLive is not None:
+                methodLines[2:2] = [
+                    "    if _time() > self.%s.allRowsExpiryTime:" % \
+                            cls.cacheAttrName,
+                    "        self.%s.RefreshLater(self)" % cls.cacheAttrName
+                ]
             cls._GenerateMethod(cacheClass, cls.allRowsMethodCacheAttrName,
                     methodLines)
         for pathClass in cls.pathClasses:
             if pathClass.cacheAttrName is None:
                 continue
+            if issubclass(pathClass, RangePath):
+                cls._GenerateRangeCacheMethod(cacheClass, pathClass,
+                        generationRef)
+                continue
             processedArgs, keyArgs = pathClass._GetProcessedAndKeyArgs()
             ref = "self.%s" % cls.cacheAttrName
-            methodLines = [
-                    "try:",
-                    "    return %s.%s[%s]" % \
-                            (ref, pathClass.subCacheAttrName, keyArgs),
-                    "except KeyError:",
-                    "    return %s.Load(self, %r, %s)" % \
-                            (ref, pathClass.name, ", ".join(processedArgs))
-            ]
+            rowsRef = "%s.%s" % (generationRef, pathClass.subCacheAttrName)
+            loadLine = "    return %s.Load(self, %r, %s)" % \
+                    (ref, pathClass.name, ", ".join(processedArgs))
+            hitLines = []
+            if cacheClass.collectStatistics:
+                hitLines.append("%s.%s.hits += 1" % \
+                        (ref, pathClass.statisticsAttrName))
+            if pathClass._IsLimited(cls, cacheClass):
+                hitLines.append("%s.move_to_end(%s)" % (rowsRef, keyArgs))
+            if cls.timeToLive is not None and cls.loadAllRowsOnFirstLoad:
+                hitLines.append("if _time() > %s.allRowsExpiryTime:" % ref)
+                hitLines.append("    %s.RefreshLater(self)" % ref)
+            elif cls.timeToLive is not None:
+                hitLines.append("if _time() > %s.%s.get(%s, 0):" % \
+                        (ref, pathClass.expiryAttrName, keyArgs))
+                hitLines.append("    %s.RefreshLater(self, %r, %s)" % \
+                        (ref, pathClass.name, ", ".join(processedArgs)))
+            if hitLines:
+                methodLines = [
+                        "try:",
+                        "    value = %s[%s]" % (rowsRef, keyArgs)
+                ] + ["    " + l for l in hitLines] + [
+                        "except KeyError:",
+                        loadLine,
+                        "return value"
+                ]
+            else:
+                methodLines = [
+                        "try:",
+                        "    return %s[%s]" % (rowsRef, keyArgs),
+                        "except KeyError:",
+                        loadLine
+                ]
             cls._GenerateMethod(cacheClass, pathClass.cacheAttrName,
                     methodLines, *pathClass.retrievalAttrNames)
+            methodLines = [
+                    "return %s.LoadMany(self, %r, keys)" % \
+                            (ref, pathClass.name)
+            ]
+            cls._GenerateMethod(cacheClass, "%sMany" % pathClass.cacheAttrName,
+                    methodLines, "keys")
+            cacheClass.pathMethodNames[pathClass.cacheAttrName] = \
+                    (cls.cacheAttrName, pathClass.name)
+
+    @classmethod
+    def _GenerateRangeCacheMethod(cls, cacheClass, pathClass, generationRef):
+        ref = "self.%s" % cls.cacheAttrName
+        methodLines = [
+                "if not %s.allRowsLoaded:" % generationRef,
+                "    %s.LoadAllRows(self)" % ref
+        ]
+        if cacheClass.collectStatistics:
+            methodLines.append("else:")
+            methodLines.append("    %s.%s.hits += 1" % \
+                    (ref, pathClass.statisticsAttrName))
+        if cls.timeToLive is not None:
+            methodLines.append("if _time() > %s.allRowsExpiryTime:" % ref)
+            methodLines.append("    %s.RefreshLater(self)" % ref)
+        methodLines.append("return %s.pathsByName[%r].Search(lower, upper, "
+                "prefix, limit, descending, %s.%s)" % (ref, pathClass.name,
+                generationRef, pathClass.subCacheAttrName))
+        cls._GenerateMethod(cacheClass, pathClass.cacheAttrName, methodLines,
+                "lower = None", "upper = None", "prefix = None",
+                "limit = None", "descending = False")
+
+    def _BeginWrite(self):
+        """Called with the lock held before the rows or path indexes are
+           modified; copy on write subcaches copy them first so that the
+           published generation is left untouched."""
+        self.writeDepth += 1
+        if self.copyOnWrite and self.writeDepth == 1:
+            for path in self.paths:
+                if isinstance(path, MultipleRowPath):
+                    path.rows = dict((k, v.Copy()) \
+                            for k, v in path.rows.items())
+                elif isinstance(path, RangePath):
+                    path.rows = path.rows.Copy()
+                else:
+                    path.rows = path.rows.copy()
+                setattr(self, path.subCacheAttrName, path.rows)
+            self.allRows = self.allRows.Copy()
+
+    def _EndWrite(self):
+        """Called with the lock held once the rows and path indexes have been
+           modified; copy on write subcaches publish a new generation."""
+        self.writeDepth -= 1
+        if self.writeDepth == 0:
+            for path in self.rangePaths:
+                path.rows.Sort()
+            if self.copyOnWrite:
+                self._PublishGeneration()
 
     def _CopyAttrs(self, row, externalRow, contextItem):
         for attrName in row.attrNames + row.extraAttrNames:
@@ -250,24 +1311,627 @@ class SubCache(object, metaclass = SubCacheMetaClass):
                 continue
             setattr(row, attrName, value)
 
-    def _FindRow(self, externalRow, errorIfMissing = False):
+    def _EnforceLimits(self, cache):
+        with self.lock:
+            for path in self.limitedPaths:
+                maxEntries = path.GetMaxEntries()
+                if maxEntries is not None:
+                    self._EvictEntries(cache, path, maxEntries)
+            budget = self._GetMemoryBudget(cache)
+            if budget is None:
+                return
+            estimatedBytes = self.EstimateMemory()["total"]
+            if estimatedBytes > budget:
+                fraction = max(0, budget) / estimatedBytes
+                cx_Logging.Debug("%s: approximately %d bytes in use, "
+                        "evicting entries to meet budget of %d bytes",
+                        self.name, estimatedBytes, budget)
+                for path in self.limitedPaths:
+                    maxEntries = int(len(path.rows) * fraction)
+                    self._EvictEntries(cache, path, maxEntries)
+                self.EstimateMemory()
+
+    def _EvictEntries(self, cache, path, maxEntries):
+        while len(path.rows) > maxEntries:
+            key, value = path.rows.popitem(last = False)
+            path.expiryTimes.pop(key, None)
+            path.statistics.evictions += 1
+            cx_Logging.Debug("%s: evicting entry %r from path %s",
+                    self.name, key, path.name)
+            rows = value if isinstance(path, MultipleRowPath) else [value]
+            for row in rows:
+                self._EvictRow(cache, row)
+
+    def _EvictRow(self, cache, row):
+        for path in self.paths:
+            key = path.GetKeyValue(row)
+            if isinstance(path, SingleRowPath):
+                if path.rows.get(key) is row:
+                    del path.rows[key]
+                    path.expiryTimes.pop(key, None)
+                    path.statistics.evictions += 1
+            else:
+                rows = path.rows.get(key)
+                if rows is not None and row in rows:
+                    del path.rows[key]
+                    path.expiryTimes.pop(key, None)
+                    path.statistics.evictions += 1
+        if self.allRowsLoaded:
+            self.allRows = RowSet()
+            self.allRowsLoaded = False
+
+    def _EstimateLoadSize(self, rows):
+        """Return the approximate number of bytes which would be used if the
+           rows were loaded into the subcache."""
+        sample = rows[:self.memorySampleSize]
+        rowSetEntrySize = (_dictEntrySize + sys.getsizeof(len(rows))) * 2
+        size = _EstimateRowsSize(iter(rows), len(rows),
+                self.memorySampleSize) + len(rows) * rowSetEntrySize
+        for path in self.paths:
+            if isinstance(path, MultipleRowPath):
+                size += len(rows) * rowSetEntrySize
+                continue
+            keySize = sum(_EstimateKeySize(path.GetKeyValue(r)) \
+                    for r in sample)
+            size += len(rows) * (_dictEntrySize + keySize // len(sample))
+        return size
+
+    def _FindRowByPrimaryKey(self, key, rowsByKey = None):
+        pkAttrNames = list(self.rowClass.pkAttrNames)
+        for path in self.singleRowPaths:
+            if path.retrievalAttrNames == pkAttrNames:
+                return path.rows.get(key[0] if len(key) == 1 else key)
+        if rowsByKey is None:
+            rowsByKey = self._GetRowsByPrimaryKey()
+        return rowsByKey.get(key)
+
+    def _GetRowsByPrimaryKey(self):
+        """Return a dictionary of the cached rows keyed by primary key tuple
+           for subcaches which have no single row path by primary key; if
+           there are no single row paths either, the rows are found in the
+           groups of the multiple row paths."""
+        if self.allRowsLoaded:
+            rows = self.allRows
+        elif self.singleRowPaths:
+            rows = self.singleRowPaths[0].rows.values()
+        else:
+            rows = itertools.chain.from_iterable(r for p in self.paths \
+                    if isinstance(p, MultipleRowPath) \
+                    for r in p.rows.values())
+        return dict((r.GetPrimaryKeyTuple(), r) for r in rows)
+
+    def _GetCachedRows(self, exact):
+        """Return an iterator over the cached rows and the number of rows;
+           unless exact is true, only the rows in the largest path are
+           returned. The index of a range path is treated as a single group
+           of rows."""
+        if self.allRowsLoaded:
+            return iter(self.allRows), len(self.allRows)
+        if exact:
+            rows = RowSet()
+            for path in self.paths:
+                if isinstance(path, RangePath):
+                    rows.extend(path.rows)
+                    continue
+                for value in path.rows.values():
+                    if isinstance(path, SingleRowPath):
+                        rows.append(value)
+                    else:
+                        rows.extend(value)
+            return iter(rows), len(rows)
+        if self.singleRowPaths:
+            rows = max((p.rows for p in self.singleRowPaths), key = len)
+            return iter(rows.values()), len(rows)
+        numRows, groups = 0, ()
+        for path in self.paths:
+            if isinstance(path, RangePath):
+                pathGroups = (path.rows,)
+            else:
+                pathGroups = path.rows.values()
+            pathNumRows = sum(len(g) for g in pathGroups)
+            if pathNumRows >= numRows:
+                numRows, groups = pathNumRows, pathGroups
+        return itertools.chain.from_iterable(groups), numRows
+
+    def _GetLoadedRows(self, cache, path):
+        """Return the rows indexed by the path, loading all rows first if
+           necessary; copy on write subcaches return those of the current
+           generation."""
+        for unresolvedRows in self._GetUnresolvedRows(cache):
+            if unresolvedRows.allRows is not None:
+                return unresolvedRows.valuesByPath[path.name]
+        if self.copyOnWrite:
+            generation = self.generation
+            if not generation.allRowsLoaded:
+                self.LoadAllRows(cache)
+                generation = self.generation
+            return getattr(generation, path.subCacheAttrName)
+        if not self.allRowsLoaded:
+            self.LoadAllRows(cache)
+        return path.rows
+
+    def _GetUnresolvedRows(self, cache):
+        """Return the rows of the subcache being resolved by the current
+           thread, most recently loaded first."""
+        stack = getattr(cache.threadLocal, "unresolvedRows", None)
+        if not stack:
+            return []
+        return [u for u in reversed(stack) if u.subCacheName == self.name]
+
+    def _GetMemoryBudget(self, cache):
+        """Return the number of bytes the subcache may use, taking into
+           account the memory budgets of both the subcache and the cache."""
+        budget = self.memoryBudget
+        if cache.memoryBudget is not None:
+            otherBytes = sum(s.estimatedBytes for s in cache.subCaches \
+                    if s is not self)
+            availableBytes = cache.memoryBudget - otherBytes
+            if budget is None or availableBytes < budget:
+                budget = availableBytes
+        return budget
+
+    def _ForgetMisses(self, rows):
+        for path in self.singleRowPaths:
+            if path.misses:
+                for row in rows:
+                    path.misses.pop(path.GetKeyValue(row), None)
+
+    def _FindRow(self, externalRow, errorIfMissing = False,
+            rowsByKey = None):
         row = None
+        searched = False
         for path in self.singleRowPaths:
             if path.ignoreRowNotCached:
                 continue
+            searched = True
             key = path.GetKeyValue(externalRow)
             row = path.rows.get(key)
             if row is not None:
                 break
+        if not searched:
+            key = tuple(getattr(externalRow, n, None) \
+                    for n in self.rowClass.pkAttrNames)
+            row = self._FindRowByPrimaryKey(key, rowsByKey)
         if errorIfMissing and row is None:
             raise cx_Exceptions.NoDataFound()
         return row
 
-    def Clear(self):
-        self.allRows = []
-        self.allRowsLoaded = False
+    def _ReplaceRow(self, cache, row, newRow):
         for path in self.paths:
-            path.Clear()
+            key = path.GetKeyValue(row)
+            if isinstance(path, SingleRowPath):
+                if path.rows.get(key) is row:
+                    del path.rows[key]
+            elif isinstance(path, RangePath):
+                path.rows.Remove(key, row)
+            else:
+                rows = path.rows.get(key)
+                if rows is None:
+                    continue
+                elif path.GetKeyValue(newRow) == key:
+                    rows.Replace(row, newRow)
+                else:
+                    rows.remove(row)
+        self.OnLoadRow(cache, newRow)
+        self._ForgetMisses([newRow])
+        if not self.loadAllRowsOnFirstLoad:
+            for path in self.paths:
+                if isinstance(path, MultipleRowPath):
+                    rows = path.rows.get(path.GetKeyValue(newRow))
+                    if rows is not None:
+                        rows.append(newRow)
+        if self.allRowsLoaded:
+            self.allRows.Replace(row, newRow)
+
+    def _Refresh(self, cache, pathName, args):
+        try:
+            if pathName is None:
+                self._RefreshAllRows(cache)
+            else:
+                self._RefreshPath(cache, self.pathsByName[pathName], args)
+        finally:
+            with self.lock:
+                self.refreshesPending.discard((pathName, args))
+
+    def _RefreshAllRows(self, cache):
+        rows = self.GetAllRowsFromDataSource(cache)
+        self.ResolveRows(cache, rows)
+        newSubCache = self.__class__(cache)
+        newSubCache.OnLoadRows(cache, rows)
+        for path in newSubCache.rangePaths:
+            path.rows.Sort()
+        with self.lock:
+            for path, newPath in zip(self.paths, newSubCache.paths):
+                setattr(self, path.subCacheAttrName, newPath.rows)
+                path.rows = newPath.rows
+            self.allRows = RowSet(rows)
+            self.allRowsLoaded = True
+            if self.copyOnWrite:
+                self._PublishGeneration()
+            if self.timeToLive is not None:
+                self.allRowsExpiryTime = time.monotonic() + self.timeToLive
+
+    def _RefreshPath(self, cache, path, args):
+        key = args[0] if len(args) == 1 else args
+        rows = path.GetRowsFromDataSource(cache, *args)
+        if isinstance(path, SingleRowPath) and len(rows) > 1:
+            raise cx_Exceptions.TooManyRows(numRows = len(rows))
+        self.ResolveRows(cache, rows)
+        with self.lock:
+            newRows = []
+            for row in rows:
+                oldRow = self._FindRow(row)
+                if oldRow is None:
+                    self.OnLoadRow(cache, row)
+                else:
+                    self._ReplaceRow(cache, oldRow, row)
+                newRows.append(row)
+            oldValue = path.rows.get(key)
+            if isinstance(path, SingleRowPath):
+                oldRows = [] if oldValue is None else [oldValue]
+            else:
+                oldRows = oldValue or []
+                path.rows[key] = RowSet(newRows)
+            for row in oldRows:
+                if row not in newRows:
+                    self._EvictRow(cache, row)
+            if self.timeToLive is not None:
+                expiryTime = time.monotonic() + self.timeToLive
+                self._SetExpiryTimes(newRows, expiryTime)
+                if newRows:
+                    path.expiryTimes[key] = expiryTime
+
+    def _RemoveRow(self, cache, row):
+        cx_Logging.Debug("%s: removing row %s", self.name, row)
+        self._BeginWrite()
+        try:
+            self.OnRemoveRow(cache, row)
+            if self.allRowsLoaded:
+                self.allRows.remove(row)
+        finally:
+            self._EndWrite()
+
+    def _SetExpiryTimes(self, rows, expiryTime):
+        for path in self.singleRowPaths:
+            for row in rows:
+                path.expiryTimes[path.GetKeyValue(row)] = expiryTime
+
+    def _NewRow(self, row, externalRow, contextItem):
+        """Return the new row which is to be added (if the row is None) or
+           which is to replace the row when the external row is applied, or
+           None if the row is to be modified in place instead."""
+        if row is not None and not self.rowClass.readOnly \
+                and not self.copyOnWrite:
+            return None
+        newRow = self.rowClass.New() if row is None else row.Copy()
+        self._CopyAttrs(newRow, externalRow, contextItem)
+        return newRow.Freeze()
+
+    def _IsChangeIgnored(self, row, multipleRowPaths, rowsByKey = None):
+        """Return true if a row changed in the database is neither cached nor
+           part of a cached group and is therefore ignored by a delta
+           refresh."""
+        if self.loadAllRowsOnFirstLoad or not multipleRowPaths \
+                or self._FindRow(row, rowsByKey = rowsByKey) is not None:
+            return False
+        return all(p.GetKeyValue(row) not in p.rows for p in multipleRowPaths)
+
+    def _UpdateRow(self, cache, externalRow, contextItem, row, newRow):
+        if row is None:
+            cx_Logging.Debug("%s: creating new row with source as %s",
+                    self.name, externalRow)
+            self.OnLoadRow(cache, newRow)
+            self._ForgetMisses([newRow])
+            if not self.loadAllRowsOnFirstLoad:
+                for path in self.paths:
+                    if isinstance(path, MultipleRowPath):
+                        key = path.GetKeyValue(newRow)
+                        rows = path.rows.get(key)
+                        if rows is None:
+                            path.rows[key] = RowSet([newRow])
+                        else:
+                            rows.append(newRow)
+            if self.allRowsLoaded:
+                self.allRows.append(newRow)
+        elif newRow is not None:
+            cx_Logging.Debug("%s: replacing row %s", self.name, row)
+            self._ReplaceRow(cache, row, newRow)
+        else:
+            cx_Logging.Debug("%s: modifying row %s", self.name, row)
+            beforeKeyValues = []
+            for path in self.singleRowPaths + self.rangePaths:
+                beforeKeyValues.append((path, path.GetKeyValue(row)))
+            self._CopyAttrs(row, externalRow, contextItem)
+            for path, beforeKeyValue in beforeKeyValues:
+                afterKeyValue = path.GetKeyValue(row)
+                if afterKeyValue == beforeKeyValue:
+                    continue
+                if isinstance(path, RangePath):
+                    path.rows.Remove(beforeKeyValue, row)
+                    path.rows.Add(afterKeyValue, row)
+                else:
+                    del path.rows[beforeKeyValue]
+                    path.rows[afterKeyValue] = row
+                    path.misses.pop(afterKeyValue, None)
+            method = getattr(self, self.setExtraAttrValuesMethodName, None)
+            if method is not None:
+                method(cache, row)
+
+    def _LoadSingleFlight(self, cache, loadKey, cachedValueFunc, loadFunc,
+            *args):
+        """Load the value once for all of the threads requesting it at the
+           same time. A thread which is resolving rows loads the value itself
+           instead of waiting, since the thread loading it may in turn be
+           waiting for the rows being resolved."""
+        with self.lock:
+            value = cachedValueFunc()
+            if value is not None:
+                return value
+            pendingLoad = self.loadsPending.get(loadKey)
+            isOwner = pendingLoad is None
+            if isOwner:
+                pendingLoad = self.loadsPending[loadKey] = _PendingLoad()
+        if not isOwner and cache._IsResolving():
+            return loadFunc(*args)
+        if not isOwner:
+            pendingLoad.event.wait()
+            if pendingLoad.exc is not None:
+                raise pendingLoad.exc
+            return pendingLoad.value
+        try:
+            pendingLoad.value = loadFunc(*args)
+        except BaseException as e:
+            pendingLoad.exc = e
+            raise
+        finally:
+            with self.lock:
+                del self.loadsPending[loadKey]
+            pendingLoad.event.set()
+        return pendingLoad.value
+
+    def _LoadCoalesced(self, cache, path, key):
+        with self.lock:
+            value = path.rows.get(key)
+            if value is not None:
+                return value
+            pendingLoad = self.coalescedLoadsPending.get(path.name)
+            isOwner = pendingLoad is None
+            if isOwner:
+                pendingLoad = self.coalescedLoadsPending[path.name] = \
+                        _PendingLoad()
+            pendingLoad.keys[key] = None
+        if isOwner:
+            with self.lock:
+                isRunning = self.coalescedLoadsRunning[path.name] > 0
+            if isRunning:
+                time.sleep(self.coalesceWindow)
+            with self.lock:
+                del self.coalescedLoadsPending[path.name]
+                self.coalescedLoadsRunning[path.name] += 1
+            try:
+                if self.tracePathLoads:
+                    cx_Logging.Debug("%s: loading %d coalesced keys by "
+                            "path %s", self.name, len(pendingLoad.keys),
+                            path.name)
+                pendingLoad.value = path.LoadMany(cache, self,
+                        list(pendingLoad.keys), pendingLoad.errors)
+                if self.limitedPaths:
+                    self._EnforceLimits(cache)
+            except BaseException as e:
+                pendingLoad.exc = e
+                raise
+            finally:
+                with self.lock:
+                    self.coalescedLoadsRunning[path.name] -= 1
+                pendingLoad.event.set()
+        else:
+            pendingLoad.event.wait()
+            if pendingLoad.exc is not None:
+                raise pendingLoad.exc
+        exc = pendingLoad.errors.get(key)
+        if exc is not None:
+            raise exc
+        value = pendingLoad.value.get(key)
+        if value is None:
+            raise cx_Exceptions.NoDataFound()
+        return value
+
+    def _InitHighWaterMark(self, cache):
+        if self.highWaterMark is not _missing:
+            return
+        if self.changeTrackingAttrName is not None:
+            self.highWaterMark = cache.dataSource.GetMaximumValue(
+                    self.rowClass.tableName, self.changeTrackingAttrName)
+        elif self.changeLogRowClass is not None:
+            self.highWaterMark = cache.dataSource.GetMaximumValue(
+                    self.changeLogRowClass.tableName,
+                    self.changeLogSequenceAttrName)
+
+    def _GetChangedRows(self, cache):
+        """Return the rows changed since the high water mark, the primary
+           keys of the rows removed since then and the new high water
+           mark."""
+        dataSource = cache.dataSource
+        if self.changeTrackingAttrName is not None:
+            conditions = {}
+            if self.highWaterMark is not None:
+                name = "%s__gt" % self.changeTrackingAttrName
+                conditions[name] = self.highWaterMark
+            rows = self.rowClass.GetRows(dataSource, **conditions)
+            values = [getattr(r, self.changeTrackingAttrName) for r in rows]
+            return rows, [], self._GetHighWaterMark(values)
+        logRowClass = self.changeLogRowClass
+        keyAttrNames = self.changeLogKeyAttrNames or self.rowClass.pkAttrNames
+        conditions = {}
+        if self.highWaterMark is not None:
+            name = "%s__gt" % self.changeLogSequenceAttrName
+            conditions[name] = self.highWaterMark
+        logRows = logRowClass.GetRows(dataSource, **conditions)
+        sequenceAttrName = self.changeLogSequenceAttrName
+        logRows.sort(key = lambda r: getattr(r, sequenceAttrName))
+        operationsByKey = {}
+        for logRow in logRows:
+            key = tuple(getattr(logRow, n) for n in keyAttrNames)
+            operationsByKey[key] = getattr(logRow,
+                    self.changeLogOperationAttrName, None)
+        removedKeys = set(k for k, o in operationsByKey.items() \
+                if o in self.changeLogDeleteOperations)
+        changedKeys = [k for k in operationsByKey if k not in removedKeys]
+        rows = []
+        pkAttrNames = self.rowClass.pkAttrNames
+        if len(pkAttrNames) == 1:
+            name = "%s__in" % pkAttrNames[0]
+            batchSize = self.rowClass.deferredBatchSize
+            for i in range(0, len(changedKeys), batchSize):
+                conditions = { name : [k[0] for k in \
+                        changedKeys[i:i + batchSize]] }
+                rows.extend(self.rowClass.GetRows(dataSource, **conditions))
+        else:
+            for key in changedKeys:
+                conditions = dict(zip(pkAttrNames, key))
+                rows.extend(self.rowClass.GetRows(dataSource, **conditions))
+        foundKeys = set(r.GetPrimaryKeyTuple() for r in rows)
+        removedKeys.update(k for k in changedKeys if k not in foundKeys)
+        values = [getattr(r, self.changeLogSequenceAttrName) for r in logRows]
+        return rows, removedKeys, self._GetHighWaterMark(values)
+
+    def _GetHighWaterMark(self, values):
+        values = [v for v in values if v is not None]
+        if self.highWaterMark is not None:
+            values.append(self.highWaterMark)
+        return max(values) if values else None
+
+    def _LoadPath(self, cache, path, args):
+        value = path.Load(cache, self, *args)
+        if self.limitedPaths:
+            self._EnforceLimits(cache)
+        return value
+
+    def _PublishGeneration(self):
+        self.generation = SubCacheGeneration(self)
+
+    def _ResolveRows(self, cache, rows, unresolvedRows):
+        method = getattr(self, self.onResolveRowMethodName, None)
+        if method is None or not rows:
+            return
+        stack = getattr(cache.threadLocal, "unresolvedRows", None)
+        if stack is None:
+            stack = cache.threadLocal.unresolvedRows = []
+        stack.append(unresolvedRows)
+        try:
+            if len(rows) > 1 and self.onLoadRowExtraDirectives:
+                self._ResolveExtraDirectives(cache, rows)
+            for row in rows:
+                method(cache, row)
+        finally:
+            stack.pop()
+
+    def _ResolveExtraDirectives(self, cache, rows):
+        """Load the values referenced by the extra directives for all of the
+           rows at once so that the generated method only finds cached
+           values instead of loading them one row at a time."""
+        for attrName, cacheMethodName, sourceAttrName in \
+                self.onLoadRowExtraDirectives:
+            method = getattr(cache, "%sMany" % cacheMethodName, None)
+            if method is None:
+                continue
+            keys = set(getattr(r, sourceAttrName) for r in rows)
+            keys.discard(None)
+            if len(keys) > 1:
+                method(list(keys))
+
+    def GetSnapshotData(self):
+        """Return the data saved in a snapshot of the cache."""
+        paths = dict((p.name, dict(p.rows)) for p in self.paths \
+                if not isinstance(p, RangePath))
+        data = dict(allRowsLoaded = self.allRowsLoaded,
+                allRows = self.allRows, paths = paths)
+        if self.highWaterMark is not _missing:
+            data["highWaterMark"] = self.highWaterMark
+        return data
+
+    def RestoreSnapshotData(self, data):
+        """Replace the contents of the subcache with the data restored from a
+           snapshot; entries subject to a time to live are marked as
+           expired so that they are refreshed when first accessed and delta
+           refreshes resume from the high water mark of the snapshot."""
+        with self.lock:
+            self._BeginWrite()
+            try:
+                self.Clear()
+                for path in self.paths:
+                    if isinstance(path, RangePath):
+                        for row in data["allRows"]:
+                            path.rows.Add(path.GetKeyValue(row), row)
+                    else:
+                        path.rows.update(data["paths"][path.name])
+                self.allRows = data["allRows"]
+                self.allRowsLoaded = data["allRowsLoaded"]
+                self.highWaterMark = data.get("highWaterMark", _missing)
+            finally:
+                self._EndWrite()
+
+    def Revalidate(self, cache):
+        """Reload all of the rows in the subcache from the database,
+           replacing rows which have changed and evicting rows which no
+           longer exist."""
+        if self.allRowsLoaded:
+            self._RefreshAllRows(cache)
+            return
+        for path in self.paths:
+            for key in list(path.rows):
+                args = key if len(path.retrievalAttrNames) > 1 else (key,)
+                self._RefreshPath(cache, path, args)
+
+    def EstimateMemory(self, exact = False):
+        """Return a dictionary containing the approximate number of bytes
+           used by the rows of the subcache, by the index of each of its
+           paths and in total. Unless exact is true, the sizes are
+           extrapolated from a sample of memorySampleSize rows and entries
+           and rows cached only by paths other than the largest are not
+           counted."""
+        sampleSize = None if exact else self.memorySampleSize
+        with self.lock:
+            rows, numRows = self._GetCachedRows(exact)
+            rowBytes = _EstimateRowsSize(rows, numRows, sampleSize)
+            pathBytes = dict((p.name, p.EstimateIndexSize(sampleSize)) \
+                    for p in self.paths)
+            totalBytes = rowBytes + sum(pathBytes.values()) + \
+                    self.allRows.GetIndexSize()
+        self.estimatedBytes = totalBytes
+        return dict(rows = rowBytes, paths = pathBytes, total = totalBytes)
+
+    def GetStatistics(self):
+        """Return a dictionary describing the statistics for the subcache
+           (loads of all rows) and each of its paths, including the
+           estimated memory used."""
+        memory = self.EstimateMemory()
+        report = self.statistics.GetReport()
+        report["allRowsLoaded"] = self.allRowsLoaded
+        report["numRows"] = len(self.allRows)
+        report["estimatedBytes"] = memory["total"]
+        report["estimatedRowBytes"] = memory["rows"]
+        report["memoryBudget"] = self.memoryBudget
+        report["paths"] = paths = {}
+        for path in self.paths:
+            paths[path.name] = pathReport = path.statistics.GetReport()
+            pathReport["entries"] = len(path.rows)
+            pathReport["cachedMisses"] = len(path.misses)
+            pathReport["estimatedIndexBytes"] = memory["paths"][path.name]
+        return report
+
+    def Clear(self):
+        with self.lock:
+            self._BeginWrite()
+            try:
+                self.allRows = RowSet()
+                self.allRowsLoaded = False
+                self.allRowsExpiryTime = 0
+                self.highWaterMark = _missing
+                for path in self.paths:
+                    path.Clear()
+            finally:
+                self._EndWrite()
 
     def GetAllRowsFromDataSource(self, cache):
         return self.rowClass.GetRows(cache.dataSource)
@@ -277,90 +1941,299 @@ class SubCache(object, metaclass = SubCacheMetaClass):
             cx_Logging.Debug("%s: loading rows by path %s with args %s",
                     self.name, pathName, args)
         path = self.pathsByName[pathName]
+        if self.collectStatistics:
+            path.statistics.misses += 1
         actualArgs = []
         for attrName, value in zip(path.retrievalAttrNames, args):
             if isinstance(value, ceDatabase.Row):
                 value = getattr(value, attrName)
             actualArgs.append(value)
         actualArgs = tuple(actualArgs)
+        key = actualArgs[0] if len(actualArgs) == 1 else actualArgs
+        for unresolvedRows in self._GetUnresolvedRows(cache):
+            rows = unresolvedRows.valuesByPath.get(path.name)
+            if rows is not None and key in rows:
+                return rows[key]
         if self.loadAllRowsOnFirstLoad:
-            if not self.allRowsLoaded:
-                self.LoadAllRows(cache)
-            return path.GetCachedValue(actualArgs)
-        return path.Load(cache, self, *actualArgs)
+            rows = self._GetLoadedRows(cache, path)
+            return path.GetCachedValue(actualArgs, rows)
+        if path.misses and path.IsCachedMiss(key):
+            raise cx_Exceptions.NoDataFound()
+        if self.coalesceWindow is not None and key is not None \
+                and not cache._IsResolving():
+            return self._LoadCoalesced(cache, path, key)
+        if self.threadSafe:
+            return self._LoadSingleFlight(cache, (pathName, actualArgs),
+                    lambda: path.rows.get(key), self._LoadPath, cache, path,
+                    actualArgs)
+        return self._LoadPath(cache, path, actualArgs)
+
+    def LoadMany(self, cache, pathName, keys):
+        """Return the values cached by the path for each of the keys (None or
+           an empty list if no rows exist for a key); values already cached
+           are returned directly and all of the others are loaded together."""
+        path = self.pathsByName[pathName]
+        keys = [path.GetKey(k) for k in keys]
+        if self.loadAllRowsOnFirstLoad:
+            rows = self._GetLoadedRows(cache, path)
+            return [rows.get(k) or path.OnRowNotCached(k) for k in keys]
+        values = [path.rows.get(k) for k in keys]
+        if self.collectStatistics:
+            numMisses = values.count(None)
+            path.statistics.hits += len(values) - numMisses
+            path.statistics.misses += numMisses
+        for unresolvedRows in self._GetUnresolvedRows(cache):
+            rows = unresolvedRows.valuesByPath.get(path.name, {})
+            values = [rows.get(k) if v is None else v \
+                    for k, v in zip(keys, values)]
+        missingKeys = {}
+        now = time.monotonic()
+        for key, value in zip(keys, values):
+            if value is None:
+                if key is not None \
+                        and not (path.misses and path.IsCachedMiss(key)):
+                    missingKeys[key] = None
+                continue
+            if path.isLimited:
+                try:
+                    path.rows.move_to_end(key)
+                except KeyError:
+                    pass
+            if path.timeToLive is not None \
+                    and now > path.expiryTimes.get(key, 0):
+                args = key if len(path.retrievalAttrNames) > 1 else (key,)
+                self.RefreshLater(cache, pathName, *args)
+        if missingKeys:
+            if self.tracePathLoads:
+                cx_Logging.Debug("%s: loading %d keys by path %s", self.name,
+                        len(missingKeys), pathName)
+            loadedValues = path.LoadMany(cache, self, list(missingKeys))
+            if self.limitedPaths:
+                self._EnforceLimits(cache)
+            values = [loadedValues.get(k) if v is None else v \
+                    for k, v in zip(keys, values)]
+        return [path.OnRowNotCached(k) if v is None else v \
+                for k, v in zip(keys, values)]
 
     def LoadAllRows(self, cache):
+        for unresolvedRows in self._GetUnresolvedRows(cache):
+            if unresolvedRows.allRows is not None:
+                return unresolvedRows.allRows
+        if self.threadSafe:
+            return self._LoadSingleFlight(cache, None,
+                    lambda: self.allRows if self.allRowsLoaded else None,
+                    self._LoadAllRows, cache)
+        return self._LoadAllRows(cache)
+
+    def _LoadAllRows(self, cache):
         if self.tracePathLoads:
             cx_Logging.Debug("%s: loading all rows", self.name)
+        self._InitHighWaterMark(cache)
+        if self.collectStatistics:
+            startTime = time.perf_counter()
         rows = self.GetAllRowsFromDataSource(cache)
-        self.OnLoadRows(cache, rows)
-        self.allRows = rows
-        self.allRowsLoaded = True
+        if self.collectStatistics:
+            self.statistics.RecordLoad(time.perf_counter() - startTime,
+                    len(rows))
+        budget = self._GetMemoryBudget(cache)
+        if budget is not None and rows:
+            requiredBytes = self._EstimateLoadSize(rows)
+            if requiredBytes > budget:
+                raise MemoryBudgetExceeded(subCacheName = self.name,
+                        requiredBytes = requiredBytes, budget = budget)
+        allRows = RowSet(rows)
+        if hasattr(self, self.onResolveRowMethodName):
+            newSubCache = self.__class__(cache)
+            newSubCache.OnLoadRows(cache, rows)
+            valuesByPath = dict((p.name, p.rows) for p in newSubCache.paths)
+            self._ResolveRows(cache, rows,
+                    _UnresolvedRows(self.name, valuesByPath, allRows))
+        with self.lock:
+            self._BeginWrite()
+            try:
+                self.OnLoadRows(cache, rows)
+                self.allRows = allRows
+                self.allRowsLoaded = True
+            finally:
+                self._EndWrite()
+            if self.timeToLive is not None:
+                self.allRowsExpiryTime = time.monotonic() + self.timeToLive
+        if budget is not None:
+            self.EstimateMemory()
         return self.allRows
 
     def OnLoadRows(self, cache, rows):
+        """Add the rows to the indexes of the paths; called with the lock
+           held. The rows are resolved separately (see ResolveRows())."""
         method = getattr(self, self.onLoadRowMethodName, None)
         if method is not None:
             for row in rows:
                 method(cache, row)
+        self._ForgetMisses(rows)
+        if self.timeToLive is not None and not self.loadAllRowsOnFirstLoad:
+            self._SetExpiryTimes(rows, time.monotonic() + self.timeToLive)
+
+    def RefreshDelta(self, cache):
+        """Apply the changes made to rows since the last refresh (or since
+           the subcache was first loaded), as identified by the change
+           tracking attribute or the change log, and return the number of
+           changes applied. Changed rows which are not cached and do not
+           belong to a cached group are ignored unless all rows are
+           loaded."""
+        if self.highWaterMark is _missing:
+            return 0
+        rows, removedKeys, highWaterMark = self._GetChangedRows(cache)
+        multipleRowPaths = [p for p in self.paths \
+                if isinstance(p, MultipleRowPath)]
+        with self.lock:
+            rowsByKey = None
+            if rows and not self.singleRowPaths:
+                rowsByKey = self._GetRowsByPrimaryKey()
+            rows = [r for r in rows \
+                    if not self._IsChangeIgnored(r, multipleRowPaths,
+                            rowsByKey)]
+        self.ResolveRows(cache, rows)
+        numChanges = 0
+        with self.lock:
+            rowsByKey = None
+            if not self.singleRowPaths:
+                rowsByKey = self._GetRowsByPrimaryKey()
+            self._BeginWrite()
+            try:
+                for key in removedKeys:
+                    row = self._FindRowByPrimaryKey(key, rowsByKey)
+                    if row is not None:
+                        self._RemoveRow(cache, row)
+                        numChanges += 1
+                self._ForgetMisses(rows)
+                for row in rows:
+                    if self._IsChangeIgnored(row, multipleRowPaths,
+                            rowsByKey):
+                        continue
+                    groupsNotLoaded = []
+                    if not self.loadAllRowsOnFirstLoad:
+                        for path in multipleRowPaths:
+                            key = path.GetKeyValue(row)
+                            if key not in path.rows:
+                                groupsNotLoaded.append((path, key))
+                    existingRow = self._FindRow(row, rowsByKey = rowsByKey)
+                    if existingRow is not None \
+                            and not self.rowClass.readOnly:
+                        for path in multipleRowPaths:
+                            if path.GetKeyValue(row) != \
+                                    path.GetKeyValue(existingRow):
+                                self._RemoveRow(cache, existingRow)
+                                existingRow = None
+                                break
+                    newRow = self._NewRow(existingRow, row, None)
+                    self._UpdateRow(cache, row, None, existingRow, newRow)
+                    for path, key in groupsNotLoaded:
+                        path.rows.pop(key, None)
+                    numChanges += 1
+            finally:
+                self._EndWrite()
+            self.highWaterMark = highWaterMark
+        if self.limitedPaths:
+            self._EnforceLimits(cache)
+        cx_Logging.Debug("%s: applied %d changes, high water mark now %r",
+                self.name, numChanges, highWaterMark)
+        return numChanges
+
+    def RefreshLater(self, cache, pathName = None, *args):
+        """Reload the rows for the given path and arguments (or all rows if
+           no path is specified) on one of the background threads of the
+           cache; the rows currently cached continue to be returned until the
+           load completes."""
+        refreshKey = (pathName, args)
+        with self.lock:
+            if refreshKey in self.refreshesPending:
+                return
+            self.refreshesPending.add(refreshKey)
+        cx_Logging.Debug("%s: refreshing expired rows by path %s with args %s",
+                self.name, pathName, args)
+        cache._CallInBackground(self._Refresh, cache, pathName, args)
 
     def RemoveRow(self, cache, externalRow):
-        row = self._FindRow(externalRow, errorIfMissing = True)
-        cx_Logging.Debug("%s: removing row %s", self.name, row)
-        self.OnRemoveRow(cache, row)
-        if self.allRowsLoaded:
-            self.allRows.remove(row)
+        with self.lock:
+            row = self._FindRow(externalRow, errorIfMissing = True)
+            self._RemoveRow(cache, row)
+
+    def ResolveRows(self, cache, rows, pathName = None, values = None):
+        """Set the extra attributes of rows before they are added to the
+           subcache. This is done without holding the lock since it may load
+           rows into other subcaches (and acquire their locks). Until it is
+           done, lookups made by the current thread find the rows (and the
+           values being loaded by the path with the given name) so that rows
+           which refer to each other are not loaded again."""
+        if not rows or not hasattr(self, self.onResolveRowMethodName):
+            return
+        valuesByPath = dict((p.name, dict((p.GetKeyValue(r), r) \
+                for r in rows)) for p in self.singleRowPaths)
+        if pathName is not None:
+            valuesByPath.setdefault(pathName, {}).update(values)
+        self._ResolveRows(cache, rows,
+                _UnresolvedRows(self.name, valuesByPath))
 
     def UpdateRow(self, cache, externalRow, contextItem = None):
-        row = self._FindRow(externalRow)
-        if row is None:
-            cx_Logging.Debug("%s: creating new row with source as %s",
-                    self.name, externalRow)
-            row = self.rowClass.New()
-            self._CopyAttrs(row, externalRow, contextItem)
-            self.OnLoadRow(cache, row)
-            if not self.loadAllRowsOnFirstLoad:
-                for path in self.paths:
-                    if isinstance(path, MultipleRowPath):
-                        key = path.GetKeyValue(row)
-                        path.rows.setdefault(key, []).append(row)
-            if self.allRowsLoaded:
-                self.allRows.append(row)
-        else:
-            cx_Logging.Debug("%s: modifying row %s", self.name, row)
-            beforeKeyValues = []
-            for path in self.singleRowPaths:
-                beforeKeyValues.append((path, path.GetKeyValue(row)))
-            self._CopyAttrs(row, externalRow, contextItem)
-            for path, beforeKeyValue in beforeKeyValues:
-                afterKeyValue = path.GetKeyValue(row)
-                if afterKeyValue != beforeKeyValue:
-                    del path.rows[beforeKeyValue]
-                    path.rows[afterKeyValue] = row
-            method = getattr(self, self.setExtraAttrValuesMethodName, None)
-            if method is not None:
-                method(cache, row)
+        """Add the row or apply the changes to the row already cached. New
+           rows are resolved before the lock is acquired; if another thread
+           adds, replaces or removes the row in the meantime, this is done
+           again."""
+        while True:
+            with self.lock:
+                row = self._FindRow(externalRow)
+            newRow = self._NewRow(row, externalRow, contextItem)
+            if newRow is not None:
+                self.ResolveRows(cache, [newRow])
+            with self.lock:
+                if self._FindRow(externalRow) is not row:
+                    continue
+                self._BeginWrite()
+                try:
+                    self._UpdateRow(cache, externalRow, contextItem, row,
+                            newRow)
+                finally:
+                    self._EndWrite()
+                if self.limitedPaths:
+                    self._EnforceLimits(cache)
+                return
 
 
 class XrefSubCache(SubCache):
 
+    def _EvictRow(self, cache, key):
+        pass
+
+    def Revalidate(self, cache):
+        self.Clear()
+
     def AddRow(self, cache, key1, key2):
         cx_Logging.Debug("%s: adding xref between %s and %s", self.name, key1,
                 key2)
         path1, path2 = self.paths
-        if key1 in path1.rows:
-            path1.rows[key1].append(key2)
-        if key2 in path2.rows:
-            path2.rows[key2].append(key1)
+        with self.lock:
+            self._BeginWrite()
+            try:
+                if key1 in path1.rows:
+                    path1.rows[key1].append(key2)
+                if key2 in path2.rows:
+                    path2.rows[key2].append(key1)
+            finally:
+                self._EndWrite()
 
     def RemoveRow(self, cache, key1, key2):
         cx_Logging.Debug("%s: removing xref between %s and %s", self.name,
                 key1, key2)
         path1, path2 = self.paths
-        if key1 in path1.rows:
-            path1.rows[key1].remove(key2)
-        if key2 in path2.rows:
-            path2.rows[key2].remove(key1)
+        with self.lock:
+            self._BeginWrite()
+            try:
+                if key1 in path1.rows:
+                    path1.rows[key1].remove(key2)
+                if key2 in path2.rows:
+                    path2.rows[key2].remove(key1)
+            finally:
+                self._EndWrite()
 
 
 class CacheMetaClass(type):
@@ -368,6 +2241,7 @@ class CacheMetaClass(type):
     def __init__(cls, name, bases, classDict):
         super(CacheMetaClass, cls).__init__(name, bases, classDict)
         cls.subCacheClasses = cls.subCacheClasses.copy()
+        cls.pathMethodNames = cls.pathMethodNames.copy()
         for value in classDict.values():
             if isinstance(value, type) and issubclass(value, SubCache):
                 cls.subCacheClasses[value.name] = value
@@ -376,17 +2250,328 @@ class CacheMetaClass(type):
 
 class Cache(object, metaclass = CacheMetaClass):
     subCacheClasses = {}
+    pathMethodNames = {}
+    threadSafe = False
+    collectStatistics = False
+    statisticsLogInterval = None
+    snapshotVersion = "2"
+    warmSubCaches = []
+    memoryBudget = None
+    backgroundThreads = 1
 
     def __init__(self, dataSource):
+        self.threadLocal = threading.local()
         self.dataSource = dataSource
+        self.backgroundExecutor = concurrent.futures.ThreadPoolExecutor(
+                self.backgroundThreads)
         self.subCaches = []
         for cls in self.subCacheClasses.values():
             subCache = cls(self)
             self.subCaches.append(subCache)
             if cls.cacheAttrName is not None:
                 setattr(self, cls.cacheAttrName, subCache)
+        if self.collectStatistics and self.statisticsLogInterval is not None:
+            self._StartPeriodicThread(self.statisticsLogInterval,
+                    "LogStatistics")
+        for subCache in self.subCaches:
+            if subCache.refreshDeltaInterval is not None:
+                self._StartPeriodicThread(subCache.refreshDeltaInterval,
+                        "_CallWithOwnDataSource", "RefreshDelta",
+                        subCache.name)
+
+    @property
+    def dataSource(self):
+        """The data source used by the current thread; threads warming the
+           cache use their own data source acquired from the pool."""
+        return getattr(self.threadLocal, "dataSource", self.mainDataSource)
+
+    @dataSource.setter
+    def dataSource(self, dataSource):
+        self.mainDataSource = dataSource
+
+    def _CallInBackground(self, method, *args):
+        """Call the method on one of the background threads of the cache
+           (at most backgroundThreads run at the same time); the method uses
+           its own data source and any exception raised is logged."""
+        self.backgroundExecutor.submit(self._CallLogged, method, *args)
+
+    def _CallLogged(self, method, *args):
+        try:
+            self._CallWithOwnDataSource(method, *args)
+        except:
+            cx_Logging.LogException()
+
+    def _CallWithOwnDataSource(self, method, *args):
+        """Call the method (or the method of the cache with the given name)
+           with a data source acquired from the pool used as the data source
+           of the cache by the current thread."""
+        if isinstance(method, str):
+            method = getattr(self, method)
+        dataSource = self.mainDataSource.AcquireDataSource()
+        self.threadLocal.dataSource = dataSource
+        try:
+            return method(*args)
+        finally:
+            del self.threadLocal.dataSource
+            self.mainDataSource.ReleaseDataSource(dataSource)
+
+    def _IsResolving(self):
+        """Return true if the current thread is resolving loaded rows."""
+        return bool(getattr(self.threadLocal, "unresolvedRows", None))
+
+    @classmethod
+    def _GetSnapshotRowClasses(cls):
+        """Return the row classes which can be saved in a snapshot (those of
+           the subcaches and their read only and editable variants) keyed by
+           name and whether they are read only."""
+        rowClasses = {}
+        for subCacheClass in cls.subCacheClasses.values():
+            rowClass = subCacheClass.rowClass
+            for c in (rowClass, rowClass.editableRowClass,
+                    rowClass.readOnlyRowClass):
+                if c is not None:
+                    rowClasses[c.__name__, c.readOnly] = c
+        return rowClasses
+
+    def _GetWarmLevels(self, names):
+        """Return the names of the subcaches grouped into levels such that
+           the subcaches referred to by the extra directives of a subcache
+           are found in earlier levels."""
+        subCacheNamesByMethodName = {}
+        for cls in self.subCacheClasses.values():
+            if cls.allRowsMethodCacheAttrName is not None:
+                subCacheNamesByMethodName[cls.allRowsMethodCacheAttrName] = \
+                        cls.name
+            for pathClass in cls.pathClasses:
+                if pathClass.cacheAttrName is not None:
+                    subCacheNamesByMethodName[pathClass.cacheAttrName] = \
+                            cls.name
+        dependencies = {}
+        for name in names:
+            cls = self.subCacheClasses[name]
+            dependencies[name] = set(subCacheNamesByMethodName.get(d[1]) \
+                    for d in cls.onLoadRowExtraDirectives)
+            dependencies[name].discard(name)
+        levels = []
+        while dependencies:
+            level = [n for n, d in dependencies.items() \
+                    if d.isdisjoint(dependencies)]
+            if not level:
+                level = list(dependencies)
+            for name in level:
+                del dependencies[name]
+            levels.append(level)
+        return levels
+
+    def _StartPeriodicThread(self, interval, methodName, *args):
+        thread = cx_Threads.Thread(_CallPeriodically, weakref.ref(self),
+                interval, methodName, *args)
+        thread.daemon = True
+        thread.start()
+
+    def _WarmSubCache(self, name, entries):
+        for subCache in self.subCaches:
+            if subCache.name == name:
+                break
+        startTime = time.perf_counter()
+        for entry in entries:
+            if entry:
+                pathName, keys = entry
+                subCache.LoadMany(self, pathName, keys)
+            else:
+                subCache.LoadAllRows(self)
+        loadTime = time.perf_counter() - startTime
+        cx_Logging.Info("%s: warmed in %.3f seconds", name, loadTime)
+        return loadTime
+
+    def RefreshDelta(self, subCacheName = None):
+        """Apply the changes made since the last refresh to each subcache
+           which has a change tracking attribute or change log (or only to
+           the subcache with the given name) and return the number of changes
+           applied."""
+        numChanges = 0
+        for subCache in self.subCaches:
+            if subCacheName is not None and subCache.name != subCacheName:
+                continue
+            if subCache.changeTrackingAttrName is not None \
+                    or subCache.changeLogRowClass is not None:
+                numChanges += subCache.RefreshDelta(self)
+        return numChanges
+
+    def Revalidate(self):
+        """Reload the contents of each subcache from the database."""
+        for subCache in self.subCaches:
+            subCache.Revalidate(self)
+
+    def SaveSnapshot(self, fileName):
+        """Save the rows and path indexes of all subcaches to the given file
+           so that a cache can be restored from it by LoadSnapshot(). Rows are
+           written once each, as a tuple of values grouped by row class, and
+           references to them (in the path indexes and in the attributes of
+           other rows) are written as row indexes."""
+        subCacheData = {}
+        for subCache in self.subCaches:
+            with subCache.lock:
+                subCacheData[subCache.name] = subCache.GetSnapshotData()
+        rows = []
+        rowIds = set()
+        def AddRow(row):
+            if id(row) not in rowIds:
+                rowIds.add(id(row))
+                rows.append(row)
+        def AddRows(value):
+            if isinstance(value, ceDatabase.Row):
+                AddRow(value)
+            elif isinstance(value, (list, tuple, RowSet)):
+                for item in value:
+                    if isinstance(item, ceDatabase.Row):
+                        AddRow(item)
+        for data in subCacheData.values():
+            AddRows(data["allRows"])
+            for values in data["paths"].values():
+                for value in values.values():
+                    AddRows(value)
+        for row in rows:
+            for attrName in row.attrNames + row.extraAttrNames:
+                AddRows(getattr(row, attrName, None))
+        rowClasses = self._GetSnapshotRowClasses()
+        rowsByClass = collections.OrderedDict()
+        for row in rows:
+            key = (row.__class__.__name__, row.readOnly)
+            if rowClasses.get(key) is not row.__class__:
+                raise SnapshotRowClassNotCached(name = key[0])
+            rowsByClass.setdefault(key, []).append(row)
+        rowIndexes = {}
+        rowClassInfo = []
+        rowValues = []
+        for (name, readOnly), classRows in rowsByClass.items():
+            attrNames = classRows[0].attrNames + classRows[0].extraAttrNames
+            rowClassInfo.append((name, readOnly, attrNames, len(classRows)))
+            for row in classRows:
+                rowIndexes[id(row)] = len(rowIndexes)
+                rowValues.append(tuple(getattr(row, n, _missing) \
+                        for n in attrNames))
+        with open(fileName, "wb") as f:
+            pickler = _SnapshotPickler(f, rowIndexes)
+            pickler.dump(self.GetSchemaHash())
+            pickler.dump(rowClassInfo)
+            pickler.dump(rowValues)
+            pickler.dump(subCacheData)
+
+    def Batch(self):
+        """Return a batch which collects calls to the generated methods and
+           resolves them together."""
+        return Batch(self)
 
     def Clear(self):
         for subCache in self.subCaches:
             subCache.Clear()
 
+    @classmethod
+    def GetSchemaHash(cls):
+        """Return a hash of the definitions of the subcaches, paths and row
+           classes used to ensure that snapshots match the cache."""
+        parts = [cls.snapshotVersion]
+        for name, subCacheClass in sorted(cls.subCacheClasses.items()):
+            rowClass = subCacheClass.rowClass
+            parts.append("%s:%s:%s:%s:%s:%s:%s" % (name,
+                    subCacheClass.__bases__[0].__name__,
+                    subCacheClass.loadAllRowsOnFirstLoad, rowClass.__name__,
+                    rowClass.attrNames, rowClass.extraAttrNames,
+                    rowClass.pkAttrNames))
+            for pathClass in subCacheClass.pathClasses:
+                parts.append("%s:%s:%s:%s" % (pathClass.name,
+                        pathClass.__bases__[0].__name__,
+                        pathClass.retrievalAttrNames,
+                        pathClass.stringRetrievalAttrNames))
+        return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+    def EstimateMemory(self, exact = False):
+        """Return a dictionary of memory estimates (see
+           SubCache.EstimateMemory()) keyed by subcache name."""
+        return dict((s.name, s.EstimateMemory(exact)) for s in self.subCaches)
+
+    def GetStatistics(self):
+        """Return a dictionary of statistics reports (see
+           SubCache.GetStatistics()) keyed by subcache name; statistics are
+           only collected if the collectStatistics attribute is true when
+           the cache class is created."""
+        return dict((s.name, s.GetStatistics()) for s in self.subCaches)
+
+    def LoadSnapshot(self, fileName, revalidate = False):
+        """Replace the contents of the cache with the snapshot saved in the
+           given file, optionally revalidating it against the database on a
+           background thread. Only the row classes of the subcaches and the
+           types of common column values are created when the snapshot is
+           loaded but snapshots should still only be loaded from trusted
+           locations."""
+        rowClasses = self._GetSnapshotRowClasses()
+        with open(fileName, "rb") as f:
+            unpickler = _SnapshotUnpickler(f)
+            if unpickler.load() != self.GetSchemaHash():
+                raise SnapshotMismatch(fileName = fileName)
+            for name, readOnly, attrNames, numRows in unpickler.load():
+                cls = rowClasses.get((name, readOnly))
+                if cls is None \
+                        or attrNames != cls.attrNames + cls.extraAttrNames:
+                    raise SnapshotMismatch(fileName = fileName)
+                unpickler.rows.extend(cls.__new__(cls) \
+                        for i in range(numRows))
+            rowValues = unpickler.load()
+            subCacheData = unpickler.load()
+        for row, values in zip(unpickler.rows, rowValues):
+            for attrName, value in zip(row.attrNames + row.extraAttrNames,
+                    values):
+                if value is not _missing:
+                    object.__setattr__(row, attrName, value)
+        for subCache in self.subCaches:
+            subCache.RestoreSnapshotData(subCacheData[subCache.name])
+        if revalidate:
+            self._CallInBackground(self.Revalidate)
+
+    def LogStatistics(self):
+        """Log a summary of the statistics for each subcache and path."""
+        for subCacheName, report in sorted(self.GetStatistics().items()):
+            cx_Logging.Info("%s: %d loads of all rows, %d rows, %.3fs, "
+                    "approximately %d bytes", subCacheName, report["loads"],
+                    report["rowsLoaded"], report["loadTime"],
+                    report["estimatedBytes"])
+            for pathName, pathReport in sorted(report["paths"].items()):
+                cx_Logging.Info("%s.%s: %d entries, %d hits, %d misses, "
+                        "%d loads, %d rows loaded, %d evictions, %.3fs",
+                        subCacheName, pathName, pathReport["entries"],
+                        pathReport["hits"], pathReport["misses"],
+                        pathReport["loads"], pathReport["rowsLoaded"],
+                        pathReport["evictions"], pathReport["loadTime"])
+
+    def Warm(self, parallelism = None):
+        """Load the subcaches listed in warmSubCaches on a pool of threads,
+           each using its own data source acquired from the connection pool.
+           Each entry is the name of a subcache, whose rows are all loaded,
+           or a tuple of the name of a subcache, the name of a path and the
+           keys to load through it. Subcaches referred to by the extra
+           directives of others are loaded first. The parallelism defaults
+           to the size of the connection pool (or 1 if there is none); it
+           cannot exceed 1 without a connection pool since the threads would
+           otherwise share a connection. Return the load time in seconds of
+           each subcache by name."""
+        pool = getattr(self.mainDataSource, "connectionPool", None)
+        if parallelism is None:
+            parallelism = 1 if pool is None else pool.maxResources
+        elif parallelism > 1 and pool is None:
+            raise ValueError("parallelism of %d requires a connection pool" % \
+                    parallelism)
+        entriesByName = collections.OrderedDict()
+        for entry in self.warmSubCaches:
+            if isinstance(entry, str):
+                entry = (entry,)
+            entriesByName.setdefault(entry[0], []).append(entry[1:])
+        loadTimes = collections.OrderedDict()
+        with concurrent.futures.ThreadPoolExecutor(parallelism) as executor:
+            for level in self._GetWarmLevels(list(entriesByName)):
+                futures = [executor.submit(self._CallWithOwnDataSource,
+                        self._WarmSubCache, n, entriesByName[n]) \
+                        for n in level]
+                for name, future in zip(level, futures):
+                    loadTimes[name] = future.result()
+        return loadTimes
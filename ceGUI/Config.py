@@ -41,9 +41,18 @@ class Config(object):
     def __ConvertTimestampToString(self, value):
         return value.strftime(self.timestampFormat)
 
+    def __GetRowPositions(self, model):
+        positions = self.rowPositionsByModel.get(model)
+        if positions is None:
+            rows = self.GetCachedRows(model)
+            positions = dict((id(r), i) for i, r in enumerate(rows))
+            self.rowPositionsByModel[model] = positions
+        return positions
+
     def ClearRowCache(self):
         self.rowsByModel = {}
         self.rowsByPK = {}
+        self.rowPositionsByModel = {}
 
     def Clone(self, configId = None):
         app = wx.GetApp()
@@ -63,6 +72,7 @@ class Config(object):
         if rows is None or refresh:
             cx_Logging.Info("Getting cached rows for model %s", model.__name__)
             rows = self.rowsByModel[model] = model.GetRows(self.dataSource)
+            self.rowPositionsByModel.pop(model, None)
         return rows
 
     def GetCachedRowByPK(self, model, pkValue):
@@ -122,7 +132,9 @@ class Config(object):
             cx_Logging.Info("Removing cached row for model %s (pk = %s)",
                     model.__name__, pkValue)
             del self.rowsByPK[model][pkValue]
-            self.rowsByModel[model].remove(row)
+            position = self.__GetRowPositions(model)[id(row)]
+            del self.rowsByModel[model][position]
+            del self.rowPositionsByModel[model]
 
     def RestoreConfigId(self):
         settingsName = "Database/%s/ConfigId" % self.dataSource.dsn
@@ -136,14 +148,13 @@ class Config(object):
     def UpdateCachedRow(self, model, externalRow, contextItem = None):
         pkAttrName, = model.pkAttrNames
         pkValue = getattr(externalRow, pkAttrName)
-        row = self.GetCachedRowByPK(model, pkValue)
-        if row is not None:
+        cachedRow = self.GetCachedRowByPK(model, pkValue)
+        if cachedRow is not None:
             cx_Logging.Info("Updating cached row for model %s (pk = %s)",
                     model.__name__, pkValue)
+            row = cachedRow.Copy() if model.readOnly else cachedRow
         else:
             row = model.New()
-            self.rowsByModel[model].append(row)
-            self.rowsByPK[model][pkValue] = row
             cx_Logging.Info("Creating cached row for model %s (pk = %s)",
                     model.__name__, pkValue)
         for attrName in row.attrNames + row.extraAttrNames:
@@ -154,6 +165,17 @@ class Config(object):
             else:
                 continue
             setattr(row, attrName, value)
+        row = row.Freeze()
+        rows = self.rowsByModel[model]
+        positions = self.__GetRowPositions(model)
+        if cachedRow is None:
+            positions[id(row)] = len(rows)
+            rows.append(row)
+        elif row is not cachedRow:
+            position = positions.pop(id(cachedRow))
+            positions[id(row)] = position
+            rows[position] = row
+        self.rowsByPK[model][pkValue] = row
 
     def WriteDatabaseSetting(self, name, value, isComplex = False,
             converter = None, isDate = False, isTimestamp = False):
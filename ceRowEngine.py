@@ -0,0 +1,346 @@
+"""
+Define methods for joining, grouping and projecting collections of rows (as
+returned by ceDatabase.Row.GetRows(), the rows dictionary of data sets or
+caches) in memory. If the rows are supplied in columnar form instead (a
+ceDatabase.Columns dictionary of NumPy arrays as returned by
+ceDatabase.Row.GetArrays()), vectorized NumPy kernels are used and the result
+is returned in columnar form as well.
+"""
+
+import ceDatabase
+import operator
+
+aggregateFunctions = ("count", "sum", "min", "max")
+
+Columns = ceDatabase.Columns
+
+_rowClasses = {}
+
+def _GetColumnarRowCount(columns):
+    """Return the number of rows in the set of columns."""
+    for values in columns.values():
+        return len(values)
+    return 0
+
+
+def _AggregateColumnar(numpy, function, values, starts):
+    """Return the aggregate of each group of values beginning at the given
+       starting positions; null values (None, NaN and NaT) are skipped and
+       the aggregate of a group containing only null values is null, the same
+       as when aggregating rows."""
+    kind = values.dtype.kind
+    if kind == "O":
+        nulls = numpy.equal(values, None)
+    elif kind == "f":
+        nulls = numpy.isnan(values)
+    elif kind in "mM":
+        nulls = numpy.isnat(values)
+    else:
+        nulls = None
+    if nulls is None or not nulls.any():
+        if function == "sum":
+            return numpy.add.reduceat(values, starts)
+        elif function == "min":
+            return numpy.minimum.reduceat(values, starts)
+        return numpy.maximum.reduceat(values, starts)
+    if kind == "O":
+        pythonFunction = dict(sum = sum, min = min, max = max)[function]
+        ends = numpy.append(starts[1:], len(values))
+        result = numpy.empty(len(starts), dtype = object)
+        for groupIndex, (start, end) in enumerate(zip(starts, ends)):
+            groupValues = [v for v in values[start:end] if v is not None]
+            if groupValues:
+                result[groupIndex] = pythonFunction(groupValues)
+        return result
+    if function == "min":
+        return numpy.fmin.reduceat(values, starts)
+    elif function == "max":
+        return numpy.fmax.reduceat(values, starts)
+    result = numpy.add.reduceat(numpy.where(nulls, 0, values), starts)
+    allNulls = numpy.logical_and.reduceat(nulls, starts)
+    result[allNulls] = values[nulls][0]
+    return result
+
+
+def _GetKeyCodes(numpy, leftColumns, rightColumns = None):
+    """Return an array of integer codes identifying the distinct values of
+       the key columns; if right columns are specified, the codes are computed
+       over both sets of columns so that they can be compared. Object columns
+       (which may contain None or values that cannot be ordered) are coded in
+       the order in which the values are first encountered."""
+    codes = None
+    for columnIndex, leftValues in enumerate(leftColumns):
+        values = leftValues
+        if rightColumns is not None:
+            values = numpy.concatenate((leftValues, rightColumns[columnIndex]))
+        if values.dtype.kind == "O":
+            codesByValue = {}
+            columnCodes = numpy.fromiter((codesByValue.setdefault(v,
+                    len(codesByValue)) for v in values), dtype = numpy.int64,
+                    count = len(values))
+            numUniqueValues = len(codesByValue)
+        else:
+            uniqueValues, columnCodes = numpy.unique(values,
+                    return_inverse = True)
+            numUniqueValues = len(uniqueValues)
+        if codes is None:
+            codes = columnCodes.astype(numpy.int64)
+        else:
+            codes = codes * numUniqueValues + columnCodes
+    if rightColumns is None:
+        return codes
+    numLeftRows = len(leftColumns[0])
+    return codes[:numLeftRows], codes[numLeftRows:]
+
+
+def _GetRows(rows):
+    """Return the rows as a sequence; dictionaries of rows (such as the rows
+       of a data set, keyed by handle) are replaced by their values."""
+    if isinstance(rows, dict):
+        return list(rows.values())
+    return rows
+
+
+def _GetValueGetter(attrNames):
+    """Return a function which returns a tuple of the values of the given
+       attributes of a row."""
+    if len(attrNames) == 1:
+        getter = operator.attrgetter(attrNames[0])
+        return lambda r: (getter(r),)
+    return operator.attrgetter(*attrNames)
+
+
+def _Normalize(attrNames):
+    """Return the list of attribute names, splitting strings if needed."""
+    if isinstance(attrNames, str):
+        return attrNames.split()
+    return list(attrNames)
+
+
+def _TakeWithMissing(numpy, values, indexes, missing):
+    """Return the values at the given indexes, setting the value to the
+       appropriate missing value for the type wherever missing is true."""
+    result = values.take(numpy.where(missing, 0, indexes)) \
+            if len(values) else numpy.empty(len(indexes), dtype = object)
+    if missing.any():
+        kind = result.dtype.kind
+        if kind == "f":
+            result[missing] = numpy.nan
+        elif kind in "mM":
+            result[missing] = numpy.datetime64("NaT")
+        else:
+            result = result.astype(object)
+            result[missing] = None
+    return result
+
+
+def GetRowClass(attrNames, name = "ResultRow"):
+    """Return a row class (generated by the row metaclass) with the given
+       attribute names; classes are generated once for each set of names."""
+    attrNames = _Normalize(attrNames)
+    key = (name, tuple(attrNames))
+    cls = _rowClasses.get(key)
+    if cls is None:
+        classDict = dict(attrNames = attrNames, reprName = name)
+        cls = _rowClasses[key] = \
+                ceDatabase.RowMetaClass(name, (ceDatabase.Row,), classDict)
+    return cls
+
+
+def GroupBy(rows, groupAttrNames, rowClass = None, **aggregates):
+    """Group the rows by the given attributes and compute the aggregates
+       specified as keyword arguments of the form name = (function, attrName)
+       where function is one of count, sum, min or max (attrName is ignored
+       for count and may be None). The groups are returned in the order in
+       which they are first encountered (or sorted by key for columnar
+       input, except that object columns are in the order in which their
+       values are first encountered)."""
+    groupAttrNames = _Normalize(groupAttrNames)
+    for aggregateName, (function, attrName) in aggregates.items():
+        if function not in aggregateFunctions:
+            raise ValueError("unsupported aggregate function %r" % function)
+    if isinstance(rows, Columns):
+        return _GroupByColumnar(rows, groupAttrNames, aggregates)
+    rows = _GetRows(rows)
+    aggregateNames = list(aggregates)
+    functions = [aggregates[n][0] for n in aggregateNames]
+    getters = [operator.attrgetter(aggregates[n][1]) \
+            if aggregates[n][0] != "count" else None for n in aggregateNames]
+    keyGetter = _GetValueGetter(groupAttrNames)
+    groups = {}
+    for row in rows:
+        key = keyGetter(row)
+        accumulators = groups.get(key)
+        if accumulators is None:
+            accumulators = groups[key] = [None] * len(functions)
+        for i, function in enumerate(functions):
+            if function == "count":
+                accumulators[i] = (accumulators[i] or 0) + 1
+                continue
+            value = getters[i](row)
+            if value is None:
+                continue
+            current = accumulators[i]
+            if current is None:
+                accumulators[i] = value
+            elif function == "sum":
+                accumulators[i] = current + value
+            elif function == "min":
+                if value < current:
+                    accumulators[i] = value
+            elif value > current:
+                accumulators[i] = value
+    if rowClass is None:
+        rowClass = GetRowClass(groupAttrNames + aggregateNames, "GroupRow")
+    return [rowClass(*(k + tuple(a))) for k, a in groups.items()]
+
+
+def _GroupByColumnar(columns, groupAttrNames, aggregates):
+    """Group the columns using NumPy."""
+    import numpy
+    numRows = _GetColumnarRowCount(columns)
+    result = Columns()
+    if numRows == 0:
+        for name in groupAttrNames:
+            result[name] = columns[name][:0]
+        for name in aggregates:
+            result[name] = numpy.zeros(0, dtype = numpy.int64)
+        return result
+    codes = _GetKeyCodes(numpy, [columns[n] for n in groupAttrNames])
+    order = numpy.argsort(codes, kind = "stable")
+    sortedCodes = codes[order]
+    starts = numpy.flatnonzero(numpy.concatenate(([True],
+            sortedCodes[1:] != sortedCodes[:-1])))
+    firstRows = order[starts]
+    for name in groupAttrNames:
+        result[name] = columns[name][firstRows]
+    for aggregateName, (function, attrName) in aggregates.items():
+        if function == "count":
+            ends = numpy.append(starts[1:], numRows)
+            result[aggregateName] = ends - starts
+            continue
+        values = columns[attrName][order]
+        result[aggregateName] = _AggregateColumnar(numpy, function, values,
+                starts)
+    return result
+
+
+def HashJoin(leftRows, rightRows, leftAttrNames, rightAttrNames = None,
+        attrNames = None, joinType = "inner", rowClass = None):
+    """Join the two collections of rows on the given attributes (the right
+       attribute names default to the left attribute names). The attributes
+       of the result default to all of the left attributes followed by the
+       right attributes not already found on the left; each attribute is
+       taken from the left rows if it exists there and from the right rows
+       otherwise. The join type may be inner or left; in the latter case
+       attributes from the right are None where no match is found."""
+    leftAttrNames = _Normalize(leftAttrNames)
+    rightAttrNames = leftAttrNames if rightAttrNames is None \
+            else _Normalize(rightAttrNames)
+    if joinType not in ("inner", "left"):
+        raise ValueError("unsupported join type %r" % joinType)
+    if isinstance(leftRows, Columns) != isinstance(rightRows, Columns):
+        raise TypeError("both collections of rows must be columnar or "
+                "neither")
+    if isinstance(leftRows, Columns):
+        return _HashJoinColumnar(leftRows, rightRows, leftAttrNames,
+                rightAttrNames, attrNames, joinType)
+    leftRows = _GetRows(leftRows)
+    rightRows = _GetRows(rightRows)
+    leftNames = leftRows[0].GetAttributeNames() if leftRows else []
+    rightNames = rightRows[0].GetAttributeNames() if rightRows else []
+    if attrNames is None:
+        attrNames = leftNames + [n for n in rightNames if n not in leftNames]
+    else:
+        attrNames = _Normalize(attrNames)
+    if rowClass is None:
+        rowClass = GetRowClass(attrNames, "JoinedRow")
+    fromLeft = [n for n in attrNames if n in leftNames]
+    fromRight = [n for n in attrNames if n not in leftNames]
+    positions = [(0, fromLeft.index(n)) if n in leftNames \
+            else (1, fromRight.index(n)) for n in attrNames]
+    leftGetter = _GetValueGetter(fromLeft) if fromLeft else lambda r: ()
+    rightGetter = _GetValueGetter(fromRight) if fromRight else lambda r: ()
+    missingRightValues = (None,) * len(fromRight)
+    rightRowsByKey = {}
+    rightKeyGetter = _GetValueGetter(rightAttrNames)
+    for row in rightRows:
+        rightRowsByKey.setdefault(rightKeyGetter(row), []).append(row)
+    leftKeyGetter = _GetValueGetter(leftAttrNames)
+    isLeftJoin = (joinType == "left")
+    results = []
+    for leftRow in leftRows:
+        matches = rightRowsByKey.get(leftKeyGetter(leftRow))
+        if matches is None and not isLeftJoin:
+            continue
+        leftValues = leftGetter(leftRow)
+        if matches is None:
+            rightValuesList = [missingRightValues]
+        else:
+            rightValuesList = [rightGetter(r) for r in matches]
+        for rightValues in rightValuesList:
+            values = (leftValues, rightValues)
+            args = [values[s][i] for s, i in positions]
+            results.append(rowClass(*args))
+    return results
+
+
+def _HashJoinColumnar(leftColumns, rightColumns, leftAttrNames,
+        rightAttrNames, attrNames, joinType):
+    """Join the columns using NumPy."""
+    import numpy
+    if attrNames is None:
+        attrNames = list(leftColumns) + \
+                [n for n in rightColumns if n not in leftColumns]
+    else:
+        attrNames = _Normalize(attrNames)
+    numLeftRows = _GetColumnarRowCount(leftColumns)
+    numRightRows = _GetColumnarRowCount(rightColumns)
+    if numLeftRows == 0 or numRightRows == 0:
+        leftCodes = numpy.zeros(numLeftRows, dtype = numpy.int64)
+        rightCodes = numpy.ones(numRightRows, dtype = numpy.int64)
+    else:
+        leftCodes, rightCodes = _GetKeyCodes(numpy,
+                [leftColumns[n] for n in leftAttrNames],
+                [rightColumns[n] for n in rightAttrNames])
+    rightOrder = numpy.argsort(rightCodes, kind = "stable")
+    sortedRightCodes = rightCodes[rightOrder]
+    lowIndexes = numpy.searchsorted(sortedRightCodes, leftCodes, "left")
+    highIndexes = numpy.searchsorted(sortedRightCodes, leftCodes, "right")
+    counts = highIndexes - lowIndexes
+    missing = None
+    if joinType == "left":
+        missing = (counts == 0)
+        counts = numpy.maximum(counts, 1)
+    leftIndexes = numpy.repeat(numpy.arange(numLeftRows), counts)
+    groupStarts = numpy.cumsum(counts) - counts
+    offsets = numpy.arange(len(leftIndexes)) - \
+            numpy.repeat(groupStarts, counts)
+    sortedIndexes = numpy.repeat(lowIndexes, counts) + offsets
+    if missing is not None:
+        missing = numpy.repeat(missing, counts)
+        sortedIndexes = numpy.where(missing, 0, sortedIndexes)
+    rightIndexes = rightOrder.take(sortedIndexes) if numRightRows \
+            else numpy.zeros(len(sortedIndexes), dtype = numpy.int64)
+    result = Columns()
+    for name in attrNames:
+        if name in leftColumns:
+            result[name] = leftColumns[name][leftIndexes]
+        elif missing is None:
+            result[name] = rightColumns[name][rightIndexes]
+        else:
+            result[name] = _TakeWithMissing(numpy, rightColumns[name],
+                    rightIndexes, missing)
+    return result
+
+
+def Project(rows, attrNames, rowClass = None):
+    """Return new rows containing only the given attributes."""
+    attrNames = _Normalize(attrNames)
+    if isinstance(rows, Columns):
+        return Columns((n, rows[n]) for n in attrNames)
+    rows = _GetRows(rows)
+    if rowClass is None:
+        rowClass = GetRowClass(attrNames, "ProjectedRow")
+    getter = _GetValueGetter(attrNames)
+    return [rowClass(*getter(r)) for r in rows]
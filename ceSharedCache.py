@@ -0,0 +1,581 @@
+"""
+Define classes for sharing the contents of a cache (see ceDatabaseCache)
+between processes. A single loader process publishes the rows of each
+subcache which loads all of its rows on first load into a memory mapped file
+in columnar form, along with a hash index for each path; worker processes
+attach to the file read only and look up rows through views which read the
+columns directly without deserializing the rows. Each publication creates a
+new generation; readers switch to it the next time they check the control
+file which names the current generation. Readers record each generation they
+have mapped in a reader file so that the writer only removes old generations
+once they are no longer mapped.
+"""
+
+import array
+import ceDatabase
+import ceDatabaseCache
+import cx_Exceptions
+import cx_Logging
+import datetime
+import decimal
+import errno
+import itertools
+import json
+import mmap
+import os
+import pickle
+import re
+import struct
+import time
+import weakref
+import zlib
+
+MAGIC = b"CXSC"
+FORMAT_VERSION = 2
+CONTROL_FILE_NAME = "current"
+GENERATIONS_TO_KEEP = 2
+
+_header = struct.Struct("<4sIQQ")
+_epoch = datetime.datetime(1970, 1, 1)
+_microsecond = datetime.timedelta(microseconds = 1)
+_fileNamePattern = re.compile(r"cache\.(\d+)\.dat(?:\.(\d+)\.\d+\.reader)?$")
+_readerNumbers = itertools.count()
+
+def _Align(offset):
+    return (offset + 7) & ~7
+
+
+def _GetColumnKind(values):
+    """Return the kind of column used to store the values."""
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        elif isinstance(value, bool):
+            kinds.add("bool")
+        elif isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+            kinds.add("int")
+        elif isinstance(value, float):
+            kinds.add("float")
+        elif isinstance(value, str):
+            kinds.add("str")
+        elif isinstance(value, decimal.Decimal) and value.is_finite():
+            kinds.add("decimal")
+        elif isinstance(value, datetime.datetime) and value.tzinfo is None:
+            kinds.add("datetime")
+        elif isinstance(value, datetime.date) \
+                and not isinstance(value, datetime.datetime):
+            kinds.add("date")
+        else:
+            kinds.add("object")
+    if len(kinds) == 1:
+        kind = kinds.pop()
+        if kind == "decimal" and _GetDecimalPlaces(values) is None:
+            return "object"
+        return kind
+    if kinds == set(["int", "float"]):
+        return "float"
+    return "object"
+
+
+def _GetDecimalPlaces(values):
+    """Return the number of decimal places needed to store all of the
+       decimal values as scaled 64-bit integers or None if that is not
+       possible."""
+    places = max(max(0, -v.as_tuple().exponent) for v in values \
+            if v is not None)
+    for value in values:
+        if value is not None and abs(value.scaleb(places)) >= 2 ** 63:
+            return None
+    return places
+
+
+def _GetHash(key):
+    """Return a hash of the key which is the same in every process (unlike
+       the builtin hash() which is randomized for strings)."""
+    return zlib.crc32(repr(_NormalizeKey(key)).encode())
+
+
+def _IsProcessRunning(pid):
+    """Return true if the process with the given id is running; where this
+       cannot be determined the process is assumed to be running."""
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _NormalizeKey(key):
+    """Return the key with numbers which compare equal (such as 1, 1.0 and
+       Decimal(1)) converted to the same type so that they hash the same."""
+    if isinstance(key, tuple):
+        return tuple(_NormalizeKey(v) for v in key)
+    if isinstance(key, int):
+        return int(key)
+    if isinstance(key, float) and key.is_integer():
+        return int(key)
+    if isinstance(key, decimal.Decimal):
+        if key.is_finite() and key == key.to_integral_value():
+            return int(key)
+        return float(key)
+    return key
+
+
+def _RemoveFile(fileName):
+    try:
+        os.remove(fileName)
+    except OSError:
+        pass
+
+
+def _GetKey(values):
+    if len(values) == 1:
+        return values[0]
+    return tuple(values)
+
+
+class _Column(object):
+    """A column of values for one attribute, read from the mapped file."""
+
+    def __init__(self, buffer, info):
+        self.kind = info["kind"]
+        self.nulls = buffer[info["nulls"]:info["nulls"] + info["numRows"]]
+        offset, length = info["values"]
+        values = buffer[offset:offset + length]
+        if self.kind in ("int", "decimal", "datetime", "date"):
+            self.values = values.cast("q")
+            self.places = info.get("places")
+        elif self.kind == "float":
+            self.values = values.cast("d")
+        elif self.kind == "bool":
+            self.values = values
+        else:
+            offset, length = info["offsets"]
+            self.offsets = buffer[offset:offset + length].cast("q")
+            self.values = values
+
+    def GetValue(self, rowIndex):
+        if self.nulls[rowIndex]:
+            return None
+        if self.kind in ("int", "float"):
+            return self.values[rowIndex]
+        elif self.kind == "decimal":
+            return decimal.Decimal(self.values[rowIndex]).scaleb(-self.places)
+        elif self.kind == "datetime":
+            return _epoch + self.values[rowIndex] * _microsecond
+        elif self.kind == "date":
+            return datetime.date.fromordinal(self.values[rowIndex])
+        elif self.kind == "bool":
+            return self.values[rowIndex] != 0
+        data = self.values[self.offsets[rowIndex]:self.offsets[rowIndex + 1]]
+        if self.kind == "str":
+            return str(data, "utf-8")
+        return pickle.loads(data)
+
+
+class _Index(object):
+    """A hash index for one path, read from the mapped file."""
+
+    def __init__(self, table, buffer, info):
+        self.table = table
+        self.retrievalAttrNames = info["retrievalAttrNames"]
+        self.stringRetrievalAttrNames = info["stringRetrievalAttrNames"]
+        self.slots = self._GetArray(buffer, info["slots"])
+        self.groupOffsets = self._GetArray(buffer, info["groupOffsets"])
+        self.postings = self._GetArray(buffer, info["postings"])
+        self.mask = len(self.slots) - 1
+
+    def _GetArray(self, buffer, location):
+        offset, length = location
+        return buffer[offset:offset + length].cast("q")
+
+    def _GetRowKey(self, rowIndex):
+        values = []
+        for attrName in self.retrievalAttrNames:
+            value = self.table.columns[attrName].GetValue(rowIndex)
+            if attrName in self.stringRetrievalAttrNames and value is not None:
+                value = value.upper()
+            values.append(value)
+        return _GetKey(values)
+
+    def Lookup(self, key):
+        """Return the indexes of the rows matching the key."""
+        slotIndex = _GetHash(key) & self.mask
+        while True:
+            groupIndex = self.slots[slotIndex]
+            if groupIndex < 0:
+                return []
+            start = self.groupOffsets[groupIndex]
+            end = self.groupOffsets[groupIndex + 1]
+            if self._GetRowKey(self.postings[start]) == key:
+                return self.postings[start:end]
+            slotIndex = (slotIndex + 1) & self.mask
+
+
+class _Table(object):
+    """The rows of one subcache, read from the mapped file."""
+
+    def __init__(self, generation, buffer, info):
+        self.name = info["name"]
+        self.numRows = info["numRows"]
+        self.attrNames = info["attrNames"]
+        self.columns = dict((n, _Column(buffer, c)) \
+                for n, c in zip(self.attrNames, info["columns"]))
+        self.indexes = dict((n, _Index(self, buffer, i)) \
+                for n, i in info["indexes"].items())
+        classDict = dict(__slots__ = [], attrNames = self.attrNames,
+                reprName = info["reprName"], table = self,
+                generation = generation)
+        for attrName in self.attrNames:
+            column = self.columns[attrName]
+            classDict[attrName] = property(lambda r, c = column: \
+                    c.GetValue(r._rowIndex))
+        self.viewClass = type(info["reprName"], (RowView,), classDict)
+
+    def GetRows(self, rowIndexes):
+        return [self.viewClass(i) for i in rowIndexes]
+
+
+class Generation(object):
+    """A single published generation of the shared cache, mapped into
+       memory."""
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        with open(fileName, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        buffer = memoryview(self.map)
+        magic, version, metadataOffset, metadataLength = \
+                _header.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise InvalidSharedCacheFile(fileName = fileName)
+        metadata = json.loads(str(buffer[metadataOffset:metadataOffset + \
+                metadataLength], "utf-8"))
+        self.schemaHash = metadata["schemaHash"]
+        self.tables = dict((t["name"], _Table(self, buffer, t)) \
+                for t in metadata["tables"])
+
+
+class InvalidSharedCacheFile(cx_Exceptions.BaseException):
+    message = 'File "%(fileName)s" is not a valid shared cache file.'
+
+
+class SharedCacheNotPublished(cx_Exceptions.BaseException):
+    message = 'No shared cache has been published in "%(directory)s".'
+
+
+class RowView(object):
+    """Read only view of a row stored in a shared cache; the values of the
+       attributes are read from the mapped file when accessed."""
+    __slots__ = ["_rowIndex"]
+    attrNames = []
+    reprName = "RowView"
+    table = generation = None
+
+    def __init__(self, rowIndex):
+        self._rowIndex = rowIndex
+
+    def __eq__(self, other):
+        return isinstance(other, RowView) and other.table is self.table \
+                and other._rowIndex == self._rowIndex
+
+    def __hash__(self):
+        return hash((id(self.table), self._rowIndex))
+
+    def __repr__(self):
+        values = ["%s=%r" % (n, getattr(self, n)) for n in self.attrNames]
+        return "<%s %s>" % (self.reprName, ", ".join(values))
+
+    def GetAttributeNames(self):
+        return self.attrNames
+
+    def Copy(self, rowClass):
+        """Return a row of the given class containing the values."""
+        return rowClass(*[getattr(self, n) for n in rowClass.attrNames])
+
+
+class SharedCache(object):
+    """Provides read only access to the contents of a cache published by a
+       writer. The methods generated on the cache class (for subcaches which
+       load all of their rows on first load) may be called on it and return
+       row views instead of rows; the control file is checked for a new
+       generation at most once every checkInterval seconds."""
+
+    def __init__(self, directory, cacheClass, checkInterval = 1.0):
+        self.directory = directory
+        self.cacheClass = cacheClass
+        self.checkInterval = checkInterval
+        self.generation = None
+        self.generationNumber = None
+        self.nextCheckTime = 0
+        self.CheckGeneration()
+        if self.generation is None:
+            raise SharedCacheNotPublished(directory = directory)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        for subCacheClass in self.cacheClass.subCacheClasses.values():
+            if name == subCacheClass.allRowsMethodCacheAttrName:
+                method = self._GetAllRowsMethod(subCacheClass)
+                break
+        else:
+            try:
+                subCacheAttrName, pathName = \
+                        self.cacheClass.pathMethodNames[name]
+            except KeyError:
+                raise AttributeError(name)
+            for subCacheClass in self.cacheClass.subCacheClasses.values():
+                if subCacheClass.cacheAttrName == subCacheAttrName:
+                    break
+            pathClass = subCacheClass.pathClassesByName[pathName]
+            method = self._GetPathMethod(subCacheClass, pathClass)
+        self.__dict__[name] = method
+        return method
+
+    def _GetAllRowsMethod(self, subCacheClass):
+        def GetAllRows():
+            table = self.GetTable(subCacheClass.name)
+            return table.GetRows(range(table.numRows))
+        return GetAllRows
+
+    def _GetPathMethod(self, subCacheClass, pathClass):
+        isSingleRowPath = issubclass(pathClass, ceDatabaseCache.SingleRowPath)
+        attrNames = pathClass.retrievalAttrNames
+        stringAttrNames = pathClass.stringRetrievalAttrNames
+        def Lookup(*args):
+            values = []
+            for attrName, value in zip(attrNames, args):
+                if isinstance(value, (RowView, ceDatabase.Row)):
+                    value = getattr(value, attrName)
+                if attrName in stringAttrNames and value is not None:
+                    value = value.upper()
+                values.append(value)
+            table = self.GetTable(subCacheClass.name)
+            rowIndexes = table.indexes[pathClass.name].Lookup(_GetKey(values))
+            if not isSingleRowPath:
+                return table.GetRows(rowIndexes)
+            if not rowIndexes:
+                raise cx_Exceptions.NoDataFound()
+            return table.viewClass(rowIndexes[0])
+        return Lookup
+
+    def CheckGeneration(self):
+        """Switch to the current generation if it has changed. A reader file
+           is created before the generation is mapped and removed once it is
+           no longer referenced, so that the writer does not remove it while
+           it is in use."""
+        self.nextCheckTime = time.monotonic() + self.checkInterval
+        while True:
+            try:
+                with open(os.path.join(self.directory,
+                        CONTROL_FILE_NAME)) as f:
+                    generationNumber = int(f.read())
+            except (IOError, ValueError):
+                return
+            if generationNumber == self.generationNumber:
+                return
+            fileName = os.path.join(self.directory,
+                    "cache.%d.dat" % generationNumber)
+            readerFileName = "%s.%d.%d.reader" % \
+                    (fileName, os.getpid(), next(_readerNumbers))
+            open(readerFileName, "w").close()
+            try:
+                generation = Generation(fileName)
+            except FileNotFoundError:
+                _RemoveFile(readerFileName)
+                continue
+            weakref.finalize(generation, _RemoveFile, readerFileName)
+            break
+        if generation.schemaHash != self.cacheClass.GetSchemaHash():
+            raise ceDatabaseCache.SnapshotMismatch(fileName = fileName)
+        cx_Logging.Info("attached to shared cache generation %d",
+                generationNumber)
+        self.generation = generation
+        self.generationNumber = generationNumber
+
+    def GetTable(self, name):
+        """Return the table for the subcache with the given name in the
+           current generation."""
+        if time.monotonic() >= self.nextCheckTime:
+            self.CheckGeneration()
+        return self.generation.tables[name]
+
+
+class Writer(object):
+    """Publishes the contents of a cache to a directory for sharing with
+       other processes."""
+
+    def __init__(self, cache, directory):
+        self.cache = cache
+        self.directory = directory
+
+    def _GetCurrentGeneration(self):
+        try:
+            with open(os.path.join(self.directory, CONTROL_FILE_NAME)) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return 0
+
+    def _GetFileName(self, generation):
+        return os.path.join(self.directory, "cache.%d.dat" % generation)
+
+    def _RemoveOldGenerations(self, generation):
+        """Remove the files of the generations older than those kept, except
+           for those still mapped by a running reader; these are removed by a
+           later publication instead."""
+        oldGenerations = set()
+        readerFileNames = {}
+        for name in os.listdir(self.directory):
+            match = _fileNamePattern.match(name)
+            if match is None:
+                continue
+            oldGeneration = int(match.group(1))
+            if oldGeneration > generation - GENERATIONS_TO_KEEP:
+                continue
+            if match.group(2) is None:
+                oldGenerations.add(oldGeneration)
+            else:
+                pid = int(match.group(2))
+                readerFileNames.setdefault(oldGeneration, []).append((name,
+                        pid))
+        for oldGeneration in sorted(oldGenerations):
+            inUse = False
+            for name, pid in readerFileNames.get(oldGeneration, []):
+                if _IsProcessRunning(pid):
+                    inUse = True
+                else:
+                    _RemoveFile(os.path.join(self.directory, name))
+            if inUse:
+                cx_Logging.Debug("shared cache generation %d still in use",
+                        oldGeneration)
+                continue
+            _RemoveFile(self._GetFileName(oldGeneration))
+
+    def _WriteColumn(self, f, values):
+        info = dict(kind = _GetColumnKind(values), numRows = len(values))
+        nulls = bytes(1 if v is None else 0 for v in values)
+        info["nulls"] = self._WriteData(f, nulls)
+        kind = info["kind"]
+        if kind in ("int", "float"):
+            typeCode = "q" if kind == "int" else "d"
+            data = array.array(typeCode, (0 if v is None else v \
+                    for v in values))
+            info["values"] = self._WriteData(f, data.tobytes(), True)
+        elif kind in ("decimal", "datetime", "date"):
+            if kind == "decimal":
+                places = info["places"] = _GetDecimalPlaces(values)
+                encode = lambda v: int(v.scaleb(places))
+            elif kind == "datetime":
+                encode = lambda v: (v - _epoch) // _microsecond
+            else:
+                encode = datetime.date.toordinal
+            data = array.array("q", (0 if v is None else encode(v) \
+                    for v in values))
+            info["values"] = self._WriteData(f, data.tobytes(), True)
+        elif kind == "bool":
+            data = bytes(1 if v else 0 for v in values)
+            info["values"] = self._WriteData(f, data, True)
+        else:
+            offsets = array.array("q", [0])
+            chunks = []
+            for value in values:
+                if value is None:
+                    chunk = b""
+                elif kind == "str":
+                    chunk = value.encode("utf-8")
+                else:
+                    chunk = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                chunks.append(chunk)
+                offsets.append(offsets[-1] + len(chunk))
+            info["values"] = self._WriteData(f, b"".join(chunks), True)
+            info["offsets"] = self._WriteData(f, offsets.tobytes(), True)
+        return info
+
+    def _WriteData(self, f, data, returnLength = False):
+        offset = _Align(f.tell())
+        f.write(b"\0" * (offset - f.tell()))
+        f.write(data)
+        if returnLength:
+            return (offset, len(data))
+        return offset
+
+    def _WriteIndex(self, f, path, rowIndexes):
+        groups = []
+        for key, value in path.rows.items():
+            rows = [value] if isinstance(value, ceDatabase.Row) else value
+            if rows:
+                groups.append((key, [rowIndexes[id(r)] for r in rows]))
+        numSlots = 1
+        while numSlots < len(groups) * 2:
+            numSlots *= 2
+        slots = array.array("q", [-1]) * numSlots
+        groupOffsets = array.array("q", [0])
+        postings = array.array("q")
+        mask = numSlots - 1
+        for groupIndex, (key, groupRowIndexes) in enumerate(groups):
+            slotIndex = _GetHash(key) & mask
+            while slots[slotIndex] >= 0:
+                slotIndex = (slotIndex + 1) & mask
+            slots[slotIndex] = groupIndex
+            postings.extend(groupRowIndexes)
+            groupOffsets.append(len(postings))
+        return dict(retrievalAttrNames = path.retrievalAttrNames,
+                stringRetrievalAttrNames = path.stringRetrievalAttrNames,
+                slots = self._WriteData(f, slots.tobytes(), True),
+                groupOffsets = self._WriteData(f, groupOffsets.tobytes(),
+                        True),
+                postings = self._WriteData(f, postings.tobytes(), True))
+
+    def _WriteTable(self, f, subCache, reload):
+        if not subCache.allRowsLoaded:
+            subCache.LoadAllRows(self.cache)
+        elif reload:
+            subCache.Revalidate(self.cache)
+        rows = subCache.allRows
+        rowIndexes = dict((id(r), i) for i, r in enumerate(rows))
+        rowClass = subCache.rowClass
+        info = dict(name = subCache.name, numRows = len(rows),
+                attrNames = rowClass.attrNames,
+                reprName = rowClass.reprName)
+        info["columns"] = []
+        for attrName in rowClass.attrNames:
+            values = [getattr(r, attrName) for r in rows]
+            info["columns"].append(self._WriteColumn(f, values))
+        info["indexes"] = dict((p.name, self._WriteIndex(f, p, rowIndexes)) \
+                for p in subCache.paths \
+                if not isinstance(p, ceDatabaseCache.RangePath))
+        return info
+
+    def Publish(self, reload = True):
+        """Write the rows of each subcache which loads all of its rows on
+           first load to a new generation and make it the current one,
+           reloading the rows from the database first if they are already
+           loaded and reload is true; return the number of the new
+           generation."""
+        generation = self._GetCurrentGeneration() + 1
+        fileName = self._GetFileName(generation)
+        tempFileName = fileName + ".tmp"
+        with open(tempFileName, "wb") as f:
+            f.write(b"\0" * _header.size)
+            tables = []
+            for subCache in self.cache.subCaches:
+                if subCache.loadAllRowsOnFirstLoad:
+                    tables.append(self._WriteTable(f, subCache, reload))
+            metadata = json.dumps(dict(tables = tables,
+                    schemaHash = self.cache.GetSchemaHash())).encode("utf-8")
+            metadataOffset = self._WriteData(f, metadata)
+            f.seek(0)
+            f.write(_header.pack(MAGIC, FORMAT_VERSION, metadataOffset,
+                    len(metadata)))
+        os.replace(tempFileName, fileName)
+        controlFileName = os.path.join(self.directory, CONTROL_FILE_NAME)
+        with open(controlFileName + ".tmp", "w") as f:
+            f.write(str(generation))
+        os.replace(controlFileName + ".tmp", controlFileName)
+        cx_Logging.Info("published shared cache generation %d", generation)
+        self._RemoveOldGenerations(generation)
+        return generation
@@ -14,6 +14,8 @@ modules = [
         "ceDatabaseCache",
         "ceDataSource",
         "ceModuleLoader",
+        "ceRowEngine",
+        "ceSharedCache",
         "ceWin32NamedPipes",
         "cx_ClassLibrary",
         "cx_DatabaseTable",
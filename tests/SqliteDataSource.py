@@ -0,0 +1,29 @@
+"""
+Data source used by the tests which runs queries against SQLite.
+"""
+
+import ceDataSource
+import sqlite3
+
+class DataSource(ceDataSource.ODBCDataSource):
+
+    def __init__(self, connection = None, connectionPool = None):
+        if connection is None:
+            connection = sqlite3.connect(":memory:", check_same_thread = False)
+        super(DataSource, self).__init__(connection, connectionPool)
+        self.numQueries = 0
+
+    def Execute(self, sql, args = ()):
+        self.connection.execute(sql, args)
+
+    def ExecuteMany(self, sql, rows):
+        self.connection.executemany(sql, rows)
+
+    def GetRowsDirect(self, sql, args = None, rowFactory = None):
+        self.numQueries += 1
+        cursor = self.connection.cursor()
+        cursor.execute(sql, args or [])
+        rows = cursor.fetchall()
+        if rowFactory is not None:
+            rows = [rowFactory(*r) for r in rows]
+        return rows
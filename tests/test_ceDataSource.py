@@ -0,0 +1,149 @@
+import datetime
+import decimal
+import unittest
+
+import numpy
+
+import ceDataSource
+
+class TestArrayBuilder(unittest.TestCase):
+
+    def testIntPromotedToFloatWithinChunk(self):
+        builder = ceDataSource._ArrayBuilder(["value"])
+        builder.AddRows([(1,), (2.5,)])
+        array = builder.GetResult()["value"]
+        self.assertEqual(array.dtype, numpy.float64)
+        self.assertEqual(list(array), [1.0, 2.5])
+
+    def testIntPromotedToFloatAcrossChunks(self):
+        builder = ceDataSource._ArrayBuilder(["value"])
+        builder.AddRows([(1,), (2,)])
+        builder.AddRows([(3.75,)])
+        array = builder.GetResult()["value"]
+        self.assertEqual(array.dtype, numpy.float64)
+        self.assertEqual(list(array), [1.0, 2.0, 3.75])
+
+    def testMixedTypesFallBackToObject(self):
+        builder = ceDataSource._ArrayBuilder(["value"])
+        builder.AddRows([(1,)])
+        builder.AddRows([("a",)])
+        array = builder.GetResult()["value"]
+        self.assertEqual(array.dtype, numpy.object_)
+        self.assertEqual(list(array), [1, "a"])
+
+    def testTypeInferredAfterNullChunk(self):
+        builder = ceDataSource._ArrayBuilder(["a", "b", "c"])
+        builder.AddRows([(None, None, None)])
+        builder.AddRows([(1, 2.5, datetime.date(2024, 1, 1))])
+        result = builder.GetResult()
+        self.assertEqual(result["a"].dtype, numpy.float64)
+        self.assertTrue(numpy.isnan(result["a"][0]))
+        self.assertEqual(result["a"][1], 1.0)
+        self.assertEqual(result["b"].dtype, numpy.float64)
+        self.assertEqual(result["c"].dtype, numpy.dtype("datetime64[D]"))
+        self.assertTrue(numpy.isnat(result["c"][0]))
+
+    def testStructuredPromotion(self):
+        builder = ceDataSource._ArrayBuilder(["a", "b"], structured = True)
+        builder.AddRows([(1, datetime.date(2024, 1, 1))])
+        builder.AddRows([(decimal.Decimal("1.5"),
+                datetime.datetime(2024, 1, 2, 3))])
+        result = builder.GetResult()
+        self.assertEqual(list(result["a"]), [1.0, 1.5])
+        self.assertEqual(result["b"][1],
+                numpy.datetime64(datetime.datetime(2024, 1, 2, 3)))
+
+
+class FakeVariable(object):
+
+    def __init__(self, values):
+        self.values = values
+
+    def getvalue(self, pos):
+        return self.values[pos]
+
+
+class FakeCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _GetKeys(self, numKeys):
+        keys = self.connection.nextKeys[:numKeys]
+        del self.connection.nextKeys[:numKeys]
+        return keys
+
+    def callfunc(self, name, returnType, args):
+        self.connection.calls.append((name, list(args)))
+        key, = self._GetKeys(1)
+        return key
+
+    def callproc(self, name, args):
+        self.connection.calls.append((name, list(args)))
+
+    def executemany(self, sql, rows):
+        self.connection.calls.append((sql, rows))
+
+    def setinputsizes(self, *args, **kwargs):
+        pass
+
+    def var(self, type, arraysize):
+        return FakeVariable(self._GetKeys(arraysize))
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.calls = []
+        self.nextKeys = list(range(100, 200))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class TestProcedureBatches(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = FakeConnection()
+        self.dataSource = ceDataSource.OracleDataSource(self.connection)
+        self.transaction = ceDataSource.Transaction()
+
+    def testConsecutiveCallsBatched(self):
+        items = [self.transaction.AddItem(procedureName = "pkg.Create",
+                args = ["N%d" % i], returnType = int) for i in range(3)]
+        self.transaction.AddItem(procedureName = "pkg.Remove", args = [5])
+        self.dataSource.CommitTransaction(self.transaction)
+        self.assertEqual(self.connection.calls, [
+                ("begin :r := pkg.Create(:a1); end;",
+                        [dict(a1 = "N%d" % i, r = None) for i in range(3)]),
+                ("pkg.Remove", [5])])
+        self.assertEqual([i.generatedKey for i in items], [100, 101, 102])
+
+    def testReferencedItemEndsBatch(self):
+        parent = self.transaction.AddItem(procedureName = "pkg.Create",
+                args = ["P"], returnType = int)
+        items = []
+        for referencedItem in (parent, None, parent):
+            referencedItem = referencedItem or items[-1]
+            item = self.transaction.AddItem(procedureName = "pkg.CreateChild",
+                    args = [None, "C%d" % len(items)], returnType = int,
+                    referencedItems = [referencedItem], fkArgs = [0])
+            items.append(item)
+        self.dataSource.CommitTransaction(self.transaction)
+        sql = "begin :r := pkg.CreateChild(:a1, :a2); end;"
+        self.assertEqual(self.connection.calls, [
+                ("pkg.Create", ["P"]),
+                ("pkg.CreateChild", [100, "C0"]),
+                (sql, [dict(a1 = 101, a2 = "C1", r = None),
+                        dict(a1 = 100, a2 = "C2", r = None)])])
+        self.assertEqual([i.generatedKey for i in items], [101, 102, 103])
+
+
+if __name__ == "__main__":
+    unittest.main()
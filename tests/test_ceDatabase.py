@@ -0,0 +1,344 @@
+import ceDatabase
+import ceDataSource
+import numpy
+import sqlite3
+import unittest
+import unittest.mock
+
+import SqliteDataSource
+
+class Document(ceDatabase.Row):
+    tableName = "Documents"
+    attrNames = "id name body"
+    pkAttrNames = "id"
+    deferredAttrNames = "body"
+
+
+class FailingDataSource(SqliteDataSource.DataSource):
+    fail = False
+
+    def GetRowsDirect(self, sql, args = None, rowFactory = None):
+        if self.fail:
+            raise sqlite3.OperationalError("connection lost")
+        return super(FailingDataSource, self).GetRowsDirect(sql, args,
+                rowFactory)
+
+
+class TestDeferredLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = FailingDataSource()
+        self.dataSource.Execute("create table Documents (id integer "
+                "primary key, name text, body text)")
+        self.dataSource.ExecuteMany("insert into Documents values (?, ?, ?)",
+                [(i, "Doc %d" % i, "Body %d" % i) for i in range(5)])
+
+    def testLoadedInOneQuery(self):
+        rows = Document.GetRows(self.dataSource)
+        numQueries = self.dataSource.numQueries
+        self.assertEqual([r.body for r in rows],
+                ["Body %d" % i for i in range(5)])
+        self.assertEqual(self.dataSource.numQueries, numQueries + 1)
+
+    def testFailedLoadIsRetried(self):
+        rows = Document.GetRows(self.dataSource)
+        self.dataSource.fail = True
+        self.assertRaises(sqlite3.OperationalError, getattr, rows[2], "body")
+        self.dataSource.fail = False
+        self.assertEqual(rows[2].body, "Body 2")
+        self.assertEqual(rows[4].body, "Body 4")
+
+
+class OrderLine(ceDatabase.Row):
+    tableName = "OrderLines"
+    attrNames = "orderId lineNo description"
+    pkAttrNames = "orderId lineNo"
+    deferredAttrNames = "description"
+
+
+class TestDeferredLoadingByCompositeKey(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SqliteDataSource.DataSource()
+        self.dataSource.Execute("create table OrderLines (orderId integer, "
+                "lineNo integer, description text)")
+        self.dataSource.ExecuteMany("insert into OrderLines "
+                "values (?, ?, ?)", [(o, n, "Line %d.%d" % (o, n)) \
+                        for o in range(10) for n in range(3)])
+
+    def testLoadedInOneQuery(self):
+        rows = OrderLine.GetRows(self.dataSource, lineNo__in = [0, 2])
+        numQueries = self.dataSource.numQueries
+        self.assertEqual([r.description for r in rows],
+                ["Line %d.%d" % (o, n) for o in range(10) for n in (0, 2)])
+        self.assertEqual(self.dataSource.numQueries, numQueries + 1)
+
+    def testLoadedInBatchesOfBindParameters(self):
+        self.dataSource.maxBindParameters = 4
+        rows = OrderLine.GetRows(self.dataSource, lineNo = 1)
+        numQueries = self.dataSource.numQueries
+        self.assertEqual([r.description for r in rows],
+                ["Line %d.1" % o for o in range(10)])
+        self.assertEqual(self.dataSource.numQueries, numQueries + 4)
+
+
+
+class Measurement(ceDatabase.Row):
+    tableName = "Measurements"
+    attrNames = "id reading label"
+    pkAttrNames = "id"
+
+
+class TestGetRowsParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SqliteDataSource.DataSource()
+        self.dataSource.Execute("create table Measurements (id integer, "
+                "reading real, label text)")
+        self.dataSource.ExecuteMany("insert into Measurements "
+                "values (?, ?, ?)", [(i - 7, None if i % 5 == 0 else i / 3,
+                        "M%d" % i) for i in range(23)])
+        self.dataSource.Execute("insert into Measurements "
+                "values (null, 1.5, 'Unknown')")
+
+    def _GetValues(self, rows):
+        return sorted((r.label, r.id, r.reading) for r in rows)
+
+    def _Test(self, method, attrName, **conditions):
+        expectedRows = Measurement.GetRows(self.dataSource, **conditions)
+        for numPartitions in (1, 3, 8, 40):
+            rows = Measurement.GetRowsParallel(self.dataSource,
+                    numPartitions, method, attrName, **conditions)
+            self.assertEqual(self._GetValues(rows),
+                    self._GetValues(expectedRows))
+
+    def testRangeOfIntegers(self):
+        self._Test("range", "id")
+
+    def testRangeOfFloatsWithNulls(self):
+        self._Test("range", "reading", id__gt = -3)
+
+    def testHashOfIntegers(self):
+        self._Test("hash", "id")
+
+    def testNonNumericColumnRejected(self):
+        for method in ("range", "hash"):
+            self.assertRaises(ValueError, Measurement.GetRowsParallel,
+                    self.dataSource, 4, method, "label")
+
+    def testFloatColumnRejectedForHash(self):
+        self.assertRaises(ValueError, Measurement.GetRowsParallel,
+                self.dataSource, 4, "hash", "reading")
+
+
+class TestGetArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SqliteDataSource.DataSource()
+        self.dataSource.Execute("create table Measurements (id integer, "
+                "reading real, label text)")
+        self.dataSource.ExecuteMany("insert into Measurements "
+                "values (?, ?, ?)", [(i, None if i < 3 else i / 2, "M%d" % i) \
+                        for i in range(6)])
+
+    def testTypeInferredFromFirstValue(self):
+        self.dataSource.arrayFetchSize = 2
+        arrays = Measurement.GetArrays(self.dataSource, "id reading",
+                id__gte = 1)
+        self.assertEqual(list(arrays["id"]), [1, 2, 3, 4, 5])
+        self.assertEqual(arrays["reading"].dtype, numpy.float64)
+        self.assertEqual(list(arrays["reading"][2:]), [1.5, 2.0, 2.5])
+
+    def testTypesSpecified(self):
+        array = Measurement.GetArrays(self.dataSource, "id label",
+                _structured = True, _dtypes = dict(label = "U4"))
+        self.assertEqual(array.dtype.names, ("id", "label"))
+        self.assertEqual(array["label"].dtype, numpy.dtype("U4"))
+        self.assertEqual(list(array["label"]),
+                ["M%d" % i for i in range(6)])
+
+
+class Country(ceDatabase.Row):
+    tableName = "Countries"
+    attrNames = "code name"
+    pkAttrNames = "code"
+    readOnly = True
+
+
+class CountryDataSet(ceDatabase.DataSet):
+    rowClass = Country
+
+
+class TestReadOnlyRows(unittest.TestCase):
+
+    def testEqualityWithOtherTypes(self):
+        row = Country("CA", "Canada")
+        self.assertEqual(row, Country("CA", "Other"))
+        self.assertNotEqual(row, Country("US", "Canada"))
+        self.assertNotEqual(row, "CA")
+        self.assertEqual(row, unittest.mock.ANY)
+        self.assertEqual(row.__eq__(("CA",)), NotImplemented)
+
+    def testInsertedRowIsEditable(self):
+        dataSet = CountryDataSet(SqliteDataSource.DataSource())
+        row = Country("CA", "Canada")
+        handle, insertedRow = dataSet.InsertRow(row = row)
+        self.assertFalse(insertedRow.readOnly)
+        dataSet.SetValue(handle, "name", "Kanada")
+        self.assertEqual(dataSet.rows[handle].name, "Kanada")
+        self.assertEqual(row.name, "Canada")
+
+
+class DocumentDataSet(ceDatabase.DataSet):
+    rowClass = Document
+
+
+class NamesDataSet(ceDatabase.DataSet):
+    tableName = "Documents"
+    attrNames = "id name"
+
+
+class TestRefresh(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SqliteDataSource.DataSource()
+        self.dataSource.Execute("create table Documents (id integer "
+                "primary key, name text, body text)")
+        self.dataSource.ExecuteMany("insert into Documents values (?, ?, ?)",
+                [(i, "Doc %d" % i, "Body %d" % i) for i in range(3)])
+
+    def testMergedByPrimaryKey(self):
+        dataSet = DocumentDataSet(self.dataSource)
+        dataSet.Retrieve()
+        self.dataSource.Execute("update Documents set name = 'New' "
+                "where id = 1")
+        self.dataSource.Execute("delete from Documents where id = 2")
+        self.dataSource.Execute("insert into Documents values (3, 'Doc 3', "
+                "'Body 3')")
+        changes = dataSet.Refresh()
+        self.assertEqual(changes.updatedHandles, [1])
+        self.assertEqual(changes.deletedHandles, [2])
+        self.assertEqual(changes.insertedHandles, [3])
+        self.assertEqual(dataSet.rows[1].name, "New")
+
+    def testDeferredAttributesNotLoaded(self):
+        dataSet = DocumentDataSet(self.dataSource)
+        dataSet.Retrieve()
+        numQueries = self.dataSource.numQueries
+        changes = dataSet.Refresh()
+        self.assertFalse(changes)
+        self.assertEqual(self.dataSource.numQueries, numQueries + 1)
+
+    def testWithoutPrimaryKey(self):
+        dataSet = NamesDataSet(self.dataSource)
+        dataSet.Retrieve()
+        self.dataSource.Execute("delete from Documents where id = 0")
+        self.dataSource.Execute("insert into Documents values (3, 'Doc 3', "
+                "'Body 3')")
+        changes = dataSet.Refresh()
+        self.assertEqual(changes.deletedHandles, [0])
+        self.assertEqual(changes.insertedHandles, [3])
+        self.assertEqual(sorted(r.id for r in dataSet.rows.values()),
+                [1, 2, 3])
+
+    def testPendingChangesWithoutPrimaryKey(self):
+        dataSet = NamesDataSet(self.dataSource)
+        dataSet.Retrieve()
+        dataSet.SetValue(0, "name", "Changed")
+        dataSet.DeleteRow(1)
+        handle, row = dataSet.InsertRow()
+        row.id = 10
+        changes = dataSet.Refresh()
+        self.assertFalse(changes)
+        self.assertTrue(dataSet.PendingChanges())
+        self.assertEqual(dataSet.rows[0].name, "Changed")
+        self.assertEqual(list(dataSet.deletedRows), [1])
+        self.assertIs(dataSet.rows[handle], row)
+        self.assertEqual(sorted(r.id for r in dataSet.rows.values()),
+                [0, 2, 10])
+
+
+
+class TestPendingChangeCounts(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSet = NamesDataSet(None)
+        self.childDataSet = self.dataSet.AddChildDataSet(NamesDataSet)
+        self.childDataSet._SetRows([NamesDataSet.rowClass(1, "One")])
+
+    def testChildChangesPropagated(self):
+        grandChildDataSet = self.childDataSet.AddChildDataSet(NamesDataSet)
+        version = self.dataSet.changeVersion
+        self.childDataSet.SetValue(0, "name", "Uno")
+        self.childDataSet.SetValue(0, "name", "Eins")
+        grandChildDataSet.InsertRow()
+        self.assertEqual(grandChildDataSet.pendingChangeCount, 1)
+        self.assertEqual(self.childDataSet.pendingChangeCount, 2)
+        self.assertEqual(self.dataSet.pendingChangeCount, 2)
+        self.assertTrue(self.dataSet.PendingChanges())
+        self.assertTrue(self.dataSet.ChangedSince(version))
+
+    def testRevertAndClearChanges(self):
+        self.childDataSet.SetValue(0, "name", "Uno")
+        self.childDataSet.RevertChanges()
+        self.assertFalse(self.dataSet.PendingChanges())
+        self.assertEqual(self.childDataSet.rows[0].name, "One")
+        self.childDataSet.DeleteRow(0)
+        self.assertTrue(self.dataSet.PendingChanges())
+        self.dataSet.ClearChanges()
+        self.assertEqual(self.dataSet.pendingChangeCount, 0)
+        self.assertEqual(self.childDataSet.pendingChangeCount, 0)
+        self.assertFalse(self.dataSet.PendingChanges())
+
+
+
+class Order(ceDatabase.Row):
+    attrNames = "orderId customerId"
+
+
+class Customer(ceDatabase.Row):
+    attrNames = "customerId"
+
+
+class OrderLineDataSet(ceDatabase.DataSet):
+    tableName = "OrderLines"
+    attrNames = "orderId lineNo description shipped"
+    pkAttrNames = "orderId lineNo"
+    charBooleanAttrNames = "shipped"
+    retrievalAttrNames = "region"
+    insertAttrNames = "customerId region orderId lineNo description shipped"
+
+
+class TestTransactionArgs(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSet = OrderLineDataSet(None, Order(7, 3))
+        self.dataSet.retrievalArgs = ("EU",)
+        self.row = OrderLineDataSet.rowClass(5, 1, "Widget", True)
+
+    def testValuesTakenFromEachSource(self):
+        transaction = ceDataSource.Transaction()
+        transaction.CreateRow(self.dataSet, self.row)
+        transaction.ModifyRow(self.dataSet, self.row, self.row)
+        transaction.RemoveRow(self.dataSet, self.row)
+        insertItem, updateItem, deleteItem = transaction.items
+        self.assertEqual(insertItem.setValues, dict(customerId = 3,
+                region = "EU", orderId = 5, lineNo = 1,
+                description = "Widget", shipped = "Y"))
+        self.assertEqual(updateItem.setValues,
+                dict(description = "Widget", shipped = "Y"))
+        self.assertEqual(updateItem.conditions, dict(orderId = 5, lineNo = 1))
+        self.assertEqual(deleteItem.conditions, dict(orderId = 5, lineNo = 1))
+
+    def testMatchesArgsFromNames(self):
+        names = OrderLineDataSet.insertAttrNames
+        for contextItem in (Order(7, 3), Customer(4)):
+            self.dataSet.contextItem = contextItem
+            self.row.shipped = not self.row.shipped
+            self.assertEqual(self.dataSet._GetArgs("insert", self.row),
+                    self.dataSet._GetArgsFromNames(names, self.row))
+        self.assertEqual(len(OrderLineDataSet.argExtractors), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,1024 @@
+import ceDatabase
+import ceDatabaseCache
+import cx_Exceptions
+import cx_Threads
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import SqliteDataSource
+
+class Code(ceDatabase.Row):
+    tableName = "Codes"
+    attrNames = "id code grp"
+    pkAttrNames = "id"
+
+
+def _CreateDataSource(name, numRows = 10):
+    """Return a data source whose connections are taken from a pool of
+       connections to a shared in-memory database populated with codes."""
+    uri = "file:%s?mode=memory&cache=shared" % name
+    connect = lambda: sqlite3.connect(uri, uri = True,
+            check_same_thread = False)
+    dataSource = SqliteDataSource.DataSource(connect(),
+            cx_Threads.ResourcePool(2, connect))
+    dataSource.Execute("create table Codes (id integer primary key, "
+            "code text, grp integer)")
+    dataSource.ExecuteMany("insert into Codes values (?, ?, ?)",
+            [(i, "C%d" % i, i % 3) for i in range(numRows)])
+    dataSource.connection.commit()
+    return dataSource
+
+
+class ExpiringCache(ceDatabaseCache.Cache):
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "codes"
+        timeToLive = 0.05
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "CodeById"
+
+
+class TestBackgroundRefresh(unittest.TestCase):
+
+    def testRefreshedOnBoundedThreadsWithOwnDataSource(self):
+        dataSource = _CreateDataSource("refresh")
+        cache = ExpiringCache(dataSource)
+        for i in range(10):
+            cache.CodeById(i)
+        numQueries = dataSource.numQueries
+        numThreads = threading.active_count()
+        time.sleep(0.1)
+        for i in range(10):
+            cache.CodeById(i)
+        self.assertLessEqual(threading.active_count(),
+                numThreads + cache.backgroundThreads)
+        cache.backgroundExecutor.shutdown(wait = True)
+        self.assertEqual(dataSource.numQueries, numQueries)
+        self.assertFalse(cache.codes.refreshesPending)
+        self.assertEqual(cache.CodeById(3).code, "C3")
+
+
+
+class GroupedCache(ceDatabaseCache.Cache):
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "codes"
+
+        class ByGroup(ceDatabaseCache.MultipleRowPath):
+            retrievalAttrNames = "grp"
+            cacheAttrName = "CodesByGroup"
+
+
+class TestRowSet(unittest.TestCase):
+
+    def testListMethods(self):
+        rowSet = ceDatabaseCache.RowSet([3, 1, 2])
+        self.assertEqual(rowSet + [4], [3, 1, 2, 4])
+        self.assertEqual([0] + rowSet, [0, 3, 1, 2])
+        self.assertEqual(rowSet.index(1), 1)
+        self.assertEqual(rowSet.count(2), 1)
+        self.assertEqual(rowSet.copy(), [3, 1, 2])
+        rowSet.sort()
+        self.assertEqual(rowSet, [1, 2, 3])
+        rowSet.insert(1, 5)
+        self.assertEqual(rowSet, [1, 5, 2, 3])
+        self.assertEqual(rowSet.pop(), 3)
+        rowSet.reverse()
+        self.assertEqual(rowSet, [2, 5, 1])
+        self.assertEqual(rowSet[1:], [5, 1])
+        rowSet.remove(5)
+        self.assertEqual(rowSet[1], 1)
+        rowSet.append(4)
+        self.assertEqual(rowSet[-1], 4)
+        rowSet.clear()
+        self.assertEqual(rowSet, [])
+
+    def testListExtendedOnAppend(self):
+        rowSet = ceDatabaseCache.RowSet(range(1000))
+        self.assertEqual(rowSet[-1], 999)
+        items = rowSet._GetList()
+        for i in range(1000, 2000):
+            rowSet.append(i)
+            self.assertEqual(rowSet[-1], i)
+        self.assertIs(rowSet._GetList(), items)
+        rowSet.remove(5)
+        self.assertEqual(rowSet[5], 6)
+
+    def testIteratedWhileAppending(self):
+        rowSet = ceDatabaseCache.RowSet()
+        done = threading.Event()
+        def Append():
+            for i in range(200000):
+                rowSet.append(i)
+                if i % 10 == 0:
+                    rowSet.remove(i)
+            done.set()
+        thread = threading.Thread(target = Append)
+        thread.daemon = True
+        thread.start()
+        while not done.is_set():
+            for item in rowSet:
+                pass
+        thread.join()
+        self.assertEqual(len(list(rowSet)), 180000)
+
+    def testCachedGroups(self):
+        dataSource = _CreateDataSource("groups")
+        cache = GroupedCache(dataSource)
+        rows = cache.CodesByGroup(1)
+        self.assertEqual([r.id for r in rows + cache.CodesByGroup(2)],
+                [1, 4, 7, 2, 5, 8])
+        rows.sort(key = lambda r: -r.id)
+        self.assertEqual([r.id for r in rows], [7, 4, 1])
+        self.assertEqual(rows.index(rows[1]), 1)
+        self.assertIsInstance(rows.copy(), list)
+
+
+class WarmedCache(ceDatabaseCache.Cache):
+    warmSubCaches = ["Codes", "Groups"]
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "codes"
+        loadAllRowsOnFirstLoad = True
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "CodeById"
+
+    class Groups(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "groups"
+
+        class ByGroup(ceDatabaseCache.MultipleRowPath):
+            retrievalAttrNames = "grp"
+            cacheAttrName = "CodesByGroup"
+
+
+class ThreadRecordingDataSource(SqliteDataSource.DataSource):
+
+    def GetRowsDirect(self, sql, args = None, rowFactory = None):
+        self.threadIds.add(threading.get_ident())
+        return super(ThreadRecordingDataSource, self).GetRowsDirect(sql,
+                args, rowFactory)
+
+
+class TestWithoutConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = ThreadRecordingDataSource()
+        self.dataSource.threadIds = set()
+        self.dataSource.Execute("create table Codes (id integer, "
+                "code text, grp integer)")
+        self.dataSource.ExecuteMany("insert into Codes values (?, ?, ?)",
+                [(i, "C%d" % i, i % 3) for i in range(10)])
+
+    def testWarmedOnOneThread(self):
+        cache = WarmedCache(self.dataSource)
+        self.assertRaises(ValueError, cache.Warm, 2)
+        self.assertEqual(list(cache.Warm()), ["Codes", "Groups"])
+        self.assertEqual(len(self.dataSource.threadIds), 1)
+        numQueries = self.dataSource.numQueries
+        self.assertEqual(cache.CodeById(4).code, "C4")
+        self.assertEqual(self.dataSource.numQueries, numQueries)
+
+    def testRowsRetrievedOnCallingThread(self):
+        rows = Code.GetRowsParallel(self.dataSource, 4,
+                partitionAttrName = "id")
+        self.assertEqual(sorted(r.id for r in rows), list(range(10)))
+        self.assertEqual(self.dataSource.threadIds,
+                set([threading.get_ident()]))
+
+
+class Employee(ceDatabase.Row):
+    tableName = "Employees"
+    attrNames = "id deptId"
+    extraAttrNames = "dept"
+    pkAttrNames = "id"
+
+
+class Department(ceDatabase.Row):
+    tableName = "Departments"
+    attrNames = "id managerId"
+    extraAttrNames = "manager"
+    pkAttrNames = "id"
+
+
+class SlowDataSource(SqliteDataSource.DataSource):
+    delays = dict(Employees = 0.1, Departments = 0.2)
+
+    def GetRowsDirect(self, sql, args = None, rowFactory = None):
+        for tableName, delay in self.delays.items():
+            if tableName in sql:
+                time.sleep(delay)
+        return super(SlowDataSource, self).GetRowsDirect(sql, args,
+                rowFactory)
+
+
+class CoalescingCache(ceDatabaseCache.Cache):
+    threadSafe = True
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "codes"
+        coalesceWindow = 0.1
+
+        class ByCode(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "code"
+            cacheAttrName = "CodeByCode"
+
+
+class TestCoalescedLoads(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SlowDataSource()
+        self.dataSource.delays = dict(Codes = 0.2)
+        self.dataSource.Execute("create table Codes (id integer, "
+                "code text, grp integer)")
+        self.dataSource.ExecuteMany("insert into Codes values (?, ?, ?)",
+                [(i, "C%d" % (i % 8), i % 3) for i in range(10)])
+        self.cache = CoalescingCache(self.dataSource)
+
+    def _LoadConcurrently(self, codes):
+        """Load the first code on its own and the others while that load is
+           running; return the result (row or exception) for each code."""
+        results = {}
+        def Load(code):
+            try:
+                results[code] = self.cache.CodeByCode(code)
+            except Exception as e:
+                results[code] = e
+        threads = [threading.Thread(target = Load, args = (c,)) \
+                for c in codes]
+        threads[0].start()
+        time.sleep(0.05)
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def testLoadWithoutWaiting(self):
+        startTime = time.monotonic()
+        self.assertEqual(self.cache.CodeByCode("C2").id, 2)
+        self.assertLess(time.monotonic() - startTime,
+                self.dataSource.delays["Codes"] + 0.05)
+
+    def testConcurrentLoadsCoalesced(self):
+        results = self._LoadConcurrently(["C2", "C3", "C4", "C5"])
+        self.assertEqual(sorted((c, r.id) for c, r in results.items()),
+                [("C2", 2), ("C3", 3), ("C4", 4), ("C5", 5)])
+        self.assertEqual(self.dataSource.numQueries, 2)
+
+    def testExceptionsRaisedForEachKey(self):
+        results = self._LoadConcurrently(["C2", "C0", "C3", "X"])
+        self.assertEqual(self.dataSource.numQueries, 2)
+        self.assertIsInstance(results["C0"], cx_Exceptions.TooManyRows)
+        self.assertEqual(results["C3"].id, 3)
+        self.assertIsInstance(results["X"], cx_Exceptions.NoDataFound)
+        self.assertRaises(cx_Exceptions.TooManyRows, self.cache.CodeByCode,
+                "C0")
+
+
+class EmployeeCache(ceDatabaseCache.Cache):
+
+    class Employees(ceDatabaseCache.SubCache):
+        rowClass = Employee
+        cacheAttrName = "employees"
+        onLoadRowExtraDirectives = "DeptById:deptId"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "EmpById"
+
+    class Departments(ceDatabaseCache.SubCache):
+        rowClass = Department
+        cacheAttrName = "departments"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "DeptById"
+
+        def SetExtraAttrValues(self, cache, row):
+            row.manager = None
+            if row.managerId is not None:
+                row.manager = cache.EmpById(row.managerId)
+
+
+class ThreadSafeEmployeeCache(EmployeeCache):
+    threadSafe = True
+
+
+class TestDirectivesAcrossSubCaches(unittest.TestCase):
+
+    def _Test(self, cacheClass):
+        dataSource = SlowDataSource()
+        dataSource.Execute("create table Employees (id integer, "
+                "deptId integer)")
+        dataSource.Execute("create table Departments (id integer, "
+                "managerId integer)")
+        dataSource.ExecuteMany("insert into Employees values (?, ?)",
+                [(1, 10), (2, 20)])
+        dataSource.ExecuteMany("insert into Departments values (?, ?)",
+                [(10, 2), (20, 1)])
+        cache = cacheClass(dataSource)
+        results = {}
+        threads = [
+                threading.Thread(target = lambda: results.setdefault("emp",
+                        cache.EmpById(1))),
+                threading.Thread(target = lambda: results.setdefault("dept",
+                        cache.DeptById(10)))
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive(), "deadlock")
+        self.assertEqual(results["emp"].dept.id, 10)
+        self.assertEqual(results["dept"].manager.id, 2)
+        self.assertEqual(cache.EmpById(2).dept.id, 20)
+        self.assertEqual(cache.DeptById(20).manager.id, 1)
+
+    def testNotThreadSafe(self):
+        self._Test(EmployeeCache)
+
+    def testThreadSafe(self):
+        self._Test(ThreadSafeEmployeeCache)
+
+    def testFailedResolutionNotCached(self):
+        dataSource = SqliteDataSource.DataSource()
+        dataSource.Execute("create table Employees (id integer, "
+                "deptId integer)")
+        dataSource.Execute("create table Departments (id integer, "
+                "managerId integer)")
+        dataSource.Execute("insert into Employees values (1, 99)")
+        cache = ThreadSafeEmployeeCache(dataSource)
+        self.assertRaises(cx_Exceptions.NoDataFound, cache.EmpById, 1)
+        numQueries = dataSource.numQueries
+        self.assertRaises(cx_Exceptions.NoDataFound, cache.EmpById, 1)
+        self.assertGreater(dataSource.numQueries, numQueries)
+        self.assertNotIn(1, cache.employees.pathsByName["ById"].rows)
+
+
+class CopyOnWriteEmployeeCache(ceDatabaseCache.Cache):
+    threadSafe = True
+
+    class Employees(ceDatabaseCache.SubCache):
+        rowClass = Employee
+        cacheAttrName = "employees"
+        onLoadRowExtraDirectives = "DeptById:deptId"
+        loadAllRowsOnFirstLoad = True
+        copyOnWrite = True
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "EmpById"
+
+    class Departments(ceDatabaseCache.SubCache):
+        rowClass = Department
+        cacheAttrName = "departments"
+        loadAllRowsOnFirstLoad = True
+        copyOnWrite = True
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "DeptById"
+
+        def SetExtraAttrValues(self, cache, row):
+            row.manager = None
+            if row.managerId is not None:
+                row.manager = cache.EmpById(row.managerId)
+
+
+class TestCopyOnWrite(unittest.TestCase):
+
+    def testGenerationPublishedOnceResolved(self):
+        dataSource = SlowDataSource()
+        dataSource.Execute("create table Employees (id integer, "
+                "deptId integer)")
+        dataSource.Execute("create table Departments (id integer, "
+                "managerId integer)")
+        dataSource.ExecuteMany("insert into Employees values (?, ?)",
+                [(1, 10), (2, 20)])
+        dataSource.ExecuteMany("insert into Departments values (?, ?)",
+                [(10, 2), (20, 1)])
+        cache = CopyOnWriteEmployeeCache(dataSource)
+        thread = threading.Thread(target = cache.EmpById, args = (1,))
+        thread.daemon = True
+        thread.start()
+        while thread.is_alive():
+            for row in cache.employees.generation.allRows:
+                self.assertIsNotNone(row.dept)
+            time.sleep(0.005)
+        emp = cache.EmpById(1)
+        self.assertIs(emp.dept, cache.DeptById(10))
+        self.assertIs(cache.DeptById(20).manager, emp)
+
+
+class Rate(ceDatabase.Row):
+    tableName = "Rates"
+    attrNames = "currency rateDate rate"
+    pkAttrNames = "currency rateDate"
+
+
+class RateCache(ceDatabaseCache.Cache):
+
+    class Rates(ceDatabaseCache.SubCache):
+        rowClass = Rate
+        cacheAttrName = "rates"
+        loadAllRowsOnFirstLoad = True
+
+        class ByCurrencyAndDate(ceDatabaseCache.RangePath):
+            retrievalAttrNames = "currency rateDate"
+            cacheAttrName = "RatesByCurrencyAndDate"
+
+
+class ThreadSafeRateCache(ceDatabaseCache.Cache):
+    threadSafe = True
+
+    class Rates(ceDatabaseCache.SubCache):
+        rowClass = Rate
+        cacheAttrName = "rates"
+        loadAllRowsOnFirstLoad = True
+
+        class ByCurrencyAndDate(ceDatabaseCache.RangePath):
+            retrievalAttrNames = "currency rateDate"
+            cacheAttrName = "RatesByCurrencyAndDate"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "currency rateDate"
+            cacheAttrName = "RateById"
+
+
+def _CreateRateCache(cacheClass = RateCache):
+    dataSource = SqliteDataSource.DataSource()
+    dataSource.Execute("create table Rates (currency text, rateDate text, "
+            "rate real)")
+    dataSource.ExecuteMany("insert into Rates values (?, ?, ?)",
+            [(c, "2024-03-%02d" % d, d / 10) for c in ("CAD", "GBP", "USD") \
+                    for d in (1, 2, 3)])
+    return cacheClass(dataSource)
+
+
+class TestRangePath(unittest.TestCase):
+
+    def _GetKeys(self, rows):
+        return [(r.currency, r.rateDate) for r in rows]
+
+    def testPartialUpperBound(self):
+        cache = _CreateRateCache()
+        rows = cache.RatesByCurrencyAndDate(lower = ("CAD", "2024-03-03"),
+                upper = ("GBP",))
+        self.assertEqual(self._GetKeys(rows), [("CAD", "2024-03-03"),
+                ("GBP", "2024-03-01"), ("GBP", "2024-03-02"),
+                ("GBP", "2024-03-03")])
+        rows = cache.RatesByCurrencyAndDate(lower = ("GBP",),
+                upper = ("GBP",))
+        self.assertEqual(len(rows), 3)
+        rows = cache.RatesByCurrencyAndDate(upper = ("GBP", "2024-03-02"),
+                limit = 1, descending = True)
+        self.assertEqual(self._GetKeys(rows), [("GBP", "2024-03-02")])
+
+    def testConcurrentSearches(self):
+        cache = _CreateRateCache(ThreadSafeRateCache)
+        cache.RatesByCurrencyAndDate()
+        done = threading.Event()
+        errors = []
+        def Search():
+            while not done.is_set():
+                try:
+                    keys = self._GetKeys(cache.RatesByCurrencyAndDate(
+                            prefix = ("EUR",)))
+                except Exception as e:
+                    errors.append(e)
+                    return
+                if keys != sorted(set(keys)) \
+                        or any(k[0] != "EUR" for k in keys):
+                    errors.append(keys)
+                    return
+        threads = [threading.Thread(target = Search) for i in range(4)]
+        switchInterval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for i in range(500):
+                row = Rate("EUR", "2024-%04d" % i, 1.0)
+                cache.rates.UpdateRow(cache, row)
+            for i in range(0, 500, 2):
+                row = Rate("EUR", "2024-%04d" % i, 1.0)
+                cache.rates.RemoveRow(cache, row)
+        finally:
+            done.set()
+            sys.setswitchinterval(switchInterval)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        rows = cache.RatesByCurrencyAndDate(prefix = ("EUR",))
+        self.assertEqual(len(rows), 250)
+
+    def testSortedByWriters(self):
+        cache = _CreateRateCache(ThreadSafeRateCache)
+        cache.RatesByCurrencyAndDate()
+        index = cache.rates.pathsByName["ByCurrencyAndDate"].rows
+        cache.rates.UpdateRow(cache, Rate("EUR", "2024-03-01", 1.0))
+        self.assertTrue(index.IsSorted())
+        entries = index.entries
+        index.Add(("EUR", "2024-03-02"), Rate("EUR", "2024-03-02", 1.0))
+        rows = cache.RatesByCurrencyAndDate(prefix = ("EUR",))
+        self.assertEqual(len(rows), 1)
+        self.assertIs(index.entries, entries)
+        index.Sort()
+        rows = cache.RatesByCurrencyAndDate(prefix = ("EUR",))
+        self.assertEqual(len(rows), 2)
+
+    def testStatistics(self):
+        cache = _CreateRateCache()
+        for loadRows in (False, True):
+            if loadRows:
+                cache.RatesByCurrencyAndDate()
+            report = cache.GetStatistics()["Rates"]
+            entries = report["paths"]["ByCurrencyAndDate"]["entries"]
+            self.assertEqual(entries, 9 if loadRows else 0)
+            for exact in (False, True):
+                memory = cache.EstimateMemory(exact)["Rates"]
+                self.assertEqual(memory["rows"] > 0, loadRows)
+            cache.LogStatistics()
+
+
+class VersionedCode(ceDatabase.Row):
+    tableName = "VersionedCodes"
+    attrNames = "id code version"
+    pkAttrNames = "id"
+
+
+class VersionedCache(ceDatabaseCache.Cache):
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = VersionedCode
+        cacheAttrName = "codes"
+        loadAllRowsOnFirstLoad = True
+        changeTrackingAttrName = "version"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "CodeById"
+
+
+class CodeDataSet(ceDatabase.DataSet):
+    tableName = "Codes"
+    attrNames = "id code grp"
+    extraAttrNames = "group"
+    pkAttrNames = "id"
+
+
+class Group(ceDatabase.Row):
+    tableName = "Groups"
+    attrNames = "id name"
+    pkAttrNames = "id"
+    readOnly = True
+
+
+class SnapshotCache(ceDatabaseCache.Cache):
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = CodeDataSet.rowClass
+        cacheAttrName = "codes"
+        onLoadRowExtraDirectives = "GroupById:grp"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "CodeById"
+
+        class ByGroup(ceDatabaseCache.MultipleRowPath):
+            retrievalAttrNames = "grp"
+            cacheAttrName = "CodesByGroup"
+
+    class Groups(ceDatabaseCache.SubCache):
+        rowClass = Group
+        cacheAttrName = "groups"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "GroupById"
+
+
+class ChangedSnapshotCache(SnapshotCache):
+
+    class Groups(ceDatabaseCache.SubCache):
+        rowClass = Group
+        cacheAttrName = "groups"
+        loadAllRowsOnFirstLoad = True
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "GroupById"
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SqliteDataSource.DataSource()
+        self.dataSource.Execute("create table Codes (id integer, "
+                "code text, grp integer)")
+        self.dataSource.Execute("create table Groups (id integer, "
+                "name text)")
+        self.dataSource.ExecuteMany("insert into Codes values (?, ?, ?)",
+                [(i, "C%d" % i, i % 2) for i in range(5)])
+        self.dataSource.ExecuteMany("insert into Groups values (?, ?)",
+                [(0, "Even"), (1, "Odd")])
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.fileName = os.path.join(self.tempDir.name, "cache.snapshot")
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def testRoundTrip(self):
+        cache = SnapshotCache(self.dataSource)
+        cache.CodesByGroup(0)
+        cache.CodeById(3)
+        cache.SaveSnapshot(self.fileName)
+        numQueries = self.dataSource.numQueries
+        cache = SnapshotCache(self.dataSource)
+        cache.LoadSnapshot(self.fileName)
+        rows = cache.CodesByGroup(0)
+        self.assertEqual([(r.id, r.code, r.group.name) for r in rows],
+                [(0, "C0", "Even"), (2, "C2", "Even"), (4, "C4", "Even")])
+        self.assertIs(rows[0].__class__, CodeDataSet.rowClass)
+        self.assertIs(cache.CodeById(2), rows[1])
+        self.assertIs(rows[0].group, cache.GroupById(0))
+        self.assertEqual(cache.CodeById(3).group.name, "Odd")
+        self.assertEqual(self.dataSource.numQueries, numQueries)
+
+    def testMismatchedDefinition(self):
+        cache = SnapshotCache(self.dataSource)
+        cache.CodeById(1)
+        cache.SaveSnapshot(self.fileName)
+        cache = ChangedSnapshotCache(self.dataSource)
+        self.assertRaises(ceDatabaseCache.SnapshotMismatch,
+                cache.LoadSnapshot, self.fileName)
+
+    def testArbitraryObjectsRejected(self):
+        with open(self.fileName, "wb") as f:
+            pickle.dump(os.getcwd, f)
+        cache = SnapshotCache(self.dataSource)
+        self.assertRaises(pickle.UnpicklingError, cache.LoadSnapshot,
+                self.fileName)
+
+    def testDeltaRefreshAfterLoad(self):
+        dataSource = SqliteDataSource.DataSource()
+        dataSource.Execute("create table VersionedCodes (id integer, "
+                "code text, version integer)")
+        dataSource.ExecuteMany("insert into VersionedCodes values (?, ?, ?)",
+                [(i, "C%d" % i, i) for i in range(5)])
+        cache = VersionedCache(dataSource)
+        self.assertEqual(cache.CodeById(2).code, "C2")
+        with tempfile.TemporaryDirectory() as dirName:
+            fileName = os.path.join(dirName, "cache.snapshot")
+            cache.SaveSnapshot(fileName)
+            dataSource.Execute("update VersionedCodes set code = 'New', "
+                    "version = 5 where id = 2")
+            cache = VersionedCache(dataSource)
+            cache.LoadSnapshot(fileName)
+        self.assertEqual(cache.CodeById(2).code, "C2")
+        self.assertEqual(cache.RefreshDelta("Codes"), 1)
+        self.assertEqual(cache.CodeById(2).code, "New")
+        self.assertEqual(cache.RefreshDelta("Codes"), 0)
+
+
+class GroupedItem(ceDatabase.Row):
+    tableName = "GroupedItems"
+    attrNames = "id grp name"
+    pkAttrNames = "id"
+
+
+class ItemChange(ceDatabase.Row):
+    tableName = "ItemChanges"
+    attrNames = "seq id operation"
+    pkAttrNames = "seq"
+
+
+class GroupedItemCache(ceDatabaseCache.Cache):
+
+    class Items(ceDatabaseCache.SubCache):
+        rowClass = GroupedItem
+        cacheAttrName = "items"
+        changeLogRowClass = ItemChange
+        changeLogSequenceAttrName = "seq"
+        changeLogOperationAttrName = "operation"
+
+        class ByGroup(ceDatabaseCache.MultipleRowPath):
+            retrievalAttrNames = "grp"
+            cacheAttrName = "ItemsByGroup"
+
+
+class TestDeltaRefresh(unittest.TestCase):
+
+    def testMultipleRowPathsOnly(self):
+        dataSource = SqliteDataSource.DataSource()
+        dataSource.Execute("create table GroupedItems (id integer, "
+                "grp integer, name text)")
+        dataSource.Execute("create table ItemChanges (seq integer, "
+                "id integer, operation text)")
+        dataSource.ExecuteMany("insert into GroupedItems values (?, ?, ?)",
+                [(i, i % 2, "Item %d" % i) for i in range(6)])
+        dataSource.Execute("insert into ItemChanges values (0, 0, 'I')")
+        cache = GroupedItemCache(dataSource)
+        self.assertEqual([r.id for r in cache.ItemsByGroup(0)], [0, 2, 4])
+        dataSource.Execute("update GroupedItems set name = 'New' "
+                "where id = 2")
+        dataSource.Execute("delete from GroupedItems where id = 4")
+        dataSource.ExecuteMany("insert into ItemChanges values (?, ?, ?)",
+                [(1, 2, "U"), (2, 4, "D")])
+        self.assertEqual(cache.RefreshDelta("Items"), 2)
+        rows = cache.ItemsByGroup(0)
+        self.assertEqual([r.id for r in rows], [0, 2])
+        self.assertEqual(rows[1].name, "New")
+
+
+
+class BoundedCache(ceDatabaseCache.Cache):
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "codes"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "CodeById"
+            maxEntries = 3
+
+        class ByCode(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "code"
+            cacheAttrName = "CodeByCode"
+
+        class ByGroup(ceDatabaseCache.MultipleRowPath):
+            retrievalAttrNames = "grp"
+            cacheAttrName = "CodesByGroup"
+            maxEntries = 1
+
+
+class TestBoundedPaths(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SqliteDataSource.DataSource()
+        self.dataSource.Execute("create table Codes (id integer primary key, "
+                "code text, grp integer)")
+        self.dataSource.ExecuteMany("insert into Codes values (?, ?, ?)",
+                [(i, "C%d" % i, i % 3) for i in range(10)])
+        self.cache = BoundedCache(self.dataSource)
+
+    def testLeastRecentlyUsedEvicted(self):
+        for key in range(4):
+            self.cache.CodeById(key)
+        self.cache.CodeById(1)
+        self.cache.CodeById(4)
+        self.assertEqual(list(self.cache.codes.rowsByById), [3, 1, 4])
+        self.assertNotIn("C2", self.cache.codes.rowsByByCode)
+        numQueries = self.dataSource.numQueries
+        self.assertEqual(self.cache.CodeById(2).code, "C2")
+        self.assertEqual(self.dataSource.numQueries, numQueries + 1)
+        self.assertEqual(list(self.cache.codes.rowsByById), [1, 4, 2])
+        statistics = self.cache.GetStatistics()["Codes"]["paths"]
+        self.assertEqual(statistics["ById"]["evictions"], 3)
+
+    def testRowsOfEvictedGroupsEvicted(self):
+        self.assertEqual(len(self.cache.CodesByGroup(1)), 3)
+        self.cache.CodeById(1)
+        self.assertEqual(len(self.cache.CodesByGroup(2)), 3)
+        self.assertEqual(list(self.cache.codes.rowsByByGroup), [2])
+        self.assertNotIn(1, self.cache.codes.rowsByById)
+        self.assertNotIn("C4", self.cache.codes.rowsByByCode)
+
+
+
+class LookupCache(ceDatabaseCache.Cache):
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "codes"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "CodeById"
+
+        class ByGroup(ceDatabaseCache.MultipleRowPath):
+            retrievalAttrNames = "grp"
+            cacheAttrName = "CodesByGroup"
+
+
+class TestLoadMany(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SqliteDataSource.DataSource()
+        self.dataSource.Execute("create table Codes (id integer primary key, "
+                "code text, grp integer)")
+        self.dataSource.ExecuteMany("insert into Codes values (?, ?, ?)",
+                [(i, "C%d" % i, i % 3) for i in range(10)])
+        self.cache = LookupCache(self.dataSource)
+
+    def testSingleRowPath(self):
+        self.cache.CodeById(3)
+        numQueries = self.dataSource.numQueries
+        rows = self.cache.CodeByIdMany([3, 4, 4, 99, None, 7])
+        self.assertEqual(self.dataSource.numQueries, numQueries + 1)
+        self.assertEqual([r and r.code for r in rows],
+                ["C3", "C4", "C4", None, None, "C7"])
+        self.assertIs(rows[1], self.cache.CodeById(4))
+        self.cache.CodeByIdMany([4, 7])
+        self.assertEqual(self.dataSource.numQueries, numQueries + 1)
+
+    def testMultipleRowPath(self):
+        numQueries = self.dataSource.numQueries
+        groups = self.cache.CodesByGroupMany([1, 2, 5])
+        self.assertEqual(self.dataSource.numQueries, numQueries + 1)
+        self.assertEqual([[r.id for r in g] for g in groups],
+                [[1, 4, 7], [2, 5, 8], []])
+        self.assertIs(groups[0], self.cache.CodesByGroup(1))
+        self.assertEqual(self.dataSource.numQueries, numQueries + 1)
+
+
+
+class NegativeCache(ceDatabaseCache.Cache):
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "codes"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "CodeById"
+            cacheMisses = True
+            missTimeToLive = 0.1
+            maxMisses = 3
+
+
+class TestCachedMisses(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SqliteDataSource.DataSource()
+        self.dataSource.Execute("create table Codes (id integer primary key, "
+                "code text, grp integer)")
+        self.dataSource.ExecuteMany("insert into Codes values (?, ?, ?)",
+                [(i, "C%d" % i, i % 3) for i in range(10)])
+        self.cache = NegativeCache(self.dataSource)
+        self.misses = self.cache.codes.pathsByName["ById"].misses
+
+    def testMissQueriedOnce(self):
+        numQueries = self.dataSource.numQueries
+        for i in range(3):
+            self.assertRaises(cx_Exceptions.NoDataFound,
+                    self.cache.CodeById, 100)
+        self.assertEqual(self.cache.CodeByIdMany([100, 101]), [None, None])
+        self.assertEqual(self.dataSource.numQueries, numQueries + 2)
+        self.assertEqual(list(self.misses), [100, 101])
+
+    def testMissesBoundedAndExpired(self):
+        self.cache.CodeByIdMany([100, 101, 102, 103])
+        self.assertEqual(list(self.misses), [101, 102, 103])
+        numQueries = self.dataSource.numQueries
+        time.sleep(0.12)
+        self.assertIsNone(self.cache.CodeByIdMany([101])[0])
+        self.assertEqual(self.dataSource.numQueries, numQueries + 1)
+
+    def testMissForgottenWhenRowAdded(self):
+        self.cache.CodeByIdMany([100, 101])
+        self.cache.codes.UpdateRow(self.cache, Code(100, "New", 1))
+        self.assertEqual(list(self.misses), [101])
+        self.assertEqual(self.cache.CodeById(100).code, "New")
+
+
+
+class StatisticsCache(ceDatabaseCache.Cache):
+    collectStatistics = True
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "codes"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "CodeById"
+
+    class AllCodes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "allCodes"
+        loadAllRowsOnFirstLoad = True
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "AllCodeById"
+
+
+class UncountedCache(ceDatabaseCache.Cache):
+
+    class Codes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "codes"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "CodeById"
+
+    class AllCodes(ceDatabaseCache.SubCache):
+        rowClass = Code
+        cacheAttrName = "allCodes"
+        loadAllRowsOnFirstLoad = True
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "AllCodeById"
+
+
+class TestStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SqliteDataSource.DataSource()
+        self.dataSource.Execute("create table Codes (id integer primary key, "
+                "code text, grp integer)")
+        self.dataSource.ExecuteMany("insert into Codes values (?, ?, ?)",
+                [(i, "C%d" % i, i % 3) for i in range(10)])
+
+    def _GetStatistics(self, cacheClass):
+        cache = cacheClass(self.dataSource)
+        for key in range(3):
+            cache.CodeById(key)
+            cache.CodeById(key)
+            cache.AllCodeById(key)
+        return cache.GetStatistics()
+
+    def testCollected(self):
+        statistics = self._GetStatistics(StatisticsCache)
+        report = statistics["Codes"]["paths"]["ById"]
+        self.assertEqual((report["hits"], report["misses"], report["loads"],
+                report["rowsLoaded"], report["entries"]), (3, 3, 3, 3, 3))
+        self.assertEqual(report["hitRatio"], 0.5)
+        self.assertEqual(sum(n for b, n in report["loadLatencies"]), 3)
+        report = statistics["AllCodes"]
+        self.assertEqual((report["loads"], report["rowsLoaded"]), (1, 10))
+        self.assertEqual(report["paths"]["ById"]["hits"], 2)
+
+    def testNotCollected(self):
+        statistics = self._GetStatistics(UncountedCache)
+        report = statistics["Codes"]["paths"]["ById"]
+        self.assertEqual((report["hits"], report["misses"], report["loads"],
+                report["entries"]), (0, 0, 0, 3))
+        self.assertEqual(statistics["AllCodes"]["numRows"], 10)
+
+
+
+class BulkEmployeeCache(ceDatabaseCache.Cache):
+
+    class Employees(ceDatabaseCache.SubCache):
+        rowClass = Employee
+        cacheAttrName = "employees"
+        loadAllRowsOnFirstLoad = True
+        allRowsMethodCacheAttrName = "Employees"
+        onLoadRowExtraDirectives = "DeptById:deptId"
+
+    class Departments(ceDatabaseCache.SubCache):
+        rowClass = Department
+        cacheAttrName = "departments"
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "DeptById"
+            batchSize = 2
+
+
+class TestBulkResolution(unittest.TestCase):
+
+    def setUp(self):
+        self.dataSource = SqliteDataSource.DataSource()
+        self.dataSource.Execute("create table Employees (id integer, "
+                "deptId integer)")
+        self.dataSource.Execute("create table Departments (id integer, "
+                "managerId integer)")
+        self.dataSource.ExecuteMany("insert into Employees values (?, ?)",
+                [(i, i % 3 * 10) for i in range(9)])
+        self.dataSource.ExecuteMany("insert into Departments values (?, ?)",
+                [(0, None), (10, None), (20, None)])
+        self.cache = BulkEmployeeCache(self.dataSource)
+
+    def testResolvedInBatches(self):
+        employees = self.cache.Employees()
+        self.assertEqual(self.dataSource.numQueries, 3)
+        self.assertEqual([e.dept.id for e in employees], [0, 10, 20] * 3)
+        self.assertIs(employees[3].dept, self.cache.DeptById(0))
+        self.assertEqual(self.dataSource.numQueries, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
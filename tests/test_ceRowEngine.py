@@ -0,0 +1,108 @@
+import math
+import unittest
+
+import numpy
+
+import ceRowEngine
+
+def _FromColumns(columns, attrNames):
+    """Return the columns as a list of tuples with nulls converted to None."""
+    values = []
+    for name in attrNames:
+        column = [None if isinstance(v, float) and math.isnan(v) else v \
+                for v in columns[name].tolist()]
+        values.append(column)
+    return list(zip(*values))
+
+
+def _FromRows(rows, attrNames):
+    return [tuple(getattr(r, n) for n in attrNames) for r in rows]
+
+
+class TestColumnarParity(unittest.TestCase):
+
+    def setUp(self):
+        self.rowClass = ceRowEngine.GetRowClass("region amount name")
+        self.data = [
+                ("North", 1.5, "a"),
+                (None, 2.0, "b"),
+                ("South", None, None),
+                ("North", None, "c"),
+                (None, 4.0, None),
+                ("South", None, None)
+        ]
+        self.rows = [self.rowClass(*v) for v in self.data]
+        self.columns = ceRowEngine.Columns(
+                region = numpy.array([v[0] for v in self.data],
+                        dtype = object),
+                amount = numpy.array([numpy.nan if v[1] is None else v[1] \
+                        for v in self.data]),
+                name = numpy.array([v[2] for v in self.data], dtype = object))
+
+    def testGroupByWithNulls(self):
+        aggregates = dict(count = ("count", None), total = ("sum", "amount"),
+                low = ("min", "amount"), high = ("max", "amount"),
+                first = ("min", "name"))
+        attrNames = ["region"] + list(aggregates)
+        rows = ceRowEngine.GroupBy(self.rows, "region", **aggregates)
+        columns = ceRowEngine.GroupBy(self.columns, "region", **aggregates)
+        self.assertEqual(_FromColumns(columns, attrNames),
+                _FromRows(rows, attrNames))
+        self.assertEqual(_FromRows(rows, attrNames), [
+                ("North", 2, 1.5, 1.5, 1.5, "a"),
+                (None, 2, 6.0, 2.0, 4.0, "b"),
+                ("South", 2, None, None, None, None)])
+
+    def testHashJoinWithNullKeys(self):
+        otherClass = ceRowEngine.GetRowClass("region manager")
+        otherData = [("North", "Ann"), (None, "Bob"), ("East", "Cid")]
+        otherRows = [otherClass(*v) for v in otherData]
+        otherColumns = ceRowEngine.Columns(
+                region = numpy.array([v[0] for v in otherData],
+                        dtype = object),
+                manager = numpy.array([v[1] for v in otherData],
+                        dtype = object))
+        attrNames = ["region", "name", "manager"]
+        for joinType in ("inner", "left"):
+            rows = ceRowEngine.HashJoin(self.rows, otherRows, "region",
+                    attrNames = attrNames, joinType = joinType)
+            columns = ceRowEngine.HashJoin(self.columns, otherColumns,
+                    "region", attrNames = attrNames, joinType = joinType)
+            self.assertEqual(_FromColumns(columns, attrNames),
+                    _FromRows(rows, attrNames))
+
+
+class TestDictionaryOfRows(unittest.TestCase):
+
+    def setUp(self):
+        rowClass = ceRowEngine.GetRowClass("id region amount")
+        self.rows = dict((i, rowClass(i, r, a)) for i, (r, a) in \
+                enumerate([("North", 1.5), ("South", 2.0), ("North", 4.0)]))
+
+    def testGroupBy(self):
+        rows = ceRowEngine.GroupBy(self.rows, "region",
+                total = ("sum", "amount"))
+        self.assertEqual(_FromRows(rows, ["region", "total"]),
+                [("North", 5.5), ("South", 2.0)])
+
+    def testHashJoin(self):
+        otherClass = ceRowEngine.GetRowClass("region manager")
+        otherRows = { 10 : otherClass("North", "Ann") }
+        rows = ceRowEngine.HashJoin(self.rows, otherRows, "region")
+        self.assertEqual(_FromRows(rows, ["id", "manager"]),
+                [(0, "Ann"), (2, "Ann")])
+
+    def testProject(self):
+        rows = ceRowEngine.Project(self.rows, "id")
+        self.assertEqual(_FromRows(rows, ["id"]), [(0,), (1,), (2,)])
+
+    def testColumnarResults(self):
+        columns = ceRowEngine.Columns(id = numpy.array([1, 2]))
+        result = ceRowEngine.Project(columns, "id")
+        self.assertIsInstance(result, ceRowEngine.Columns)
+        self.assertRaises(TypeError, ceRowEngine.HashJoin, columns,
+                list(self.rows.values()), "id")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import ceDataSource
+import ceDatabase
+import ceDatabaseCache
+import ceSharedCache
+import datetime
+import decimal
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+
+class Price(ceDatabase.Row):
+    tableName = "Prices"
+    attrNames = "id amount asOf day"
+    pkAttrNames = "id"
+
+
+class PriceDataSource(ceDataSource.DataSource):
+
+    def GetRows(self, _tableName, _columnNames, _rowFactory = None,
+            **_conditions):
+        return [_rowFactory(i, decimal.Decimal(i) / 4,
+                datetime.datetime(2024, 3, 1, 12, 30, i),
+                datetime.date(2024, 3, i + 1)) for i in range(1, 6)]
+
+
+class PriceCache(ceDatabaseCache.Cache):
+
+    class Prices(ceDatabaseCache.SubCache):
+        rowClass = Price
+        cacheAttrName = "prices"
+        loadAllRowsOnFirstLoad = True
+
+        class ById(ceDatabaseCache.SingleRowPath):
+            retrievalAttrNames = "id"
+            cacheAttrName = "PriceById"
+
+        class ByAmount(ceDatabaseCache.MultipleRowPath):
+            retrievalAttrNames = "amount"
+            cacheAttrName = "PricesByAmount"
+
+
+class TestSharedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        cache = PriceCache(PriceDataSource())
+        self.writer = ceSharedCache.Writer(cache, self.directory)
+        self.writer.Publish(reload = False)
+
+    def testNumericKeys(self):
+        sharedCache = ceSharedCache.SharedCache(self.directory, PriceCache)
+        for key in (2, 2.0, decimal.Decimal("2"), decimal.Decimal("2.00")):
+            self.assertEqual(sharedCache.PriceById(key).id, 2)
+        self.assertEqual(len(sharedCache.PricesByAmount(1)), 1)
+        self.assertEqual(len(sharedCache.PricesByAmount(0.25)), 1)
+
+    def testFixedWidthColumns(self):
+        sharedCache = ceSharedCache.SharedCache(self.directory, PriceCache)
+        table = sharedCache.GetTable("Prices")
+        self.assertEqual(table.columns["amount"].kind, "decimal")
+        self.assertEqual(table.columns["asOf"].kind, "datetime")
+        self.assertEqual(table.columns["day"].kind, "date")
+        row = sharedCache.PriceById(3)
+        self.assertEqual(row.amount, decimal.Decimal("0.75"))
+        self.assertEqual(row.asOf, datetime.datetime(2024, 3, 1, 12, 30, 3))
+        self.assertEqual(row.day, datetime.date(2024, 3, 4))
+
+    def testMappedGenerationsAreKept(self):
+        fileName = os.path.join(self.directory, "cache.1.dat")
+        sharedCache = ceSharedCache.SharedCache(self.directory, PriceCache)
+        row = sharedCache.PriceById(1)
+        for i in range(ceSharedCache.GENERATIONS_TO_KEEP + 1):
+            self.writer.Publish(reload = False)
+        self.assertTrue(os.path.exists(fileName))
+        self.assertEqual(row.id, 1)
+        del sharedCache, row
+        gc.collect()
+        self.writer.Publish(reload = False)
+        self.assertFalse(os.path.exists(fileName))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                ["cache.4.dat", "cache.5.dat", "current"])
+
+
+if __name__ == "__main__":
+    unittest.main()